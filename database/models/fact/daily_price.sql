@@ -0,0 +1,102 @@
+{{ config(unique_key=['symbol', 'date']) }}
+
+-- Daily prices with a close adjusted for every split and dividend that came after the bar.
+--
+-- yfinance returns prices already adjusted for the corporate actions known when they were fetched, so an
+-- action only needs applying to the bars fetched before its date. Its factor is applied through a running
+-- sum of log factors per symbol, which avoids joining every bar to every later action.
+--
+-- An incremental run processes the rows inserted since the last run. A symbol with a new split or
+-- dividend among them has its whole history reprocessed, as its earlier adjusted closes change.
+
+with
+
+{% if is_incremental() %}
+
+new_rows as (
+    select *
+    from {{ source('raw_data', 'stock_price') }}
+    where inserted_at > (select coalesce(max(inserted_at), '1900-01-01') from {{ this }})
+),
+
+restated_symbols as (
+    select distinct symbol
+    from new_rows
+    where dividends <> 0 or stock_splits not in (0, 1)
+),
+
+prices as (
+    select * from new_rows
+    where symbol not in (select symbol from restated_symbols)
+
+    union all
+
+    select s.*
+    from {{ source('raw_data', 'stock_price') }} s
+    join restated_symbols r on r.symbol = s.symbol
+),
+
+{% else %}
+
+prices as (
+    select * from {{ source('raw_data', 'stock_price') }}
+),
+
+{% endif %}
+
+with_previous_close as (
+    select
+        *,
+        lag(close_price) over (partition by symbol order by date) as previous_close
+    from prices
+),
+
+actions as (
+    select
+        symbol,
+        date,
+        ln(
+            case when stock_splits > 0 then 1 / stock_splits else 1 end
+            * case when dividends > 0 and previous_close > dividends then 1 - dividends / previous_close else 1 end
+        ) as log_factor
+    from with_previous_close
+    where dividends > 0 or (stock_splits > 0 and stock_splits <> 1)
+),
+
+-- Bars and actions in one stream per symbol. A bar is positioned at the later of its date and the day it was
+-- fetched, and an action at its date; actions sort before bars on the same day, as such a bar already has them
+stream as (
+    select symbol, date, greatest(date, cast(inserted_at as date)) as position, 1 as is_bar, 0.0 as log_factor
+    from prices
+
+    union all
+
+    select symbol, date, date as position, 0 as is_bar, log_factor
+    from actions
+),
+
+cumulative as (
+    select
+        symbol,
+        date,
+        is_bar,
+        sum(log_factor) over (partition by symbol) as total_log_factor,
+        sum(log_factor) over (partition by symbol order by position, is_bar rows unbounded preceding) as applied_log_factor
+    from stream
+)
+
+select
+    p.symbol,
+    p.date,
+    p.open_price,
+    p.high_price,
+    p.low_price,
+    p.close_price,
+    p.close_price * exp(c.total_log_factor - c.applied_log_factor) as adjusted_close,
+    p.volume,
+    p.dividends,
+    p.stock_splits,
+    p.inserted_at,
+    current_timestamp as refreshed_at
+from prices p
+join cumulative c on c.symbol = p.symbol and c.date = p.date and c.is_bar = 1
@@ -0,0 +1,21 @@
+{{ config(unique_key=['symbol', 'date']) }}
+
+-- The price target in effect on each trading day next to that day's adjusted close.
+-- An incremental run covers the bars refreshed in daily_price since the last run, including restated ones.
+
+select
+    p.symbol,
+    p.date,
+    p.adjusted_close,
+    t.low as target_low,
+    t.high as target_high,
+    t.mean as target_mean,
+    t.median as target_median,
+    t.mean / nullif(p.adjusted_close, 0) - 1 as upside_to_mean,
+    p.refreshed_at
+from {{ ref('daily_price') }} p
+join {{ ref('price_target_daily') }} t on t.symbol = p.symbol and t.date = p.date
+
+{% if is_incremental() %}
+where p.refreshed_at > (select coalesce(max(refreshed_at), '1900-01-01') from {{ this }})
+{% endif %}
@@ -0,0 +1,48 @@
+{{ config(unique_key=['symbol', 'date']) }}
+
+-- One row per symbol and day, rebuilt from the validity intervals of recommendation_history.
+-- Each interval covers valid_from up to but excluding valid_to, and the current one runs through today.
+-- Days before a symbol's first interval come from the daily snapshots written before change capture.
+-- An incremental run rebuilds from the latest day already loaded, as only the current interval can still change.
+
+select
+    h.symbol,
+    d.day::date as date,
+    h.strong_buy,
+    h.buy,
+    h.hold,
+    h.sell,
+    h.strong_sell
+from {{ source('raw_data', 'recommendation_history') }} h
+cross join lateral generate_series(
+    {% if is_incremental() %}
+    greatest(h.valid_from, (select coalesce(max(date), '1900-01-01') from {{ this }})),
+    {% else %}
+    h.valid_from,
+    {% endif %}
+    coalesce(h.valid_to, current_date + 1) - 1,
+    interval '1 day'
+) as d(day)
+{% if is_incremental() %}
+where coalesce(h.valid_to, current_date + 1) > (select coalesce(max(date), '1900-01-01') from {{ this }})
+{% endif %}
+
+union all
+
+select
+    r.symbol,
+    r.date,
+    r.strong_buy,
+    r.buy,
+    r.hold,
+    r.sell,
+    r.strong_sell
+from {{ source('raw_data', 'recommendation') }} r
+where not exists (
+    select 1
+    from {{ source('raw_data', 'recommendation_history') }} h
+    where h.symbol = r.symbol and h.valid_from <= r.date
+)
+{% if is_incremental() %}
+and r.date >= (select coalesce(max(date), '1900-01-01') from {{ this }})
+{% endif %}
@@ -0,0 +1,22 @@
+{{ config(unique_key=['symbol', 'date']) }}
+
+-- The daily analyst recommendation counts of each symbol with a score from 1 (strong buy) to 5 (strong sell),
+-- weighting each count by its grade. An incremental run recomputes from the latest day already loaded,
+-- which a same-day rerun may have changed.
+
+select
+    symbol,
+    date,
+    strong_buy,
+    buy,
+    hold,
+    sell,
+    strong_sell,
+    strong_buy + buy + hold + sell + strong_sell as analysts,
+    (1.0 * strong_buy + 2 * buy + 3 * hold + 4 * sell + 5 * strong_sell)
+        / nullif(strong_buy + buy + hold + sell + strong_sell, 0) as score
+from {{ ref('recommendation_daily') }}
+
+{% if is_incremental() %}
+where date >= (select coalesce(max(date), '1900-01-01') from {{ this }})
+{% endif %}
@@ -0,0 +1,336 @@
+
+"""
+This module contains portfolio analytics over stored prices. Prices are loaded into one wide matrix
+(dates by symbols) and every measure is computed for the whole universe at once with matrix operations,
+without looping over symbols in Python.
+
+Examples:
+    python analytics.py summary --symbols AAPL MSFT NVDA --start 2015-01-01 --output summary.csv
+    python analytics.py correlation --source cache --start 2020-01-01 --output correlation.csv
+"""
+
+import argparse
+import datetime
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+import database_actions
+import price_cache
+import price_target
+import stock_price
+
+
+logger = logging.getLogger(__name__)
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def load_prices_from_db(db_actions: database_actions.DatabaseActions, symbols: Optional[List[str]] = None,
+                        start: Optional[datetime.date] = None, end: Optional[datetime.date] = None,
+                        column: str = 'close_price') -> pd.DataFrame:
+    """
+    Loads a price column of the stock_price table in a single query.
+
+    Args:
+        db_actions (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+        symbols (List[str], optional): The symbols to load. Defaults to every symbol.
+        start (datetime.date, optional): The first date to load. Defaults to the earliest stored date.
+        end (datetime.date, optional): The exclusive end date. Defaults to the latest stored date.
+        column (str, optional): The price column. Defaults to 'close_price'.
+
+    Returns:
+        pd.DataFrame: A wide frame with one row per date and one column per symbol
+    """
+    table = stock_price.StockPrice.__table__
+    query = sqlalchemy.select(table.c.symbol, table.c.date, table.c[column])
+    if symbols is not None:
+        query = query.where(table.c.symbol.in_(symbols))
+    if start is not None:
+        query = query.where(table.c.date >= start)
+    if end is not None:
+        query = query.where(table.c.date < end)
+
+    with db_actions.get_engine().connect() as conn:
+        data = pd.read_sql(query, conn)
+    data['date'] = pd.to_datetime(data['date'])
+    return to_wide(data, 'symbol', 'date', column)
+
+
+def load_prices_from_cache(cache: Optional[price_cache.ParquetPriceCache] = None, symbols: Optional[List[str]] = None,
+                           start: Optional[datetime.date] = None, end: Optional[datetime.date] = None,
+                           column: str = 'Close') -> pd.DataFrame:
+    """
+    Loads a price column from the local Parquet price cache.
+
+    Args:
+        cache (price_cache.ParquetPriceCache, optional): The cache. Defaults to the one in PRICE_CACHE_DIR.
+        symbols (List[str], optional): The symbols to load. Defaults to every cached symbol.
+        start (datetime.date, optional): The first date to load. Defaults to the earliest cached date.
+        end (datetime.date, optional): The exclusive end date. Defaults to the latest cached date.
+        column (str, optional): The price column. Defaults to 'Close'.
+
+    Returns:
+        pd.DataFrame: A wide frame with one row per date and one column per symbol
+    """
+    cache = cache if cache is not None else price_cache.ParquetPriceCache()
+    data = cache.read(symbols, start=start, end=end, columns=[column])
+    data['Date'] = pd.to_datetime(data['Date'])
+    return to_wide(data, 'symbol', 'Date', column)
+
+
+def to_wide(data: pd.DataFrame, symbol_column: str, date_column: str, value_column: str) -> pd.DataFrame:
+    """
+    Pivots long price rows to one row per date and one column per symbol. A symbol with two rows for a date keeps the last.
+    """
+    data = data.drop_duplicates(subset=[symbol_column, date_column], keep='last')
+    wide = data.pivot(index=date_column, columns=symbol_column, values=value_column).sort_index()
+    wide.index.name = 'date'
+    wide.columns.name = 'symbol'
+    return wide.astype(np.float64)
+
+
+def load_price_targets(db_actions: database_actions.DatabaseActions, symbols: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Loads the latest price targets of each symbol, from the daily snapshots or the change capture history,
+    whichever is more recent.
+
+    Args:
+        db_actions (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+        symbols (List[str], optional): The symbols to load. Defaults to every symbol.
+
+    Returns:
+        pd.DataFrame: The low, high, mean and median targets, indexed by symbol
+    """
+    snapshots = price_target.PriceTarget.__table__
+    history = price_target.PriceTargetHistory.__table__
+    columns = ['low', 'high', 'mean', 'median']
+
+    latest = (sqlalchemy.select(snapshots.c.symbol, sqlalchemy.func.max(snapshots.c.date).label('date'))
+              .group_by(snapshots.c.symbol).subquery())
+    snapshot_query = (sqlalchemy.select(snapshots.c.symbol, snapshots.c.date, *[snapshots.c[column] for column in columns])
+                      .join(latest, (latest.c.symbol == snapshots.c.symbol) & (latest.c.date == snapshots.c.date)))
+    history_query = (sqlalchemy.select(history.c.symbol, history.c.valid_from.label('date'), *[history.c[column] for column in columns])
+                     .where(history.c.valid_to.is_(None)))
+    if symbols is not None:
+        snapshot_query = snapshot_query.where(snapshots.c.symbol.in_(symbols))
+        history_query = history_query.where(history.c.symbol.in_(symbols))
+
+    with db_actions.get_engine().connect() as conn:
+        data = pd.concat([pd.read_sql(snapshot_query, conn), pd.read_sql(history_query, conn)], ignore_index=True)
+    data['date'] = pd.to_datetime(data['date'])
+    data = data.sort_values('date', kind='stable').drop_duplicates(subset=['symbol'], keep='last')
+    return data.set_index('symbol')[columns].astype(np.float64)
+
+
+def returns(prices: pd.DataFrame, log: bool = False) -> pd.DataFrame:
+    """
+    Args:
+        prices (pd.DataFrame): Wide prices.
+        log (bool, optional): Whether to return log returns instead of simple returns. Defaults to False.
+
+    Returns:
+        pd.DataFrame: The daily returns, NaN where either price is missing and for the first date
+    """
+    values = prices.to_numpy(dtype=np.float64)
+    result = np.full_like(values, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = values[1:] / values[:-1]
+        result[1:] = np.log(ratio) if log else ratio - 1
+    return pd.DataFrame(result, index=prices.index, columns=prices.columns)
+
+
+def rolling_volatility(daily_returns: pd.DataFrame, window: int = 21, annualize: bool = True) -> pd.DataFrame:
+    """
+    Args:
+        daily_returns (pd.DataFrame): Wide daily returns.
+        window (int, optional): The number of days in each window. Windows with a missing return are NaN. Defaults to 21.
+        annualize (bool, optional): Whether to scale by the square root of the trading days in a year. Defaults to True.
+
+    Returns:
+        pd.DataFrame: The standard deviation of the returns over each trailing window
+    """
+    volatility = daily_returns.rolling(window, min_periods=window).std()
+    return volatility * np.sqrt(TRADING_DAYS_PER_YEAR) if annualize else volatility
+
+
+def _pairwise_moments(daily_returns: pd.DataFrame, min_periods: int):
+    values = daily_returns.to_numpy(dtype=np.float64)
+    present = ~np.isnan(values)
+    x = np.where(present, values, 0.0)
+    mask = present.astype(np.float64)
+
+    # For every pair (i, j), sums over only the dates where both symbols have a return
+    count = mask.T @ mask
+    sum_x = x.T @ mask
+    sum_xx = (x * x).T @ mask
+    sum_xy = x.T @ x
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = (sum_xy - sum_x * sum_x.T / count) / (count - 1)
+        variance = (sum_xx - sum_x * sum_x / count) / (count - 1)
+    covariance[count < max(min_periods, 2)] = np.nan
+    return covariance, variance
+
+
+def covariance(daily_returns: pd.DataFrame, min_periods: int = 20) -> pd.DataFrame:
+    """
+    Computes the covariance matrix of the returns with pairwise deletion of missing values, like
+    DataFrame.cov, but as a few matrix products instead of one loop per pair of symbols.
+
+    Args:
+        daily_returns (pd.DataFrame): Wide daily returns.
+        min_periods (int, optional): The dates two symbols need in common for a value. Defaults to 20.
+
+    Returns:
+        pd.DataFrame: The symbols by symbols covariance matrix
+    """
+    result, _ = _pairwise_moments(daily_returns, min_periods)
+    return pd.DataFrame(result, index=daily_returns.columns, columns=daily_returns.columns)
+
+
+def correlation(daily_returns: pd.DataFrame, min_periods: int = 20) -> pd.DataFrame:
+    """
+    Computes the correlation matrix of the returns with pairwise deletion of missing values, like
+    DataFrame.corr, but as a few matrix products instead of one loop per pair of symbols.
+
+    Args:
+        daily_returns (pd.DataFrame): Wide daily returns.
+        min_periods (int, optional): The dates two symbols need in common for a value. Defaults to 20.
+
+    Returns:
+        pd.DataFrame: The symbols by symbols correlation matrix
+    """
+    result, variance = _pairwise_moments(daily_returns, min_periods)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # variance[i, j] is the variance of i over the dates it shares with j
+        result = result / np.sqrt(variance * variance.T)
+    np.clip(result, -1.0, 1.0, out=result)
+    return pd.DataFrame(result, index=daily_returns.columns, columns=daily_returns.columns)
+
+
+def drawdowns(prices: pd.DataFrame) -> pd.DataFrame:
+    """
+    Args:
+        prices (pd.DataFrame): Wide prices.
+
+    Returns:
+        pd.DataFrame: The fall of each price from its running maximum, as a non-positive fraction
+    """
+    values = prices.to_numpy(dtype=np.float64)
+    running_max = np.fmax.accumulate(values, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = values / running_max - 1
+    return pd.DataFrame(result, index=prices.index, columns=prices.columns)
+
+
+def last_valid(prices: pd.DataFrame) -> pd.Series:
+    """
+    Returns:
+        pd.Series: The last non-missing price of each symbol
+    """
+    values = prices.to_numpy(dtype=np.float64)
+    present = ~np.isnan(values)
+    last_row = len(values) - 1 - np.argmax(present[::-1], axis=0)
+    result = values[last_row, np.arange(values.shape[1])]
+    result[~present.any(axis=0)] = np.nan
+    return pd.Series(result, index=prices.columns)
+
+
+def price_target_upside(prices: pd.DataFrame, targets: pd.DataFrame, target_column: str = 'mean') -> pd.Series:
+    """
+    Args:
+        prices (pd.DataFrame): Wide prices.
+        targets (pd.DataFrame): Price targets indexed by symbol, as returned by load_price_targets.
+        target_column (str, optional): The target to compare with. Defaults to 'mean'.
+
+    Returns:
+        pd.Series: The target relative to the last price of each symbol, minus one
+    """
+    target = targets[target_column].reindex(prices.columns)
+    return target / last_valid(prices) - 1
+
+
+def summarize(prices: pd.DataFrame, targets: Optional[pd.DataFrame] = None, window: int = 21) -> pd.DataFrame:
+    """
+    Computes per-symbol statistics of the whole universe.
+
+    Args:
+        prices (pd.DataFrame): Wide prices.
+        targets (pd.DataFrame, optional): Price targets indexed by symbol, for the upside column.
+        window (int, optional): The window of the latest rolling volatility. Defaults to 21.
+
+    Returns:
+        pd.DataFrame: The last price, total and annualized return, annualized volatility over the whole period and
+            over the last window, and maximum drawdown of each symbol, and the upside to the mean target if
+            targets are given
+    """
+    daily_returns = returns(prices)
+    values = prices.to_numpy(dtype=np.float64)
+    present = ~np.isnan(values)
+    first_row = np.argmax(present, axis=0)
+    first = values[first_row, np.arange(values.shape[1])]
+    last = last_valid(prices)
+    days = present.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total_return = last.to_numpy() / first - 1
+        annualized_return = (1 + total_return) ** (TRADING_DAYS_PER_YEAR / np.maximum(days - 1, 1)) - 1
+
+    summary = pd.DataFrame({'last_price': last,
+                            'days': days,
+                            'total_return': total_return,
+                            'annualized_return': annualized_return,
+                            'volatility': daily_returns.std() * np.sqrt(TRADING_DAYS_PER_YEAR),
+                            'recent_volatility': rolling_volatility(daily_returns, window).iloc[-1] if len(prices) > 0 else np.nan,
+                            'max_drawdown': drawdowns(prices).min()},
+                           index=prices.columns)
+    if targets is not None:
+        summary['target_upside'] = price_target_upside(prices, targets)
+    return summary
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description='Compute portfolio analytics over stored prices')
+    parser.add_argument('analysis', choices=['summary', 'correlation', 'covariance', 'drawdowns', 'volatility'])
+    parser.add_argument('--symbols', nargs='+', help='Symbols to analyse. Defaults to every stored symbol.')
+    parser.add_argument('--start', type=datetime.date.fromisoformat, help='First date, as YYYY-MM-DD')
+    parser.add_argument('--end', type=datetime.date.fromisoformat, help='Exclusive end date, as YYYY-MM-DD')
+    parser.add_argument('--source', choices=['db', 'cache'], default='db',
+                        help='Read prices from DATABASE_URL or from the local price cache. Defaults to db.')
+    parser.add_argument('--window', type=int, default=21, help='Rolling window in trading days')
+    parser.add_argument('--output', help='Write the result as CSV to this file instead of printing it')
+    args = parser.parse_args(argv)
+
+    db = database_actions.DatabaseActions(os.getenv('DATABASE_URL')) if args.source == 'db' else None
+    if args.source == 'db':
+        prices = load_prices_from_db(db, args.symbols, args.start, args.end)
+    else:
+        prices = load_prices_from_cache(None, args.symbols, args.start, args.end)
+    logger.info(f'Loaded {prices.shape[0]} dates for {prices.shape[1]} symbols')
+
+    if args.analysis == 'summary':
+        result = summarize(prices, load_price_targets(db, args.symbols) if db is not None else None, args.window)
+    elif args.analysis == 'correlation':
+        result = correlation(returns(prices))
+    elif args.analysis == 'covariance':
+        result = covariance(returns(prices))
+    elif args.analysis == 'drawdowns':
+        result = drawdowns(prices)
+    else:
+        result = rolling_volatility(returns(prices), args.window)
+
+    if args.output:
+        result.to_csv(args.output)
+    else:
+        print(result.to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,883 @@
+
+"""
+This module contains benchmarks for the stock data downloaders. They run against a stubbed
+yfinance.Ticker, which returns synthetic or recorded data with injected latency, and a fake
+AlphaVantage endpoint, so no network access is needed.
+
+Examples:
+    python benchmark.py fetch --symbols 200 --latency 0.05 --workers 1 8 32
+    python benchmark.py rate-limit --symbols 300 --workers 16 --threshold 20 --rate 5
+    python benchmark.py rate-limit --check --workers 4 16 --threshold 20
+    python benchmark.py conversion --rows 10000
+    python benchmark.py record --symbols AAPL MSFT NVDA --output fixtures
+    python benchmark.py suite --symbols 200 --fixtures fixtures --output after.json --baseline before.json
+    python benchmark.py analytics --symbols 5000 --years 10
+    python benchmark.py writes --writers 1 4 16 --pool-size 4 --max-overflow 0
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import glob
+import http.server
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import analytics
+import database_actions
+import database_base
+import fetch_engine
+import frame_conversion
+import instrumentation
+import rate_limiter
+import stock_data
+import stock_price
+import symbol_universe
+
+
+logger = logging.getLogger(__name__)
+
+
+class FakeHTTPError(Exception):
+    pass
+
+
+class FakeThrottlingEndpoint:
+    """
+    A local stand-in for the Yahoo endpoint that rejects requests with a 429 whenever more than
+    max_requests_per_second were accepted during the last second.
+    """
+
+    def __init__(self, max_requests_per_second: int):
+        self.max_requests_per_second = max_requests_per_second
+        self.accepted = 0
+        self.rejected = 0
+        self._recent = collections.deque()
+        self._lock = threading.Lock()
+
+    def request(self):
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.max_requests_per_second:
+                self.rejected += 1
+                raise FakeHTTPError('429 Client Error: Too Many Requests')
+            self._recent.append(now)
+            self.accepted += 1
+
+
+class FixtureSet:
+    """
+    yfinance responses recorded by record_fixtures, one pickle per recorded symbol. Any symbol can be
+    replayed: it is mapped onto one of the recorded symbols by a hash of its name.
+    """
+
+    def __init__(self, directory: str):
+        paths = sorted(glob.glob(os.path.join(directory, '*.pkl')))
+        if len(paths) == 0:
+            raise ValueError(f'No recorded fixtures in {directory}')
+        self._fixtures = [pd.read_pickle(path) for path in paths]
+
+    def __len__(self) -> int:
+        return len(self._fixtures)
+
+    def get(self, symbol: str) -> Dict[str, Any]:
+        return self._fixtures[zlib.crc32(symbol.encode('utf-8')) % len(self._fixtures)]
+
+
+def record_fixtures(symbols: List[str], directory: str, period: str = '1y'):
+    """
+    Records the live yfinance responses the downloaders use for each symbol, for FixtureSet to replay.
+
+    Args:
+        symbols (List[str]): The symbols to record.
+        directory (str): The directory the fixtures are written to.
+        period (str, optional): The period of price history to record. Defaults to '1y'.
+    """
+    import yfinance
+
+    os.makedirs(directory, exist_ok=True)
+    for symbol in symbols:
+        ticker = yfinance.Ticker(symbol)
+        fixture = {'history': ticker.history(period=period),
+                   'recommendations': ticker.get_recommendations(),
+                   'price_targets': ticker.get_analyst_price_targets(),
+                   'growth_estimates': ticker.get_growth_estimates(),
+                   'insider_purchases': ticker.get_insider_purchases()}
+        pd.to_pickle(fixture, os.path.join(directory, f'{symbol}.pkl'))
+        logger.info(f'Recorded {symbol} with {len(fixture["history"])} days of history')
+
+
+def _copy(value: Any) -> Any:
+    if isinstance(value, (pd.DataFrame, dict)):
+        return value.copy()
+    return value
+
+
+class StubTicker:
+    """
+    Stands in for yfinance.Ticker. Every call sleeps for the configured latency and fails with the
+    configured probability before returning synthetic data, or recorded data if fixtures are given.
+    If an endpoint is given, every call is also subject to its rate limit. If a requests counter is given,
+    every call is counted in it under the name of the method called.
+    """
+
+    _requests_lock = threading.Lock()
+
+    def __init__(self, symbol: str, latency: float = 0.05, failure_rate: float = 0.0, history_days: int = 5,
+                 endpoint: Optional[FakeThrottlingEndpoint] = None, fixtures: Optional[FixtureSet] = None,
+                 requests: Optional[collections.Counter] = None):
+        self.symbol = symbol
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.history_days = history_days
+        self.endpoint = endpoint
+        self.fixtures = fixtures
+        self.requests = requests
+
+    def _call(self, method: str):
+        if self.requests is not None:
+            with self._requests_lock:
+                self.requests[method] += 1
+        if self.endpoint is not None:
+            self.endpoint.request()
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise ConnectionError(f'Injected failure for {self.symbol}')
+
+    def history(self, start: str = None, end: str = None, period: str = None) -> pd.DataFrame:
+        self._call('history')
+        if self.fixtures is not None:
+            return _copy(self.fixtures.get(self.symbol)['history'])
+        dates = pd.bdate_range(end=datetime.date.today() - datetime.timedelta(days=1),
+                               periods=self.history_days, tz='America/New_York', name='Date')
+        prices = [100.0 + i for i in range(len(dates))]
+        return pd.DataFrame({'Open': prices,
+                             'High': [p + 1 for p in prices],
+                             'Low': [p - 1 for p in prices],
+                             'Close': prices,
+                             'Volume': [1000000] * len(dates),
+                             'Dividends': [0.0] * len(dates),
+                             'Stock Splits': [0.0] * len(dates)}, index=dates)
+
+    def get_recommendations(self) -> pd.DataFrame:
+        self._call('get_recommendations')
+        if self.fixtures is not None:
+            return _copy(self.fixtures.get(self.symbol)['recommendations'])
+        return pd.DataFrame({'period': ['0m'], 'strongBuy': [5], 'buy': [10], 'hold': [3], 'sell': [1], 'strongSell': [0]})
+
+    def get_analyst_price_targets(self) -> dict:
+        self._call('get_analyst_price_targets')
+        if self.fixtures is not None:
+            return _copy(self.fixtures.get(self.symbol)['price_targets'])
+        return {'current': 100.0, 'low': 80.0, 'high': 140.0, 'mean': 115.0, 'median': 112.0}
+
+    def get_growth_estimates(self) -> pd.DataFrame:
+        self._call('get_growth_estimates')
+        if self.fixtures is not None:
+            return _copy(self.fixtures.get(self.symbol)['growth_estimates'])
+        return pd.DataFrame({'stockTrend': [0.05, 0.07, 0.10, 0.12], 'indexTrend': [0.03, 0.04, 0.06, 0.08]},
+                            index=pd.Index(['0q', '+1q', '0y', '+1y'], name='period'))
+
+    def get_insider_purchases(self) -> pd.DataFrame:
+        self._call('get_insider_purchases')
+        if self.fixtures is not None:
+            return _copy(self.fixtures.get(self.symbol)['insider_purchases'])
+        return pd.DataFrame({'Insider Purchases Last 6m': ['Purchases', 'Sales', 'Total Insider Shares Held'],
+                             'Shares': [12000, 45000, 3000000],
+                             'Trans': [3, 7, None]})
+
+
+class StubDownloader:
+    """
+    Stands in for yfinance.download. Each call is one request with the configured latency, and returns
+    the synthetic or recorded histories of all requested tickers side by side under (ticker, field) columns.
+    """
+
+    def __init__(self, latency: float = 0.05, history_days: int = 5, fixtures: Optional[FixtureSet] = None):
+        self.latency = latency
+        self.history_days = history_days
+        self.fixtures = fixtures
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, tickers: List[str], start: str = None, end: str = None, **kwargs) -> pd.DataFrame:
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        frames = {symbol: StubTicker(symbol, latency=0, history_days=self.history_days, fixtures=self.fixtures).history()
+                  for symbol in tickers}
+        return pd.concat(frames, axis=1)
+
+
+def make_symbols(number_of_symbols: int) -> List[str]:
+    return [f'S{i:05d}' for i in range(number_of_symbols)]
+
+
+class FakeAlphaVantageServer:
+    """
+    A local HTTP server standing in for the AlphaVantage LISTING_STATUS endpoint. Every request waits
+    for the configured latency and fails with a 503 with the configured probability.
+    """
+
+    def __init__(self, symbols: List[str], latency: float = 0.05, failure_rate: float = 0.0):
+        header = ','.join(symbol_universe.SymbolUniverse.listing_columns)
+        rows = [f'{symbol},{symbol} Inc,NYSE,Stock,2000-01-01,null,Active' for symbol in symbols]
+        content = '\n'.join([header] + rows).encode('utf-8')
+        self.requests = 0
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(latency)
+                if random.random() < failure_rate:
+                    self.send_error(503, 'Injected failure')
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-download')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/query'
+
+    def __enter__(self) -> 'FakeAlphaVantageServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class TimedFetchEngine(fetch_engine.FetchEngine):
+    """
+    A FetchEngine that keeps the exact duration of every call, retries included, by dataset, so that
+    the benchmark can report exact percentiles rather than the bucketed ones of instrumentation.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = collections.defaultdict(list)
+        self._latencies_lock = threading.Lock()
+
+    def call_with_retry(self, description, func, dataset='other', cost=1):
+        start = time.perf_counter()
+        try:
+            return super().call_with_retry(description, func, dataset=dataset, cost=cost)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._latencies_lock:
+                self.latencies[dataset].append(elapsed)
+
+
+def run_fetch_benchmark(number_of_symbols: int, latency: float, max_workers: int, failure_rate: float = 0.0) -> Dict[str, float]:
+    """
+    Times the three downloaders for one worker count.
+
+    Args:
+        number_of_symbols (int): The number of synthetic symbols to download.
+        latency (float): The seconds each stubbed call takes.
+        max_workers (int): The worker count of the fetch engine.
+        failure_rate (float, optional): The probability that a stubbed call fails. Defaults to 0.0.
+
+    Returns:
+        Dict[str, float]: The wall-clock seconds taken by each downloader, and the number of multi-ticker price
+            requests and of single-symbol price requests, the fallback for the symbols of failed batches
+    """
+    engine = fetch_engine.FetchEngine(max_workers=max_workers, base_delay=0.01, max_delay=0.1)
+    downloader = StubDownloader(latency)
+    ticker_requests = collections.Counter()
+    stocks = stock_data.StockData(engine=engine,
+                                  ticker_factory=lambda symbol: StubTicker(symbol, latency, failure_rate, requests=ticker_requests),
+                                  symbols=make_symbols(number_of_symbols),
+                                  batch_downloader=downloader)
+    timings = {}
+
+    start = time.perf_counter()
+    stocks.download_recommendations()
+    timings['recommendations'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stocks.download_price_targets()
+    timings['price_targets'] = time.perf_counter() - start
+
+    with mock.patch.object(stock_price.StockPrice, 'get_max_date_by_symbol', return_value={}):
+        start = time.perf_counter()
+        stocks.download_stock_prices(None, stocks.get_list_of_symbols())
+        timings['stock_prices'] = time.perf_counter() - start
+        timings['stock_price_batch_requests'] = downloader.requests
+        timings['stock_price_symbol_requests'] = ticker_requests['history']
+
+    return timings
+
+
+class RecordingRateLimiter(rate_limiter.RateLimiter):
+    """
+    A RateLimiter that records its rate right after every throttle, for checking that it backs off.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rates_after_throttle = []
+
+    def on_error(self, error: Exception):
+        super().on_error(error)
+        if rate_limiter.is_throttle_error(error):
+            self.rates_after_throttle.append(self.rate)
+
+
+def run_rate_limit_check(threshold: int, max_workers: int, number_of_requests: int, latency: float,
+                         max_rejected_fraction: float) -> Dict[str, Any]:
+    """
+    Checks the rate limiter against a fake endpoint that rejects requests above threshold per second. The limiter
+    starts at twice the threshold, so it must be throttled, halve its rate, and then grow it back while keeping the
+    share of rejected requests small.
+
+    Args:
+        threshold (int): The requests per second the fake endpoint accepts.
+        max_workers (int): The worker count of the fetch engine.
+        number_of_requests (int): The number of requests to make.
+        latency (float): The seconds each request takes.
+        max_rejected_fraction (float): The largest share of requests the endpoint may reject.
+
+    Returns:
+        Dict[str, Any]: The endpoint counters, the start, backed-off and final rates, and a list of the checks
+            that failed, empty if the limiter passed
+    """
+    endpoint = FakeThrottlingEndpoint(threshold)
+    start_rate = 2.0 * threshold
+    limiter = RecordingRateLimiter(rate=start_rate, burst=threshold, min_rate=0.5, max_rate=start_rate)
+    engine = fetch_engine.FetchEngine(max_workers=max_workers, max_attempts=10, base_delay=0.05, max_delay=1.0, limiter=limiter)
+
+    def request(i: int):
+        time.sleep(latency)
+        endpoint.request()
+
+    start = time.perf_counter()
+    engine.map(lambda i: engine.call_with_retry(f'request {i}', lambda: request(i)), range(number_of_requests))
+    elapsed = time.perf_counter() - start
+
+    rejected_fraction = endpoint.rejected / (endpoint.accepted + endpoint.rejected)
+    lowest_rate = min(limiter.rates_after_throttle, default=None)
+    failures = []
+    if rejected_fraction > max_rejected_fraction:
+        failures.append(f'{rejected_fraction:.1%} of requests were rejected, more than {max_rejected_fraction:.1%}')
+    if lowest_rate is None:
+        failures.append('the endpoint never throttled the limiter, so backing off was not exercised')
+    elif lowest_rate >= start_rate:
+        failures.append(f'the rate did not back off after a throttle: {lowest_rate:.2f}/s')
+    elif limiter.rate <= lowest_rate:
+        failures.append(f'the rate did not recover after backing off to {lowest_rate:.2f}/s: {limiter.rate:.2f}/s at the end')
+
+    return {'seconds': elapsed,
+            'requests_per_second': endpoint.accepted / elapsed,
+            'endpoint_accepted': endpoint.accepted,
+            'endpoint_rejected': endpoint.rejected,
+            'rejected_fraction': rejected_fraction,
+            'start_rate': start_rate,
+            'lowest_rate': lowest_rate,
+            'final_rate': limiter.rate,
+            'failures': failures}
+
+
+def run_rate_limit_benchmark(number_of_symbols: int, latency: float, max_workers: int, threshold: int,
+                             rate: float, burst: int) -> Dict[str, float]:
+    """
+    Downloads recommendations from a fake endpoint that rejects requests above threshold per second,
+    with the fetch engine going through an adaptive rate limiter.
+
+    Args:
+        number_of_symbols (int): The number of synthetic symbols to download.
+        latency (float): The seconds each stubbed call takes.
+        max_workers (int): The worker count of the fetch engine.
+        threshold (int): The requests per second the fake endpoint accepts.
+        rate (float): The starting rate of the limiter in requests per second.
+        burst (int): The burst size of the limiter.
+
+    Returns:
+        Dict[str, float]: The sustained throughput, the endpoint counters and the limiter counters
+    """
+    endpoint = FakeThrottlingEndpoint(threshold)
+    limiter = rate_limiter.RateLimiter(rate=rate, burst=burst, min_rate=0.5, max_rate=max(rate, threshold * 2))
+    engine = fetch_engine.FetchEngine(max_workers=max_workers, max_attempts=5, base_delay=0.05, max_delay=1.0, limiter=limiter)
+    stocks = stock_data.StockData(engine=engine,
+                                  ticker_factory=lambda symbol: StubTicker(symbol, latency, endpoint=endpoint),
+                                  symbols=make_symbols(number_of_symbols))
+
+    start = time.perf_counter()
+    recs = stocks.download_recommendations()
+    elapsed = time.perf_counter() - start
+
+    results = {'seconds': elapsed,
+               'symbols_per_second': len(recs) / elapsed,
+               'downloaded': len(recs),
+               'endpoint_accepted': endpoint.accepted,
+               'endpoint_rejected': endpoint.rejected}
+    results.update({f'limiter_{name}': value for name, value in limiter.get_stats().items()})
+    return results
+
+
+def loop_stock_prices(symbol: str, data_df: pd.DataFrame, now: datetime.datetime) -> List[stock_price.StockPrice]:
+    """
+    The per-row .loc conversion the downloader used before frame_conversion, kept as the baseline
+    for the conversion benchmark.
+    """
+    prices = []
+    for i in data_df.index:
+        row = data_df.loc[i]
+        price = stock_price.StockPrice(id=symbol + '_' + row['Date'].isoformat(),
+                                       symbol=symbol,
+                                       date=row['Date'],
+                                       open_price=float(row['Open']),
+                                       high_price=float(row['High']),
+                                       low_price=float(row['Low']),
+                                       close_price=float(row['Close']),
+                                       volume=int(row['Volume']),
+                                       dividends=float(row['Dividends']),
+                                       stock_splits=float(row['Stock Splits']),
+                                       inserted_at=now)
+        prices.append(price)
+    return prices
+
+
+def run_conversion_benchmark(number_of_rows: int) -> Dict[str, float]:
+    """
+    Compares the rows per second of the per-row .loc conversion with the vectorized conversion on a
+    synthetic history.
+
+    Args:
+        number_of_rows (int): The number of rows in the synthetic history.
+
+    Returns:
+        Dict[str, float]: The rows per second of each conversion
+    """
+    data_df = StubTicker('BENCH', latency=0, history_days=number_of_rows).history().reset_index()
+    now = datetime.datetime.now()
+    conversions = {'loop_orm': lambda: loop_stock_prices('BENCH', data_df, now),
+                   'vectorized_frame': lambda: frame_conversion.stock_price_frame('BENCH', data_df, now),
+                   'vectorized_records': lambda: frame_conversion.to_records(frame_conversion.stock_price_frame('BENCH', data_df, now)),
+                   'vectorized_tuples': lambda: frame_conversion.to_tuples(frame_conversion.stock_price_frame('BENCH', data_df, now))}
+
+    results = {}
+    for name, conversion in conversions.items():
+        start = time.perf_counter()
+        conversion()
+        results[name] = number_of_rows / (time.perf_counter() - start)
+    return results
+
+
+SUITE_SCENARIOS = ['stock_prices', 'recommendations', 'price_targets', 'main']
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Returns:
+        Optional[float]: The peak resident set size of this process in MiB, or None where the resource module is missing
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_suite_scenario(scenario: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs one scenario of the suite. Meant to be run in a fresh process, so that its peak RSS is its own.
+
+    Args:
+        scenario (str): One of SUITE_SCENARIOS. 'main' runs main.main end to end, with the symbols served by a fake
+            AlphaVantage endpoint and every dataset written to the database.
+        options (Dict[str, Any]): The suite options: symbols, latency, failure_rate, workers, fixtures (a directory
+            or None) and database_url (None for a fresh SQLite database).
+
+    Returns:
+        Dict[str, Any]: The wall-clock seconds, symbols per second, exact p50 and p99 call latencies in milliseconds,
+            rows produced and peak RSS of the scenario
+    """
+    logging.disable(logging.CRITICAL)
+    random.seed(0)
+
+    symbols = make_symbols(options['symbols'])
+    latency = options['latency']
+    failure_rate = options['failure_rate']
+    fixtures = FixtureSet(options['fixtures']) if options['fixtures'] else None
+    engine = TimedFetchEngine(max_workers=options['workers'], base_delay=0.01, max_delay=0.1)
+    ticker_factory = lambda symbol: StubTicker(symbol, latency, failure_rate, fixtures=fixtures)
+    downloader = StubDownloader(latency, fixtures=fixtures)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = options['database_url'] or f'sqlite:///{os.path.join(directory, "benchmark.db")}'
+        instrumentation.metrics.reset()
+        start = time.perf_counter()
+
+        if scenario == 'main':
+            import main
+
+            # main builds StockData itself, so the stubs are injected by replacing the class it calls
+            real_stock_data = stock_data.StockData
+
+            def make_stock_data(**kwargs) -> stock_data.StockData:
+                return real_stock_data(ticker_factory=ticker_factory, batch_downloader=downloader, **kwargs)
+
+            environment = {'DATABASE_URL': database_url,
+                           'SYMBOL_CACHE_PATH': os.path.join(directory, 'symbol_universe.json'),
+                           'ALPHAVANTAGE_API_KEY': 'benchmark'}
+            with FakeAlphaVantageServer(symbols, latency, failure_rate) as server, \
+                    mock.patch.dict(os.environ, environment), \
+                    mock.patch.object(symbol_universe.SymbolUniverse, 'url', server.url), \
+                    mock.patch.object(fetch_engine.FetchEngine, 'from_env', return_value=engine), \
+                    mock.patch.object(stock_data, 'StockData', make_stock_data):
+                main.main(['--run-id', f'benchmark-{datetime.datetime.now():%Y%m%dT%H%M%S}'])
+            rows = sum(instrumentation.metrics.report()['counters'].get('rows_written', {}).values())
+
+        else:
+            stocks = stock_data.StockData(engine=engine, ticker_factory=ticker_factory, symbols=symbols,
+                                          batch_downloader=downloader)
+            if scenario == 'stock_prices':
+                db = database_actions.DatabaseActions(database_url)
+                db.create_schema()
+                database_base.Base.metadata.create_all(bind=db.get_engine())
+                rows = len(stocks.download_stock_prices(db, symbols))
+            elif scenario == 'recommendations':
+                rows = len(stocks.download_recommendations())
+            else:
+                rows = len(stocks.download_price_targets())
+
+        elapsed = time.perf_counter() - start
+
+    latencies = pd.Series([value for values in engine.latencies.values() for value in values], dtype=float)
+    return {'scenario': scenario,
+            'seconds': elapsed,
+            'symbols_per_second': len(symbols) / elapsed,
+            'rows': rows,
+            'calls': len(latencies),
+            'p50_ms': latencies.quantile(0.5) * 1000 if len(latencies) > 0 else None,
+            'p99_ms': latencies.quantile(0.99) * 1000 if len(latencies) > 0 else None,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def run_suite(scenarios: List[str], options: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Runs each scenario in its own freshly spawned process.
+
+    Args:
+        scenarios (List[str]): The scenarios to run, from SUITE_SCENARIOS.
+        options (Dict[str, Any]): The suite options passed to run_suite_scenario.
+
+    Returns:
+        List[Dict[str, Any]]: The results of each scenario
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for scenario in scenarios:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(run_suite_scenario, scenario, options).result())
+    return results
+
+
+def format_suite_results(results: List[Dict[str, Any]], baseline: Optional[List[Dict[str, Any]]] = None) -> str:
+    baseline_by_scenario = {result['scenario']: result for result in baseline or []}
+    lines = [f'{"scenario":16s} {"seconds":>8s} {"symbols/s":>10s} {"p50 ms":>8s} {"p99 ms":>8s} {"rows":>8s} {"peak MiB":>9s}']
+    for result in results:
+        line = (f'{result["scenario"]:16s} {result["seconds"]:8.2f} {result["symbols_per_second"]:10.1f} '
+                f'{result["p50_ms"] or 0:8.1f} {result["p99_ms"] or 0:8.1f} {result["rows"]:8d} {result["peak_rss_mb"] or 0:9.1f}')
+        before = baseline_by_scenario.get(result['scenario'])
+        if before is not None:
+            line += f'  (throughput {result["symbols_per_second"] / before["symbols_per_second"] - 1:+.0%}'
+            if result['peak_rss_mb'] and before['peak_rss_mb']:
+                line += f', peak RSS {result["peak_rss_mb"] / before["peak_rss_mb"] - 1:+.0%}'
+            line += ' vs baseline)'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def run_write_benchmark(database_url: Optional[str], writers: int, batches: int, rows: int,
+                        engine_options: database_actions.EngineOptions) -> Dict[str, Any]:
+    """
+    Writes synthetic price batches from several threads at once through one DatabaseActions, and measures the
+    per-batch latency, the wait for pooled connections and the connections opened.
+
+    Args:
+        database_url (str, optional): The database to write to. Defaults to a fresh SQLite file.
+        writers (int): The number of writer threads.
+        batches (int): The number of batches each writer writes.
+        rows (int): The number of rows per batch.
+        engine_options (database_actions.EngineOptions): The pool settings to measure.
+
+    Returns:
+        Dict[str, Any]: Rows per second, the p50 and p99 batch latency, the p99 pool wait, and the pool events
+    """
+    now = datetime.datetime.now()
+    frames = []
+    for writer in range(writers):
+        history = StubTicker(f'W{writer:04d}', latency=0, history_days=batches * rows).history().reset_index()
+        frames.append([frame_conversion.stock_price_frame(f'W{writer:04d}', history.iloc[k:k + rows], now)
+                       for k in range(0, batches * rows, rows)])
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = database_actions.DatabaseActions(database_url or f'sqlite:///{os.path.join(directory, "benchmark.db")}',
+                                              engine_options=engine_options)
+        db.create_schema()
+        database_base.Base.metadata.create_all(bind=db.get_engine())
+        db.get_engine().dispose()
+        instrumentation.metrics.reset()
+
+        latencies = []
+        lock = threading.Lock()
+
+        def write(writer_frames: List[pd.DataFrame]):
+            for frame in writer_frames:
+                start = time.perf_counter()
+                db.bulk_load(stock_price.StockPrice.__table__, frame, on_conflict=db.ON_CONFLICT_NOTHING)
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=writers) as executor:
+            list(executor.map(write, frames))
+        elapsed = time.perf_counter() - start
+
+        report = instrumentation.metrics.report()
+        pool = db.get_pool_stats()
+        db.get_engine().dispose()
+
+    latencies = pd.Series(latencies, dtype=float)
+    events = {key.split('=', 1)[1]: value for key, value in report['counters'].get('db_pool_events', {}).items()}
+    pool_wait = report['histograms'].get('pool_wait_seconds', {}).get('', {})
+    return {'rows_per_second': writers * batches * rows / elapsed,
+            'p50_ms': latencies.quantile(0.5) * 1000,
+            'p99_ms': latencies.quantile(0.99) * 1000,
+            'pool_wait_p99_ms': pool_wait['p99'] * 1000 if pool_wait.get('p99') is not None else None,
+            'connections_opened': events.get('connect', 0),
+            'checkouts': events.get('checkout', 0),
+            'overflow': pool.get('overflow')}
+
+
+def make_price_matrix(number_of_symbols: int, number_of_days: int, missing_rate: float = 0.01, seed: int = 0) -> pd.DataFrame:
+    """
+    Builds wide synthetic prices as geometric random walks, with a share of prices missing at random and
+    every tenth symbol listed halfway through the period.
+    """
+    generator = np.random.default_rng(seed)
+    daily_returns = generator.normal(0.0003, 0.02, size=(number_of_days, number_of_symbols))
+    prices = 100 * np.exp(np.cumsum(daily_returns, axis=0))
+    prices[generator.random(prices.shape) < missing_rate] = np.nan
+    prices[:number_of_days // 2, ::10] = np.nan
+    dates = pd.bdate_range(end=datetime.date.today(), periods=number_of_days, name='date')
+    return pd.DataFrame(prices, index=dates, columns=pd.Index(make_symbols(number_of_symbols), name='symbol'))
+
+
+def run_analytics_benchmark(number_of_symbols: int, years: int, window: int, baseline_symbols: int) -> Dict[str, float]:
+    """
+    Times each analytic over the whole synthetic universe, and the pandas pairwise correlation it replaces
+    on a subset of it.
+
+    Args:
+        number_of_symbols (int): The number of synthetic symbols.
+        years (int): The years of daily prices per symbol.
+        window (int): The rolling volatility window.
+        baseline_symbols (int): The number of symbols the DataFrame.corr baseline runs on, as it is quadratic in them.
+
+    Returns:
+        Dict[str, float]: The seconds of each step, the largest difference from the baseline correlations and the peak RSS
+    """
+    prices = make_price_matrix(number_of_symbols, years * analytics.TRADING_DAYS_PER_YEAR)
+    timings = {}
+
+    start = time.perf_counter()
+    daily_returns = analytics.returns(prices)
+    timings['returns'] = time.perf_counter() - start
+
+    steps = {'rolling_volatility': lambda: analytics.rolling_volatility(daily_returns, window),
+             'drawdowns': lambda: analytics.drawdowns(prices),
+             'covariance': lambda: analytics.covariance(daily_returns),
+             'correlation': lambda: analytics.correlation(daily_returns),
+             'summary': lambda: analytics.summarize(prices, window=window)}
+    for name, step in steps.items():
+        start = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - start
+
+    subset = daily_returns.iloc[:, :baseline_symbols]
+    start = time.perf_counter()
+    expected = subset.corr(min_periods=20)
+    timings['pandas_corr_subset'] = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = analytics.correlation(subset)
+    timings['correlation_subset'] = time.perf_counter() - start
+    timings['max_abs_difference'] = float(np.nanmax(np.abs(actual.to_numpy() - expected.to_numpy())))
+
+    timings['peak_rss_mb'] = peak_rss_mb()
+    return timings
+
+
+def format_results(results: Dict[str, float]) -> str:
+    return ', '.join(f'{name}={value:.2f}' if isinstance(value, float) else f'{name}={value}'
+                     for name, value in results.items())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the stock data downloaders against a stubbed yfinance')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    fetch_parser = subparsers.add_parser('fetch', help='Compare downloader wall-clock time across worker counts')
+    fetch_parser.add_argument('--symbols', type=int, default=200, help='Number of synthetic symbols')
+    fetch_parser.add_argument('--latency', type=float, default=0.05, help='Seconds of injected latency per call')
+    fetch_parser.add_argument('--failure-rate', type=float, default=0.0, help='Probability that a call fails')
+    fetch_parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 32], help='Worker counts to compare')
+
+    limit_parser = subparsers.add_parser('rate-limit', help='Measure sustained throughput against a throttling fake endpoint')
+    limit_parser.add_argument('--symbols', type=int, default=300, help='Number of synthetic symbols')
+    limit_parser.add_argument('--latency', type=float, default=0.05, help='Seconds of injected latency per call')
+    limit_parser.add_argument('--workers', type=int, nargs='+', default=[16], help='Worker counts to compare')
+    limit_parser.add_argument('--threshold', type=int, default=20, help='Requests per second the fake endpoint accepts')
+    limit_parser.add_argument('--rate', type=float, default=5.0, help='Starting requests per second of the rate limiter')
+    limit_parser.add_argument('--burst', type=int, default=10, help='Burst size of the rate limiter')
+    limit_parser.add_argument('--check', action='store_true',
+                              help='Check that the limiter keeps 429s under --max-rejected, backs off and recovers; exits non-zero if not')
+    limit_parser.add_argument('--requests', type=int, default=400, help='Number of requests made by --check')
+    limit_parser.add_argument('--max-rejected', type=float, default=0.05, help='Largest share of requests --check allows to be rejected')
+
+    conversion_parser = subparsers.add_parser('conversion', help='Compare per-row and vectorized price conversion')
+    conversion_parser.add_argument('--rows', type=int, default=10000, help='Number of rows in the synthetic history')
+
+    suite_parser = subparsers.add_parser('suite', help='Measure throughput, latency and peak RSS of the downloaders and main()')
+    suite_parser.add_argument('--symbols', type=int, default=200, help='Number of synthetic symbols')
+    suite_parser.add_argument('--latency', type=float, default=0.05, help='Seconds of injected latency per call')
+    suite_parser.add_argument('--failure-rate', type=float, default=0.0, help='Probability that a call fails')
+    suite_parser.add_argument('--workers', type=int, default=8, help='Worker count of the fetch engine')
+    suite_parser.add_argument('--fixtures', help='Directory of recorded fixtures to replay instead of synthetic data')
+    suite_parser.add_argument('--database-url', help='Database to write to, e.g. a local Postgres. Defaults to a fresh SQLite file per scenario.')
+    suite_parser.add_argument('--scenarios', nargs='+', choices=SUITE_SCENARIOS, default=SUITE_SCENARIOS, help='Scenarios to run')
+    suite_parser.add_argument('--output', help='Write the results as JSON to this file')
+    suite_parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+
+    analytics_parser = subparsers.add_parser('analytics', help='Time the vectorized analytics over a synthetic universe')
+    analytics_parser.add_argument('--symbols', type=int, default=5000, help='Number of synthetic symbols')
+    analytics_parser.add_argument('--years', type=int, default=10, help='Years of daily prices per symbol')
+    analytics_parser.add_argument('--window', type=int, default=21, help='Rolling volatility window in trading days')
+    analytics_parser.add_argument('--baseline-symbols', type=int, default=300,
+                                  help='Number of symbols to compare with pandas DataFrame.corr on')
+
+    writes_parser = subparsers.add_parser('writes', help='Measure batch latency and connection churn of concurrent writers')
+    writes_parser.add_argument('--writers', type=int, nargs='+', default=[1, 4, 16], help='Writer thread counts to compare')
+    writes_parser.add_argument('--batches', type=int, default=20, help='Batches written by each writer')
+    writes_parser.add_argument('--rows', type=int, default=2000, help='Rows per batch')
+    writes_parser.add_argument('--database-url', help='Database to write to, e.g. a local Postgres. Defaults to a fresh SQLite file.')
+    writes_parser.add_argument('--pool-size', type=int, help='Connections kept in the pool. Defaults to DB_POOL_SIZE.')
+    writes_parser.add_argument('--max-overflow', type=int, help='Connections opened beyond the pool. Defaults to DB_MAX_OVERFLOW.')
+    writes_parser.add_argument('--page-size', type=int, help='Rows per INSERT of an executemany. Defaults to DB_INSERTMANYVALUES_PAGE_SIZE.')
+
+    record_parser = subparsers.add_parser('record', help='Record live yfinance responses as fixtures for the suite')
+    record_parser.add_argument('--symbols', nargs='+', required=True, help='Symbols to record')
+    record_parser.add_argument('--output', default='fixtures', help='Directory to write the fixtures to')
+    record_parser.add_argument('--period', default='1y', help='Period of price history to record')
+
+    args = parser.parse_args(argv)
+
+    logging.getLogger('stock_data').setLevel(logging.CRITICAL)
+    logging.getLogger('fetch_engine').setLevel(logging.CRITICAL)
+    logging.getLogger('rate_limiter').setLevel(logging.CRITICAL)
+
+    if args.benchmark == 'analytics':
+        results = run_analytics_benchmark(args.symbols, args.years, args.window, args.baseline_symbols)
+        print(f'symbols={args.symbols} years={args.years} {format_results(results)}')
+
+    elif args.benchmark == 'writes':
+        engine_options = database_actions.EngineOptions.from_env()
+        overrides = {'pool_size': args.pool_size, 'max_overflow': args.max_overflow, 'insertmanyvalues_page_size': args.page_size}
+        engine_options = engine_options._replace(**{name: value for name, value in overrides.items() if value is not None})
+        for writers in args.writers:
+            results = run_write_benchmark(args.database_url, writers, args.batches, args.rows, engine_options)
+            print(f'writers={writers:3d} {format_results(results)}')
+
+    elif args.benchmark == 'record':
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+        record_fixtures(args.symbols, args.output, args.period)
+
+    elif args.benchmark == 'suite':
+        options = {'symbols': args.symbols,
+                   'latency': args.latency,
+                   'failure_rate': args.failure_rate,
+                   'workers': args.workers,
+                   'fixtures': args.fixtures,
+                   'database_url': args.database_url}
+        results = run_suite(args.scenarios, options)
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)['results']
+        print(format_suite_results(results, baseline))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'options': options, 'results': results}, f, indent=2)
+
+    elif args.benchmark == 'rate-limit':
+        if args.check:
+            failed = False
+            for workers in args.workers:
+                results = run_rate_limit_check(args.threshold, workers, args.requests, args.latency, args.max_rejected)
+                failures = results.pop('failures')
+                print(f'workers={workers:3d} {format_results(results)}')
+                for failure in failures:
+                    print(f'FAILED: {failure}')
+                failed = failed or len(failures) > 0
+            sys.exit(1 if failed else 0)
+        for workers in args.workers:
+            results = run_rate_limit_benchmark(args.symbols, args.latency, workers, args.threshold, args.rate, args.burst)
+            print(f'workers={workers:3d} {format_results(results)}')
+
+    elif args.benchmark == 'conversion':
+        results = run_conversion_benchmark(args.rows)
+        for name, rows_per_second in results.items():
+            print(f'{name:20s} {rows_per_second:12,.0f} rows/s  ({rows_per_second / results["loop_orm"]:.0f}x)')
+
+    else:
+        baseline = None
+        for workers in args.workers:
+            timings = run_fetch_benchmark(args.symbols, args.latency, workers, args.failure_rate)
+            batch_requests = timings.pop('stock_price_batch_requests')
+            symbol_requests = timings.pop('stock_price_symbol_requests')
+            total = sum(timings.values())
+            if baseline is None:
+                baseline = total
+            details = ', '.join(f'{name}={seconds:.2f}s' for name, seconds in timings.items())
+            print(f'workers={workers:3d} total={total:.2f}s speedup={baseline / total:.1f}x ({details}, '
+                  f'price batch requests={batch_requests}, single-symbol price requests={symbol_requests})')
+
+
+if __name__ == '__main__':
+    main()
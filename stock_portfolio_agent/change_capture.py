@@ -0,0 +1,132 @@
+
+"""
+This module turns daily snapshots into validity intervals, so that a dataset whose values rarely change
+is written once per change instead of once per day.
+"""
+
+import datetime
+import hashlib
+import logging
+import math
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+import sqlalchemy
+
+import database_actions
+import instrumentation
+
+
+logger = logging.getLogger(__name__)
+
+
+def row_hash(values: List[Any]) -> str:
+    """
+    Hashes the values of a snapshot row. Numbers are compared as floats, so a count read back as a float
+    hashes like the integer it was fetched as, and missing values hash alike whether they are None or NaN.
+
+    Args:
+        values (List[Any]): The compared values of the row, in a fixed column order.
+
+    Returns:
+        str: The hex MD5 digest
+    """
+    parts = []
+    for value in values:
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            parts.append('')
+        elif isinstance(value, (int, float)):
+            parts.append(repr(float(value)))
+        else:
+            parts.append(str(value))
+    return hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+class ChangeCapture:
+    """
+    Compares fetched snapshots with the current interval of each symbol in a history table, whose key is
+    (symbol, valid_from) and whose valid_to is null for the current interval. The hash and start of every
+    current interval are loaded in one query and kept in memory for the run.
+    """
+
+    def __init__(self, db_actions: database_actions.DatabaseActions, history_table: sqlalchemy.Table, value_columns: List[str]):
+        """
+        Args:
+            db_actions (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+            history_table (sqlalchemy.Table): The history table, e.g. RecommendationHistory.__table__.
+            value_columns (List[str]): The snapshot columns that are compared and stored.
+        """
+        self._db_actions = db_actions
+        self._table = history_table
+        self._value_columns = value_columns
+        self._current: Optional[Dict[str, Tuple[str, datetime.date]]] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Tuple[str, datetime.date]]:
+        """
+        Retrieves the current intervals, reading them from the database on the first call only.
+
+        Returns:
+            Dict[str, Tuple[str, datetime.date]]: The row hash and valid_from of the current interval of each symbol
+        """
+        with self._lock:
+            if self._current is None:
+                query = (sqlalchemy.select(self._table.c.symbol, self._table.c.row_hash, self._table.c.valid_from)
+                         .where(self._table.c.valid_to.is_(None)))
+                with self._db_actions.get_engine().connect() as conn:
+                    self._current = {r[0]: (r[1], r[2]) for r in conn.execute(query).all()}
+            return self._current
+
+    def changes(self, connection: sqlalchemy.Connection, batch: pd.DataFrame) -> pd.DataFrame:
+        """
+        Closes the current interval of every symbol whose snapshot differs from it, and returns the rows of the
+        intervals that replace them. Unchanged symbols produce nothing. Meant to be passed as the transform of a
+        pipeline.StreamingWriter, so the closing updates share the transaction that writes the new intervals.
+
+        Args:
+            connection (sqlalchemy.Connection): The connection whose transaction writes the batch.
+            batch (pd.DataFrame): Snapshot rows with symbol, date and the value columns.
+
+        Returns:
+            pd.DataFrame: The new intervals, in the columns of the history table
+        """
+        columns = ['symbol', 'valid_from', 'valid_to'] + self._value_columns + ['row_hash', 'inserted_at']
+        if len(batch) == 0:
+            return pd.DataFrame(columns=columns)
+
+        current = self.load()
+        now = datetime.datetime.now()
+        opened = []
+        closed = []
+        # A symbol fetched twice in one batch is compared on its last snapshot
+        snapshots = batch.drop_duplicates(subset=['symbol'], keep='last')
+        for row in snapshots.to_dict('records'):
+            snapshot_date = row['date'].date() if isinstance(row['date'], datetime.datetime) else row['date']
+            digest = row_hash([row[column] for column in self._value_columns])
+            with self._lock:
+                previous = current.get(row['symbol'])
+                if previous is not None and previous[0] == digest:
+                    continue
+                if previous is not None:
+                    closed.append({'symbol': row['symbol'], 'valid_from': previous[1], 'valid_to': snapshot_date})
+                current[row['symbol']] = (digest, snapshot_date)
+            opened.append({'symbol': row['symbol'],
+                           'valid_from': snapshot_date,
+                           'valid_to': None,
+                           **{column: row[column] for column in self._value_columns},
+                           'row_hash': digest,
+                           'inserted_at': now})
+
+        if len(closed) > 0:
+            statement = (self._table.update()
+                         .where(self._table.c.symbol == sqlalchemy.bindparam('key_symbol'))
+                         .where(self._table.c.valid_from == sqlalchemy.bindparam('key_valid_from'))
+                         .values(valid_to=sqlalchemy.bindparam('new_valid_to')))
+            connection.execute(statement, [{'key_symbol': row['symbol'],
+                                            'key_valid_from': row['valid_from'],
+                                            'new_valid_to': row['valid_to']} for row in closed])
+
+        instrumentation.metrics.increment('unchanged', len(snapshots) - len(opened), table=self._table.name)
+        logger.info(f'{len(opened)} of {len(snapshots)} snapshots changed for {self._table.fullname}')
+        return pd.DataFrame(opened, columns=columns)
@@ -0,0 +1,232 @@
+
+"""
+This module is the command line entry point of the ingestion, analytics and benchmark tools. Only the
+standard library is imported up front: each subcommand imports the modules it needs when it runs, so that
+--help and the status commands start quickly enough for cron jobs and health checks.
+
+Examples:
+    python cli.py ingest
+    python cli.py ingest recommendation price_target --change-capture
+    python cli.py ingest stock_price --processes 8 --report-file run_report.json
+    python cli.py resume 20240102T060000
+    python cli.py status
+    python cli.py watermarks stock_price --symbols AAPL MSFT
+    python cli.py analytics summary --start 2015-01-01 --output summary.csv
+    python cli.py benchmark suite --symbols 500
+"""
+
+import argparse
+import logging
+import os
+import sys
+from typing import List
+
+
+logger = logging.getLogger(__name__)
+
+# The commands that run another module's main, with the number of leading words parsed here
+FORWARDED_COMMANDS = {'ingest': 1, 'resume': 2, 'analytics': 1, 'benchmark': 1}
+
+
+def _split_datasets(argv: List[str]) -> List[str]:
+    # The leading words of 'ingest' are datasets, the rest are options of main.py
+    datasets = []
+    while len(datasets) < len(argv) and not argv[len(datasets)].startswith('-'):
+        datasets.append(argv[len(datasets)])
+    rest = argv[len(datasets):]
+    return (['--datasets', *datasets] if len(datasets) > 0 else []) + rest
+
+
+def run_ingest(args: argparse.Namespace) -> int:
+    import main
+
+    main.main(_split_datasets(args.options))
+    return 0
+
+
+def run_resume(args: argparse.Namespace) -> int:
+    import main
+
+    main.main(['--resume', args.run_id, *_split_datasets(args.options)])
+    return 0
+
+
+def run_analytics(args: argparse.Namespace) -> int:
+    import analytics
+
+    analytics.main(args.options)
+    return 0
+
+
+def run_benchmark(args: argparse.Namespace) -> int:
+    import benchmark
+
+    benchmark.main(args.options)
+    return 0
+
+
+def _get_database_actions():
+    import database_actions
+
+    connection_string = os.getenv('DATABASE_URL')
+    if not connection_string:
+        raise SystemExit('DATABASE_URL is not set')
+    return database_actions.DatabaseActions(connection_string)
+
+
+def _reflect_raw_table(engine, name: str):
+    """
+    Reads the columns of a raw_data table from the database rather than from its model, as importing the
+    models loads sqlalchemy.orm, which would double the start-up time of the status commands.
+
+    Returns:
+        sqlalchemy.Table: The table, or None if no run has created it yet
+    """
+    import sqlalchemy
+    import database_actions
+
+    schema = database_actions.DatabaseActions.raw_schema_name
+    if not sqlalchemy.inspect(engine).has_table(name, schema=schema):
+        return None
+    return sqlalchemy.Table(name, sqlalchemy.MetaData(), schema=schema, autoload_with=engine)
+
+
+def show_status(args: argparse.Namespace) -> int:
+    """
+    Prints the number of finished and failed symbols of each dataset of a run, from its checkpoints.
+
+    Returns:
+        int: 0, or 1 if the run has no checkpoints
+    """
+    import sqlalchemy
+
+    engine = _get_database_actions().get_engine()
+    table = _reflect_raw_table(engine, 'ingest_run_state')
+    if table is None:
+        print('No runs recorded')
+        return 1
+
+    with engine.connect() as conn:
+        run_id = args.run_id
+        if run_id is None:
+            run_id = conn.execute(sqlalchemy.select(table.c.run_id).order_by(table.c.updated_at.desc()).limit(1)).scalar()
+        query = (sqlalchemy.select(table.c.dataset, table.c.status, sqlalchemy.func.count(), sqlalchemy.func.max(table.c.updated_at))
+                 .where(table.c.run_id == run_id)
+                 .group_by(table.c.dataset, table.c.status))
+        rows = conn.execute(query).all() if run_id is not None else []
+
+    if len(rows) == 0:
+        print(f'No checkpoints for run {run_id}' if run_id is not None else 'No runs recorded')
+        return 1
+
+    datasets = {}
+    for dataset, state, count, updated_at in rows:
+        entry = datasets.setdefault(dataset, {'done': 0, 'failed': 0, 'updated_at': updated_at})
+        # The status is run_state.IngestRunState.STATUS_DONE or STATUS_FAILED
+        entry['done' if state == 'done' else 'failed'] += count
+        entry['updated_at'] = max(entry['updated_at'], updated_at)
+
+    print(f'Run {run_id}')
+    print(f'{"dataset":<20} {"done":>8} {"failed":>8}  last update')
+    for dataset, entry in sorted(datasets.items()):
+        print(f'{dataset:<20} {entry["done"]:>8} {entry["failed"]:>8}  {entry["updated_at"]}')
+    return 0
+
+
+def show_watermarks(args: argparse.Namespace) -> int:
+    """
+    Prints, for each dataset, how many symbols have a watermark and the range of their last ingested dates, or
+    with --symbols the last ingested date of each symbol. Reads raw_data.ingest_watermark only, without
+    seeding it.
+
+    Returns:
+        int: 0, or 1 if there are no watermarks to show
+    """
+    import sqlalchemy
+
+    engine = _get_database_actions().get_engine()
+    table = _reflect_raw_table(engine, 'ingest_watermark')
+    if table is None:
+        print('No watermarks recorded')
+        return 1
+
+    with engine.connect() as conn:
+        if args.symbols:
+            query = (sqlalchemy.select(table.c.dataset, table.c.symbol, table.c.last_date, table.c.updated_at)
+                     .where(table.c.symbol.in_(args.symbols))
+                     .order_by(table.c.dataset, table.c.symbol))
+        else:
+            query = (sqlalchemy.select(table.c.dataset, sqlalchemy.func.count(), sqlalchemy.func.min(table.c.last_date),
+                                       sqlalchemy.func.max(table.c.last_date))
+                     .group_by(table.c.dataset)
+                     .order_by(table.c.dataset))
+        if args.dataset is not None:
+            query = query.where(table.c.dataset == args.dataset)
+        rows = conn.execute(query).all()
+
+    if len(rows) == 0:
+        print('No watermarks recorded')
+        return 1
+
+    if args.symbols:
+        print(f'{"dataset":<20} {"symbol":<10} {"last date":<12} updated')
+        for dataset, symbol, last_date, updated_at in rows:
+            print(f'{dataset:<20} {symbol:<10} {str(last_date):<12} {updated_at}')
+    else:
+        print(f'{"dataset":<20} {"symbols":>8}  {"oldest":<12} newest')
+        for dataset, count, oldest, newest in rows:
+            print(f'{dataset:<20} {count:>8}  {str(oldest):<12} {newest}')
+    return 0
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='cli.py', description='Ingest, inspect and analyse stock data')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    # The options of ingest, analytics and benchmark are those of main.py, analytics.py and benchmark.py
+    ingest_parser = subparsers.add_parser('ingest', add_help=False,
+                                          help='Download datasets into the database, e.g. "ingest stock_price --processes 4". Defaults to all datasets.')
+    ingest_parser.add_argument('options', nargs='*', help='Datasets followed by options of main.py')
+    ingest_parser.set_defaults(handler=run_ingest)
+
+    resume_parser = subparsers.add_parser('resume', help='Resume a run, skipping the symbols it already finished')
+    resume_parser.add_argument('run_id', help='The id of the run to resume')
+    resume_parser.add_argument('options', nargs='*', help='Datasets and other options of ingest')
+    resume_parser.set_defaults(handler=run_resume)
+
+    analytics_parser = subparsers.add_parser('analytics', add_help=False, help='Compute analytics over stored prices')
+    analytics_parser.add_argument('options', nargs='*')
+    analytics_parser.set_defaults(handler=run_analytics)
+
+    benchmark_parser = subparsers.add_parser('benchmark', add_help=False, help='Run the ingestion and analytics benchmarks')
+    benchmark_parser.add_argument('options', nargs='*')
+    benchmark_parser.set_defaults(handler=run_benchmark)
+
+    status_parser = subparsers.add_parser('status', help='Show the progress of a run from its checkpoints')
+    status_parser.add_argument('run_id', nargs='?', help='The run to show. Defaults to the most recently updated run.')
+    status_parser.set_defaults(handler=show_status)
+
+    watermarks_parser = subparsers.add_parser('watermarks', help='Show the ingest watermarks')
+    watermarks_parser.add_argument('dataset', nargs='?', help='Show only this dataset')
+    watermarks_parser.add_argument('--symbols', nargs='+', help='Show the watermark of each of these symbols')
+    watermarks_parser.set_defaults(handler=show_watermarks)
+
+    # argparse does not pass on options that come right after a subcommand, so the arguments of the commands
+    # that run another module's main are split off before parsing
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) > 0 and argv[0] in FORWARDED_COMMANDS:
+        parsed = FORWARDED_COMMANDS[argv[0]]
+        args = parser.parse_args(argv[:parsed])
+        args.options = argv[parsed:]
+        return args
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    args = parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,312 @@
 
+import contextlib
+import io
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, NamedTuple, Optional, Union
+
 import sqlalchemy
-import pandas as pd
+from sqlalchemy.dialects import postgresql, sqlite
+
+import instrumentation
+
+if TYPE_CHECKING:
+    # pandas is imported by the first write, so that read-only commands start without it
+    import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+class BulkLoadResult(NamedTuple):
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+class EngineOptions(NamedTuple):
+    """
+    The connection pool and statement settings of the engine of a DatabaseActions.
+
+    pool_size connections are kept open, and up to max_overflow more are opened while all of them are checked
+    out; a checkout waits at most pool_timeout seconds for one to be returned. pool_recycle replaces connections
+    older than that many seconds, and pool_pre_ping tests each connection on checkout, both of which avoid
+    failures on connections the server or a proxy has dropped. statement_timeout cancels statements that run
+    longer than that many seconds, on PostgreSQL only. insertmanyvalues_page_size is the number of rows of an
+    executemany insert sent per INSERT .. VALUES statement.
+    """
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_recycle: int = -1
+    pool_pre_ping: bool = False
+    statement_timeout: Optional[float] = None
+    insertmanyvalues_page_size: int = 1000
+
+    @classmethod
+    def from_env(cls) -> 'EngineOptions':
+        """
+        Reads the options from the DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+        DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT and DB_INSERTMANYVALUES_PAGE_SIZE environment variables,
+        with the defaults of the class for those that are not set.
+        """
+        statement_timeout = os.getenv('DB_STATEMENT_TIMEOUT')
+        return cls(pool_size=int(os.getenv('DB_POOL_SIZE', cls._field_defaults['pool_size'])),
+                   max_overflow=int(os.getenv('DB_MAX_OVERFLOW', cls._field_defaults['max_overflow'])),
+                   pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', cls._field_defaults['pool_timeout'])),
+                   pool_recycle=int(os.getenv('DB_POOL_RECYCLE', cls._field_defaults['pool_recycle'])),
+                   pool_pre_ping=os.getenv('DB_POOL_PRE_PING', '').lower() in ('1', 'true', 'yes'),
+                   statement_timeout=float(statement_timeout) if statement_timeout else None,
+                   insertmanyvalues_page_size=int(os.getenv('DB_INSERTMANYVALUES_PAGE_SIZE',
+                                                            cls._field_defaults['insertmanyvalues_page_size'])))
+
+    def engine_arguments(self, url: sqlalchemy.URL) -> Dict[str, Any]:
+        """
+        Args:
+            url (sqlalchemy.URL): The URL of the database.
+
+        Returns:
+            Dict[str, Any]: The keyword arguments of create_engine for the database
+        """
+        arguments = {'pool_pre_ping': self.pool_pre_ping,
+                     'insertmanyvalues_page_size': self.insertmanyvalues_page_size}
+        if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+            # An in-memory SQLite database lives in a single connection, so every thread, the writer threads
+            # included, must share that one connection, never recycled, to see the same tables
+            arguments.update(poolclass=sqlalchemy.StaticPool, connect_args={'check_same_thread': False})
+        else:
+            arguments.update(pool_size=self.pool_size, max_overflow=self.max_overflow, pool_timeout=self.pool_timeout,
+                             pool_recycle=self.pool_recycle)
+        if url.get_backend_name() == 'postgresql' and self.statement_timeout is not None:
+            arguments['connect_args'] = {'options': f'-c statement_timeout={int(self.statement_timeout * 1000)}'}
+        return arguments
 
 
 class DatabaseActions:
     raw_schema_name = 'raw_data'
 
-    def __init__(self, connection_string: str):
-        self._engine = sqlalchemy.create_engine(connection_string)
+    ON_CONFLICT_UPDATE = 'update'
+    ON_CONFLICT_NOTHING = 'nothing'
+
+    def __init__(self, connection_string: str, bulk_batch_size: Optional[int] = None,
+                 engine_options: Optional[EngineOptions] = None):
+        """
+        Creates the engine without connecting; no connection is opened until the first query.
+
+        Args:
+            connection_string (str): The SQLAlchemy URL of the database.
+            bulk_batch_size (int, optional): The number of rows written per statement by bulk_load.
+                Defaults to the BULK_BATCH_SIZE environment variable, or 10000.
+            engine_options (EngineOptions, optional): The pool and statement settings of the engine.
+                Defaults to EngineOptions.from_env().
+        """
+        url = sqlalchemy.make_url(connection_string)
+        self._engine_options = engine_options if engine_options is not None else EngineOptions.from_env()
+        self._engine = sqlalchemy.create_engine(url, **self._engine_options.engine_arguments(url))
+        self._bulk_batch_size = bulk_batch_size if bulk_batch_size is not None else int(os.getenv('BULK_BATCH_SIZE', 10000))
 
-        
-        with self._engine.connect() as connection:
+        if self._engine.dialect.name == 'sqlite':
+            # SQLite has no schemas, so the raw_data schema is an attached database on every connection
+            sqlalchemy.event.listen(self._engine, 'connect', self._attach_sqlite_schema)
+        for event in ('connect', 'checkout', 'close', 'invalidate'):
+            sqlalchemy.event.listen(self._engine, event, self._pool_event_counter(event))
+
+    @staticmethod
+    def _pool_event_counter(event: str):
+        # Counts pool events: connections opened and closed against checkouts give the connection churn
+        def count(*args):
+            instrumentation.metrics.increment('db_pool_events', event=event)
+        return count
+
+    def create_schema(self):
+        """
+        Creates the raw_data schema if it does not exist. Run once before creating the tables; SQLite needs
+        nothing, as the schema is attached on connect.
+        """
+        if self._engine.dialect.name == 'sqlite':
+            return
+        with self._engine.begin() as connection:
             connection.execute(sqlalchemy.schema.CreateSchema(DatabaseActions.raw_schema_name, if_not_exists=True))
-            connection.commit()
+
+    def _attach_sqlite_schema(self, dbapi_connection, connection_record):
+        database = self._engine.url.database
+        if not database or database == ':memory:':
+            path = ':memory:'
+        else:
+            path = f'{os.path.splitext(database)[0]}.{DatabaseActions.raw_schema_name}.db'
+        dbapi_connection.execute(f"ATTACH DATABASE '{path}' AS {DatabaseActions.raw_schema_name}")
 
     def get_engine(self):
-        return self._engine
\ No newline at end of file
+        return self._engine
+
+    @contextlib.contextmanager
+    def write_transaction(self) -> Iterator[sqlalchemy.Connection]:
+        """
+        Checks a connection out of the engine's pool and yields it inside a transaction that commits when the
+        block ends, or rolls back if it raises. Writer threads may use it concurrently, each getting a connection
+        of its own from the shared pool, so the number of connections is bounded by the pool settings rather than
+        the number of writers. The wait for a connection is recorded in the 'pool_wait_seconds' histogram.
+
+        Yields:
+            sqlalchemy.Connection: The connection to write with
+        """
+        with instrumentation.metrics.timer('pool_wait'):
+            connection = self._engine.connect()
+        try:
+            with connection.begin():
+                yield connection
+        finally:
+            connection.close()
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: The configured pool size and overflow, and the connections currently checked in, checked
+                out and in overflow. Only the status text is available for pools that are not a QueuePool.
+        """
+        pool = self._engine.pool
+        if not isinstance(pool, sqlalchemy.QueuePool):
+            return {'status': pool.status()}
+        return {'pool_size': pool.size(),
+                'max_overflow': self._engine_options.max_overflow,
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow()}
+
+    def bulk_load(self, table: sqlalchemy.Table, rows: Union['pd.DataFrame', List[Dict[str, Any]]],
+                  batch_size: Optional[int] = None,
+                  connection: Optional[sqlalchemy.Connection] = None,
+                  on_conflict: Optional[str] = None) -> BulkLoadResult:
+        """
+        Writes rows to a table with the fastest path the dialect offers: COPY into a temporary staging
+        table on PostgreSQL with psycopg2 or psycopg, and executemany inserts everywhere else.
+
+        With on_conflict set, rows whose primary key already exists are updated (ON_CONFLICT_UPDATE) or
+        skipped (ON_CONFLICT_NOTHING) instead of failing the write, so a partial or repeated run can be
+        written again safely. Upserts are supported on PostgreSQL and SQLite.
+
+        Args:
+            table (sqlalchemy.Table): The table to write to, e.g. StockPrice.__table__.
+            rows (Union[pd.DataFrame, List[Dict[str, Any]]]): The rows, as a frame whose columns are table columns
+                or as one dict per row.
+            batch_size (int, optional): The number of rows written per statement. Defaults to the batch size
+                the instance was created with.
+            connection (sqlalchemy.Connection, optional): A connection with an open transaction to write with.
+                If None, the rows are written and committed in a transaction of their own.
+            on_conflict (str, optional): ON_CONFLICT_UPDATE, ON_CONFLICT_NOTHING, or None to insert plainly.
+                Defaults to None.
+
+        Returns:
+            BulkLoadResult: The number of rows written and the seconds it took
+        """
+        import pandas as pd
+
+        frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        if len(frame) == 0:
+            return BulkLoadResult(0, 0.0)
+
+        if on_conflict not in (None, DatabaseActions.ON_CONFLICT_UPDATE, DatabaseActions.ON_CONFLICT_NOTHING):
+            raise ValueError(f'Unknown on_conflict mode: {on_conflict}')
+        if on_conflict is not None:
+            # A single statement may not touch the same key twice, so keep the last row of each key
+            frame = frame.drop_duplicates(subset=[column.name for column in table.primary_key.columns], keep='last')
+
+        batch_size = batch_size if batch_size is not None else self._bulk_batch_size
+        start = time.perf_counter()
+        with instrumentation.metrics.timer('write', table=table.name):
+            if connection is None:
+                with self.write_transaction() as connection:
+                    self._write_batches(connection, table, frame, batch_size, on_conflict)
+            else:
+                self._write_batches(connection, table, frame, batch_size, on_conflict)
+        result = BulkLoadResult(len(frame), time.perf_counter() - start)
+        instrumentation.metrics.increment('rows_written', result.rows, table=table.name)
+
+        logger.info(f'Wrote {result.rows} rows to {table.fullname} in {result.seconds:.2f}s ({result.rows_per_second:,.0f} rows/s)')
+        return result
+
+    def _write_batches(self, connection: sqlalchemy.Connection, table: sqlalchemy.Table, frame: 'pd.DataFrame',
+                       batch_size: int, on_conflict: Optional[str]):
+        import frame_conversion
+
+        use_copy = connection.dialect.name == 'postgresql' and connection.dialect.driver in ('psycopg2', 'psycopg')
+        if use_copy:
+            staging_name = self._create_staging_table(connection, table)
+        else:
+            statement = self._insert_statement(connection, table, list(frame.columns), on_conflict)
+        for k in range(0, len(frame), batch_size):
+            batch = frame.iloc[k:k + batch_size]
+            if use_copy:
+                self._copy_batch(connection, table, staging_name, batch, on_conflict)
+            else:
+                connection.execute(statement, frame_conversion.to_records(batch))
+
+    @staticmethod
+    def _insert_statement(connection: sqlalchemy.Connection, table: sqlalchemy.Table, columns: List[str], on_conflict: Optional[str]):
+        if on_conflict is None:
+            return table.insert()
+
+        if connection.dialect.name == 'postgresql':
+            insert = postgresql.insert
+        elif connection.dialect.name == 'sqlite':
+            insert = sqlite.insert
+        else:
+            raise ValueError(f'Upserts are not supported on {connection.dialect.name}')
+
+        key_columns = [column.name for column in table.primary_key.columns]
+        statement = insert(table)
+        if on_conflict == DatabaseActions.ON_CONFLICT_NOTHING:
+            return statement.on_conflict_do_nothing(index_elements=key_columns)
+        update_columns = {column: statement.excluded[column] for column in columns if column not in key_columns}
+        return statement.on_conflict_do_update(index_elements=key_columns, set_=update_columns)
+
+    @staticmethod
+    def _on_conflict_clause(connection: sqlalchemy.Connection, table: sqlalchemy.Table, columns: List[str], on_conflict: Optional[str]) -> str:
+        if on_conflict is None:
+            return ''
+
+        preparer = connection.dialect.identifier_preparer
+        key_columns = [column.name for column in table.primary_key.columns]
+        conflict_target = ', '.join(preparer.quote(column) for column in key_columns)
+        if on_conflict == DatabaseActions.ON_CONFLICT_NOTHING:
+            return f' ON CONFLICT ({conflict_target}) DO NOTHING'
+        assignments = ', '.join(f'{preparer.quote(column)} = EXCLUDED.{preparer.quote(column)}'
+                                for column in columns if column not in key_columns)
+        return f' ON CONFLICT ({conflict_target}) DO UPDATE SET {assignments}'
+
+    @staticmethod
+    def _create_staging_table(connection: sqlalchemy.Connection, table: sqlalchemy.Table) -> str:
+        preparer = connection.dialect.identifier_preparer
+        staging_name = preparer.quote(f'{table.name}_staging')
+        connection.exec_driver_sql(f'CREATE TEMPORARY TABLE IF NOT EXISTS {staging_name} '
+                                   f'(LIKE {preparer.format_table(table)} INCLUDING DEFAULTS) ON COMMIT DROP')
+        return staging_name
+
+    @staticmethod
+    def _copy_batch(connection: sqlalchemy.Connection, table: sqlalchemy.Table, staging_name: str, batch: 'pd.DataFrame',
+                    on_conflict: Optional[str]):
+        preparer = connection.dialect.identifier_preparer
+        columns = ', '.join(preparer.quote(column) for column in batch.columns)
+        copy_sql = f'COPY {staging_name} ({columns}) FROM STDIN WITH (FORMAT csv)'
+
+        buffer = io.StringIO()
+        batch.to_csv(buffer, index=False, header=False, na_rep='')
+
+        cursor = connection.connection.driver_connection.cursor()
+        try:
+            if connection.dialect.driver == 'psycopg2':
+                buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+            else:
+                with cursor.copy(copy_sql) as copy:
+                    copy.write(buffer.getvalue())
+        finally:
+            cursor.close()
+
+        connection.exec_driver_sql(f'INSERT INTO {preparer.format_table(table)} ({columns}) SELECT {columns} FROM {staging_name}'
+                                   + DatabaseActions._on_conflict_clause(connection, table, list(batch.columns), on_conflict))
+        connection.exec_driver_sql(f'TRUNCATE {staging_name}')
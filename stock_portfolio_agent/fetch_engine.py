@@ -0,0 +1,157 @@
+
+"""
+This module contains a worker-pool engine for fetching per-symbol data concurrently.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import os
+import random
+import time
+from typing import Callable, Iterable, Iterator, List, Optional, TypeVar
+
+import instrumentation
+import rate_limiter
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class FetchEngine:
+    def __init__(self, max_workers: int = 8, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0,
+                 limiter: Optional[rate_limiter.RateLimiter] = None):
+        """
+        Args:
+            max_workers (int, optional): The maximum number of symbols fetched at the same time. Defaults to 8.
+            max_attempts (int, optional): The number of times a single call is attempted before giving up. Defaults to 3.
+            base_delay (float, optional): The upper bound in seconds of the first backoff delay. Defaults to 0.5.
+            max_delay (float, optional): The cap in seconds on any single backoff delay. Defaults to 8.0.
+            limiter (rate_limiter.RateLimiter, optional): The rate limiter every attempt goes through.
+                If None, calls are not rate limited.
+        """
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1')
+
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = limiter
+
+    @classmethod
+    def from_env(cls) -> 'FetchEngine':
+        """
+        Builds a FetchEngine from the FETCH_MAX_WORKERS, FETCH_MAX_ATTEMPTS, FETCH_BASE_DELAY and
+        FETCH_MAX_DELAY environment variables, using the constructor defaults for any that are unset.
+        The engine gets a rate limiter configured by RateLimiter.from_env.
+
+        Returns:
+            FetchEngine: The configured engine
+        """
+        return cls(max_workers=int(os.getenv('FETCH_MAX_WORKERS', 8)),
+                   max_attempts=int(os.getenv('FETCH_MAX_ATTEMPTS', 3)),
+                   base_delay=float(os.getenv('FETCH_BASE_DELAY', 0.5)),
+                   max_delay=float(os.getenv('FETCH_MAX_DELAY', 8.0)),
+                   limiter=rate_limiter.RateLimiter.from_env())
+
+    def backoff_delay(self, attempt: int) -> float:
+        """
+        Computes the delay before the next attempt using exponential backoff with full jitter, so
+        that workers which failed together do not all retry at the same instant.
+
+        Args:
+            attempt (int): The number of attempts that have failed so far (1 for the first failure).
+
+        Returns:
+            float: The number of seconds to wait
+        """
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    def call_with_retry(self, description: str, func: Callable[[], T], dataset: str = 'other', cost: int = 1) -> T:
+        """
+        Calls func, retrying with jittered exponential backoff when it raises. Every attempt first waits
+        for the rate limiter, and reports its outcome back to it. The time taken including retries is
+        recorded in the fetch_seconds histogram, and retries and failures are counted.
+
+        Args:
+            description (str): A short description of the call, used in log messages.
+            func (Callable[[], T]): The call to make.
+            dataset (str, optional): The dataset the call fetches, used as the label of its metrics. Defaults to 'other'.
+            cost (int, optional): The number of upstream requests one attempt makes, taken from the rate limiter
+                per attempt. Defaults to 1.
+
+        Returns:
+            T: The value returned by func
+
+        Raises:
+            Exception: The exception raised by the last attempt, if every attempt failed.
+        """
+        attempt = 0
+        with instrumentation.metrics.timer('fetch', dataset=dataset):
+            while True:
+                if self.limiter is not None:
+                    self.limiter.acquire(cost)
+                try:
+                    result = func()
+                except Exception as e:
+                    attempt += 1
+                    logger.error(f'Error getting {description} (attempt {attempt} of {self.max_attempts}): {e}')
+                    if self.limiter is not None:
+                        self.limiter.on_error(e)
+                    if attempt >= self.max_attempts:
+                        if self.limiter is not None:
+                            self.limiter.on_failure()
+                        instrumentation.metrics.increment('failed_calls', dataset=dataset)
+                        raise
+                    if self.limiter is not None:
+                        self.limiter.on_retry()
+                    instrumentation.metrics.increment('retries', dataset=dataset)
+                    time.sleep(self.backoff_delay(attempt))
+                    continue
+                if self.limiter is not None:
+                    self.limiter.on_success()
+                return result
+
+    def imap(self, func: Callable[[R], T], items: Iterable[R]) -> Iterator[T]:
+        """
+        Applies func to every item on the worker pool and yields the results in the same order as items.
+
+        At most 2 * max_workers calls are in flight or waiting to be consumed at any time, so a large
+        iterable of items is never submitted to the pool all at once.
+
+        Args:
+            func (Callable[[R], T]): The function to apply to each item.
+            items (Iterable[R]): The items, usually stock symbols.
+
+        Returns:
+            Iterator[T]: The results of func, in the order of items
+        """
+        window = 2 * self.max_workers
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = collections.deque()
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def map(self, func: Callable[[R], T], items: Iterable[R]) -> List[T]:
+        """
+        Applies func to every item on the worker pool.
+
+        Args:
+            func (Callable[[R], T]): The function to apply to each item.
+            items (Iterable[R]): The items, usually stock symbols.
+
+        Returns:
+            List[T]: The results of func, in the order of items
+        """
+        return list(self.imap(func, items))
@@ -0,0 +1,124 @@
+
+"""
+This module converts yfinance frames to the columns of the raw_data tables in one vectorized pass,
+without building a pandas Series or an ORM object per row.
+"""
+
+import datetime
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+STOCK_PRICE_COLUMNS = ['id', 'symbol', 'date', 'open_price', 'high_price', 'low_price', 'close_price',
+                       'volume', 'dividends', 'stock_splits', 'inserted_at']
+
+_STOCK_PRICE_SOURCE_COLUMNS = {'Open': 'open_price',
+                               'High': 'high_price',
+                               'Low': 'low_price',
+                               'Close': 'close_price',
+                               'Dividends': 'dividends',
+                               'Stock Splits': 'stock_splits'}
+
+
+def _offset_text(seconds: int) -> str:
+    sign = '-' if seconds < 0 else '+'
+    hours, minutes = divmod(abs(seconds) // 60, 60)
+    return f'{sign}{hours:02d}:{minutes:02d}'
+
+
+def isoformat_dates(dates: pd.Series) -> pd.Series:
+    """
+    Formats a datetime column the way Timestamp.isoformat does for whole seconds, including the
+    UTC offset of timezone-aware values (e.g. 2024-01-02T00:00:00-05:00). The local times are formatted
+    by numpy in one call, and each distinct offset is formatted once, so no strftime runs per row.
+
+    Args:
+        dates (pd.Series): A datetime64 column, with or without a timezone.
+
+    Returns:
+        pd.Series: The formatted strings
+    """
+    if dates.dt.tz is not None:
+        local = dates.dt.tz_localize(None)
+        utc = dates.dt.tz_convert('UTC').dt.tz_localize(None)
+        offsets = (local - utc).to_numpy(dtype='timedelta64[s]').astype(np.int64)
+    else:
+        local = dates
+        offsets = None
+
+    text = np.datetime_as_string(local.to_numpy(dtype='datetime64[s]'), unit='s').astype(object)
+    if offsets is not None:
+        # A symbol's frame has one offset, or two across daylight saving changes
+        unique, inverse = np.unique(offsets, return_inverse=True)
+        suffixes = np.array([_offset_text(int(seconds)) for seconds in unique], dtype=object)
+        text = text + suffixes[inverse]
+    return pd.Series(text, index=dates.index)
+
+
+def empty_stock_price_frame() -> pd.DataFrame:
+    return pd.DataFrame({column: pd.Series(dtype=object) for column in STOCK_PRICE_COLUMNS})
+
+
+def stock_price_frame(symbol: str, data_df: pd.DataFrame, now: datetime.datetime) -> pd.DataFrame:
+    """
+    Converts a frame in the format of Ticker.history(...).reset_index() to the columns of the
+    raw_data.stock_price table.
+
+    Args:
+        symbol (str): The stock symbol the frame belongs to.
+        data_df (pd.DataFrame): The price data, with Date, Open, High, Low, Close, Volume, Dividends and Stock Splits columns.
+        now (datetime.datetime): The value of the inserted_at column.
+
+    Returns:
+        pd.DataFrame: A frame with the columns in STOCK_PRICE_COLUMNS and one row per row of data_df
+    """
+    if len(data_df) == 0:
+        return empty_stock_price_frame()
+
+    dates = pd.to_datetime(data_df['Date']).reset_index(drop=True)
+    frame = pd.DataFrame({'id': symbol + '_' + isoformat_dates(dates),
+                          'symbol': symbol,
+                          'date': dates.dt.date})
+    for source, column in _STOCK_PRICE_SOURCE_COLUMNS.items():
+        frame[column] = data_df[source].to_numpy(dtype=np.float64)
+    frame['volume'] = data_df['Volume'].to_numpy(dtype=np.int64)
+    frame['inserted_at'] = now
+
+    return frame[STOCK_PRICE_COLUMNS]
+
+
+def concat_stock_price_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    frames = [frame for frame in frames if len(frame) > 0]
+    if len(frames) == 0:
+        return empty_stock_price_frame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def to_records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Converts a frame to one dict per row, with native Python values and None for missing values, as
+    accepted by Connection.execute(insert(table), records).
+
+    Args:
+        frame (pd.DataFrame): The frame to convert.
+
+    Returns:
+        List[Dict[str, Any]]: The rows of the frame
+    """
+    return frame.astype(object).where(frame.notna(), None).to_dict(orient='records')
+
+
+def to_tuples(frame: pd.DataFrame) -> List[Tuple]:
+    """
+    Converts a frame to one tuple per row of native Python values, in column order, as accepted by a
+    DBAPI executemany.
+
+    Args:
+        frame (pd.DataFrame): The frame to convert.
+
+    Returns:
+        List[Tuple]: The rows of the frame
+    """
+    return list(zip(*(frame[column].tolist() for column in frame.columns)))
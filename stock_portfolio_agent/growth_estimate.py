@@ -2,7 +2,7 @@
 
 import datetime
 from database_base import Base
-from sqlalchemy import String, Date
+from sqlalchemy import String, Date, Float
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 
@@ -12,10 +12,10 @@ class GrowthEstimate(Base):
     id: Mapped[str] = mapped_column(primary_key=True)
     symbol: Mapped[str] = mapped_column(String(10))
     date: Mapped[datetime.date] = mapped_column(Date)
-    current_quarter: Mapped[float]
-    next_quarter: Mapped[float]
-    current_year: Mapped[float]
-    next_year: Mapped[float]
+    current_quarter: Mapped[float] = mapped_column(Float, nullable=True)
+    next_quarter: Mapped[float] = mapped_column(Float, nullable=True)
+    current_year: Mapped[float] = mapped_column(Float, nullable=True)
+    next_year: Mapped[float] = mapped_column(Float, nullable=True)
     
     def __repr__(self) -> str:
-        return f"GrowthEstimate(symbol={self.symbol}, date={self.date}, current_quarter={self.current_quarter}, next_quarter={self.next_quarter}, current_year={self.current_year}, next_year={self.next_year})"
\ No newline at end of file
+        return f"GrowthEstimate(symbol={self.symbol}, date={self.date}, current_quarter={self.current_quarter}, next_quarter={self.next_quarter}, current_year={self.current_year}, next_year={self.next_year})"
@@ -1,7 +1,7 @@
 
 import datetime
 from database_base import Base
-from sqlalchemy import String, Date
+from sqlalchemy import String, Date, BigInteger
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 
@@ -12,6 +12,9 @@ class InsiderTransaction(Base):
     id: Mapped[str] = mapped_column(primary_key=True)
     symbol: Mapped[str] = mapped_column(String(10))
     date: Mapped[datetime.date] = mapped_column(Date)
-    purchases: Mapped[int]
-    sales: Mapped[int]
-    insider_shares_held: Mapped[int]
+    purchases: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    sales: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    insider_shares_held: Mapped[int] = mapped_column(BigInteger, nullable=True)
+
+    def __repr__(self) -> str:
+        return f"InsiderTransaction(id={self.id}, symbol={self.symbol}, date={self.date}, purchases={self.purchases}, sales={self.sales}, insider_shares_held={self.insider_shares_held})"
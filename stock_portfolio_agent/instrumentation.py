@@ -0,0 +1,236 @@
+
+"""
+This module contains the counters, stage timers and latency histograms recorded during an ingestion run,
+and renders them as a JSON run report or in the Prometheus text format.
+"""
+
+import bisect
+import contextlib
+import json
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels_key(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _parse_labels(text: str) -> Labels:
+    if text == '':
+        return ()
+    return tuple(sorted(tuple(pair.split('=', 1)) for pair in text.split(',')))
+
+
+def _labels_text(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra is not None else [])
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, counts: List[int], total: float):
+        """
+        Adds the observations of another histogram with the same buckets.
+
+        Args:
+            counts (List[int]): Its count per bucket, with the count beyond the last bucket at the end.
+            total (float): Its sum.
+        """
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.count += sum(counts)
+        self.sum += total
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimates a quantile as the upper bound of the bucket it falls in.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            Optional[float]: The estimate, infinity if it falls beyond the last bucket, or None if nothing was observed
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    def __init__(self, prefix: str = 'ingest'):
+        """
+        Args:
+            prefix (str, optional): The prefix of every metric name in the Prometheus output. Defaults to 'ingest'.
+        """
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters: Dict[str, Dict[Labels, float]] = {}
+            self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+            self._started = time.time()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        """
+        Adds to a counter.
+
+        Args:
+            name (str): The counter name, e.g. 'rows_written'.
+            value (float, optional): The amount to add. Defaults to 1.
+            **labels: Labels distinguishing series of the counter, e.g. table='stock_price'.
+        """
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Records a value, usually a duration in seconds, in a histogram.
+
+        Args:
+            name (str): The histogram name, e.g. 'fetch_seconds'.
+            value (float): The observed value.
+            **labels: Labels distinguishing series of the histogram, e.g. dataset='recommendation'.
+        """
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, **labels) -> Iterator[None]:
+        """
+        Times a block as one observation of the '<stage>_seconds' histogram. The histogram sums give the
+        total time per stage; for stages run on several threads at once that total exceeds wall-clock time.
+
+        Args:
+            stage (str): The stage, e.g. 'fetch', 'convert' or 'write'.
+            **labels: Labels distinguishing series of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f'{stage}_seconds', time.perf_counter() - start, **labels)
+
+    def report(self) -> dict:
+        """
+        Returns:
+            dict: The counters, and for each histogram its count, sum, mean, p50, p99 and bucket counts, keyed by name
+                and then by labels rendered as 'name=value,...' ('' for no labels)
+        """
+        with self._lock:
+            counters = {name: {','.join(f'{k}={v}' for k, v in key): value for key, value in series.items()}
+                        for name, series in self._counters.items()}
+            histograms = {}
+            for name, series in self._histograms.items():
+                histograms[name] = {}
+                for key, histogram in series.items():
+                    histograms[name][','.join(f'{k}={v}' for k, v in key)] = {
+                        'count': histogram.count,
+                        'sum': histogram.sum,
+                        'mean': histogram.sum / histogram.count if histogram.count > 0 else None,
+                        'p50': histogram.quantile(0.5),
+                        'p99': histogram.quantile(0.99),
+                        'buckets': list(histogram.buckets),
+                        'bucket_counts': list(histogram.counts)}
+            return {'started_at': self._started,
+                    'elapsed_seconds': time.time() - self._started,
+                    'counters': counters,
+                    'histograms': histograms}
+
+    def merge_report(self, report: dict):
+        """
+        Adds the counters and histograms of a report, e.g. one written by another process of a sharded run.
+        Histograms of reports without bucket counts are skipped, as their quantiles cannot be combined.
+
+        Args:
+            report (dict): A report as returned by report.
+        """
+        with self._lock:
+            self._started = min(self._started, report['started_at'])
+            for name, series in report['counters'].items():
+                merged = self._counters.setdefault(name, {})
+                for text, value in series.items():
+                    key = _parse_labels(text)
+                    merged[key] = merged.get(key, 0) + value
+            for name, series in report['histograms'].items():
+                merged = self._histograms.setdefault(name, {})
+                for text, histogram in series.items():
+                    if 'bucket_counts' not in histogram:
+                        continue
+                    key = _parse_labels(text)
+                    if key not in merged:
+                        merged[key] = Histogram(tuple(histogram['buckets']))
+                    merged[key].merge(histogram['bucket_counts'], histogram['sum'])
+
+    def to_prometheus(self) -> str:
+        """
+        Renders the metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The rendered metrics
+        """
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                metric = f'{self._prefix}_{name}_total'
+                lines.append(f'# TYPE {metric} counter')
+                for key, value in sorted(series.items()):
+                    lines.append(f'{metric}{_labels_text(key)} {value}')
+            for name, series in sorted(self._histograms.items()):
+                metric = f'{self._prefix}_{name}'
+                lines.append(f'# TYPE {metric} histogram')
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{_labels_text(key, ("le", str(bound)))} {cumulative}')
+                    lines.append(f'{metric}_bucket{_labels_text(key, ("le", "+Inf"))} {histogram.count}')
+                    lines.append(f'{metric}_sum{_labels_text(key)} {histogram.sum}')
+                    lines.append(f'{metric}_count{_labels_text(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, path: str, extra: Optional[dict] = None):
+        report = self.report()
+        if extra is not None:
+            report.update(extra)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+    def write_prometheus(self, path: str):
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus())
+
+
+# The registry every module records into
+metrics = Metrics()
@@ -1,11 +1,29 @@
 
+import argparse
+import datetime
+import json
 import os
 import logging
+import time
+from typing import Callable, Dict, NamedTuple, Optional
 import sqlalchemy
-from sqlalchemy.orm import Session
+import change_capture
 import database_actions
 import database_base
+import fetch_engine
+import growth_estimate
+import insider_transaction
+import instrumentation
+import migrations
+import pipeline
+import price_target
+import recommendation
+import run_state
+import sharding
 import stock_data
+import stock_price
+import trading_calendar
+import watermark
 
 
 logging.basicConfig(
@@ -19,39 +37,182 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def main():
+def get_writer_options() -> dict:
+    """
+    Reads the StreamingWriter thresholds from the WRITE_FLUSH_ROWS, WRITE_FLUSH_SECONDS and WRITE_QUEUE_SIZE
+    environment variables.
+    """
+    return {'flush_rows': int(os.getenv('WRITE_FLUSH_ROWS', 5000)),
+            'flush_seconds': float(os.getenv('WRITE_FLUSH_SECONDS', 5.0)),
+            'queue_size': int(os.getenv('WRITE_QUEUE_SIZE', 64))}
+
+DATASETS = ['recommendation', 'price_target', 'growth_estimate', 'insider_transaction', 'stock_price']
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Download stock data and write it to the database')
+    run_group = parser.add_mutually_exclusive_group()
+    run_group.add_argument('--run-id', help='Id to record the checkpoints of this run under. Defaults to the current time.')
+    run_group.add_argument('--resume', metavar='RUN_ID',
+                           help='Resume the given run, skipping the symbols it already finished for each dataset')
+    parser.add_argument('--datasets', nargs='+', choices=DATASETS, default=DATASETS,
+                        help='The datasets to refresh. Defaults to all of them.')
+    parser.add_argument('--ignore-watermarks', action='store_true',
+                        help='Do not skip symbols by their ingest watermarks, and start prices after the latest date stored in '
+                             'stock_price instead of the watermark. Prices are still only requested for trading days missing after that date.')
+    parser.add_argument('--change-capture', action='store_true',
+                        help='Write recommendations and price targets to their history tables only when they change')
+    shard_group = parser.add_mutually_exclusive_group()
+    shard_group.add_argument('--shard', type=sharding.parse_shard, metavar='I/N',
+                             help='Ingest only shard I of N of the symbols, numbered from 0, e.g. on one of N hosts sharing a run id')
+    shard_group.add_argument('--processes', type=int, metavar='N',
+                             help='Split the symbols into N shards and ingest each in its own process')
+    # Set by the coordinator of --processes, which has already created the tables its shards write to
+    parser.add_argument('--skip-setup', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--report-file', help='Write the JSON run report to this file as well as the log')
+    parser.add_argument('--prometheus-file',
+                        help='Write the run metrics in the Prometheus text format to this file, e.g. for the node_exporter textfile collector')
+    return parser.parse_args(argv)
+
+
+class DatasetWriter(NamedTuple):
+    table: sqlalchemy.Table
+    fetch: Callable
+    on_conflict: str
+    watermarks: watermark.WatermarkStore
+    transform: Optional[Callable] = None
+
+
+def get_dataset_writers(db: database_actions.DatabaseActions, stocks: stock_data.StockData,
+                        change_capture_mode: bool = False, use_watermarks: bool = True) -> Dict[str, DatasetWriter]:
+    """
+    Args:
+        db (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+        stocks (stock_data.StockData): The downloader.
+        change_capture_mode (bool, optional): Whether to write recommendations and price targets to their history
+            tables, only when they change, instead of one snapshot row per day. Defaults to False.
+        use_watermarks (bool, optional): Whether stock prices start after each symbol's watermark rather than after
+            the latest date in the stock_price table. Defaults to True.
+
+    Returns:
+        Dict[str, DatasetWriter]: For each dataset, its table, a function from a list of symbols to the
+            (symbol, worked, rows) results of StockData, the on_conflict mode its rows are written with, its
+            watermarks, and the transform of its fetched rows into the rows written, if any
+    """
+    tables = {'recommendation': recommendation.Recommendation.__table__,
+              'price_target': price_target.PriceTarget.__table__,
+              'growth_estimate': growth_estimate.GrowthEstimate.__table__,
+              'insider_transaction': insider_transaction.InsiderTransaction.__table__,
+              'stock_price': stock_price.StockPrice.__table__}
+    watermarks = {dataset: watermark.WatermarkStore(db, dataset, table) for dataset, table in tables.items()}
+    price_watermarks = watermarks['stock_price'] if use_watermarks else None
+
+    writers = {'recommendation': DatasetWriter(tables['recommendation'], stocks.iter_recommendations, db.ON_CONFLICT_UPDATE, watermarks['recommendation']),
+               'price_target': DatasetWriter(tables['price_target'], stocks.iter_price_targets, db.ON_CONFLICT_UPDATE, watermarks['price_target']),
+               'growth_estimate': DatasetWriter(tables['growth_estimate'], stocks.iter_growth_estimates, db.ON_CONFLICT_UPDATE, watermarks['growth_estimate']),
+               'insider_transaction': DatasetWriter(tables['insider_transaction'], stocks.iter_insider_transactions, db.ON_CONFLICT_UPDATE, watermarks['insider_transaction']),
+               'stock_price': DatasetWriter(tables['stock_price'], lambda symbols: stocks.iter_stock_prices(db, symbols, price_watermarks),
+                                            db.ON_CONFLICT_NOTHING, watermarks['stock_price'])}
+
+    if change_capture_mode:
+        histories = {'recommendation': (recommendation.RecommendationHistory.__table__, ['strong_buy', 'buy', 'hold', 'sell', 'strong_sell']),
+                     'price_target': (price_target.PriceTargetHistory.__table__, ['low', 'high', 'mean', 'median'])}
+        for dataset, (history_table, value_columns) in histories.items():
+            capture = change_capture.ChangeCapture(db, history_table, value_columns)
+            writers[dataset] = writers[dataset]._replace(table=history_table, transform=capture.changes)
+
+    return writers
+
+
+def run_shards(args: argparse.Namespace, run_id: str):
+    """
+    Coordinates a run split into args.processes shard processes on this host. The symbol listing is refreshed and
+    the tables are created once, before the shards start. The shards are started with --skip-setup, so they neither
+    refetch the listing nor race on DDL.
+    The shards share the run id, so a failed shard is resumed with --resume like any other run.
+    """
+    db = database_actions.DatabaseActions(os.getenv('DATABASE_URL'))
+    stocks = stock_data.StockData()
+    db.create_schema()
+    database_base.Base.metadata.create_all(bind=db.get_engine())
+    migrations.check_stock_price_layout(db)
+    migrations.ensure_stock_price_partitions(db)
+    logger.info(f'Splitting {len(stocks.get_list_of_symbols())} symbols into {args.processes} shards')
+
+    shard_argv = ['--run-id', run_id, '--skip-setup', '--datasets', *args.datasets]
+    if args.ignore_watermarks:
+        shard_argv.append('--ignore-watermarks')
+    if args.change_capture:
+        shard_argv.append('--change-capture')
+    reports, failed = sharding.run_local_shards(shard_argv, args.processes)
+
+    sharding.write_merged_report(reports, args.report_file, args.prometheus_file)
+    if len(failed) > 0:
+        raise RuntimeError(f'Shards {failed} of run {run_id} failed; rerun with --resume {run_id} --processes {args.processes}')
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run_id = args.resume or args.run_id or run_state.RunCheckpoint.new_run_id()
+    logger.info(f'{"Resuming" if args.resume else "Starting"} run {run_id}')
+    if args.processes is not None:
+        run_shards(args, run_id)
+        return
+
+    instrumentation.metrics.reset()
+    start = time.perf_counter()
+
     connection_string = os.getenv('DATABASE_URL')
     db = database_actions.DatabaseActions(connection_string)
     engine = db.get_engine()
-    stocks = stock_data.StockData()
-    symbols = stocka.get_list_of_symbols()
-
-    symbol_size = 100
-    i = 0
-    j = i + symbol_size
-    database_base.Base.metadata.create_all(bind=engine)
-    with Session(engine) as session:
-        recs = stocks.download_recommendations()
-        logger.info('Adding recommendations to database')
-        session.add_all(recs)
-        session.commit()
-
-    with Session(engine) as session:
-        targets = stocks.download_price_targets()
-        logger.info('Adding price targets to database')
-        session.add_all(targets)
-        session.commit()
-
-    while i < len(symbols):
-        with Session(engine) as session:
-            j = min(j, len(symbols))
-            symbol_sample = symbols[i:j]
-            prices = stocks.download_stock_prices(db, symbol_sample)
-            logger.info('Adding stockprices to database')
-            session.add_all(prices)
-            session.commit()
-            i = j
-            j = i + symbol_size
+    if not args.skip_setup:
+        db.create_schema()
+        database_base.Base.metadata.create_all(bind=engine)
+        migrations.check_stock_price_layout(db)
+        migrations.ensure_stock_price_partitions(db)
+
+    fetcher = fetch_engine.FetchEngine.from_env()
+    stocks = stock_data.StockData(engine=fetcher)
+    symbols = stocks.get_list_of_symbols()
+    if args.shard is not None:
+        symbols = sharding.select_shard(symbols, *args.shard)
+        logger.info(f'Shard {args.shard[0]}/{args.shard[1]} holds {len(symbols)} symbols')
+    writer_options = get_writer_options()
+
+    dataset_writers = get_dataset_writers(db, stocks, args.change_capture, not args.ignore_watermarks)
+    rows_written = {}
+    today = datetime.date.today()
+    for dataset in DATASETS:
+        if dataset not in args.datasets:
+            continue
+        writer = dataset_writers[dataset]
+        checkpoint = run_state.RunCheckpoint(db, run_id, dataset)
+        pending = checkpoint.get_pending_symbols(symbols)
+        if not args.ignore_watermarks:
+            # Prices can only be complete through the last trading day; the other datasets are daily snapshots
+            current_date = trading_calendar.previous_trading_day(today) if dataset == 'stock_price' else today
+            stale = writer.watermarks.get_stale_symbols(pending, current_date)
+            logger.info(f'Skipping {len(pending) - len(stale)} symbols whose {dataset} data is current through {current_date}')
+            pending = stale
+        logger.info(f'Adding {dataset} data to database for {len(pending)} symbols')
+        with instrumentation.metrics.timer('dataset', dataset=dataset):
+            rows_written[dataset] = pipeline.write_stream(db, writer.table, writer.fetch(pending), on_conflict=writer.on_conflict,
+                                                          on_flush=checkpoint.record, on_batch=writer.watermarks.record,
+                                                          transform=writer.transform, **writer_options)
+
+    report = {'run_id': run_id,
+              'shard': f'{args.shard[0]}/{args.shard[1]}' if args.shard is not None else None,
+              'datasets': args.datasets,
+              'symbols': len(symbols),
+              'rows_written': rows_written,
+              'run_seconds': time.perf_counter() - start,
+              'rate_limiter': fetcher.limiter.get_stats() if fetcher.limiter is not None else None,
+              'db_pool': db.get_pool_stats()}
+    logger.info(f'Run report: {json.dumps({**instrumentation.metrics.report(), **report}, default=str)}')
+    if args.report_file:
+        instrumentation.metrics.write_report(args.report_file, report)
+    if args.prometheus_file:
+        instrumentation.metrics.write_prometheus(args.prometheus_file)
 
 #    stock_data.StockData()
 
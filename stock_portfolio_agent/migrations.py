@@ -0,0 +1,209 @@
+
+"""
+This module contains the storage migrations of the raw_data tables that create_all cannot apply to a
+table that already exists.
+
+Examples:
+    python migrations.py stock-price
+    python migrations.py stock-price --partition-from-year 2000 --drop-legacy
+    python migrations.py stock-price-partitions --through-year 2027
+"""
+
+import argparse
+import datetime
+import logging
+import os
+from typing import Optional
+
+import sqlalchemy
+
+import database_actions
+import stock_price
+
+
+logger = logging.getLogger(__name__)
+
+STOCK_PRICE_KEY = ['symbol', 'date']
+STOCK_PRICE_LEGACY_NAME = 'stock_price_legacy'
+_STOCK_PRICE_NEW_NAME = 'stock_price_new'
+
+
+def is_partitioned(connection: sqlalchemy.Connection, schema: str, name: str) -> bool:
+    """
+    Returns:
+        bool: Whether the table is a partitioned table. Always False outside PostgreSQL.
+    """
+    if connection.dialect.name != 'postgresql':
+        return False
+    query = """
+        SELECT 1
+        FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :schema AND c.relname = :name"""
+    return connection.execute(sqlalchemy.text(query), {'schema': schema, 'name': name}).first() is not None
+
+
+def _stock_price_table(name: str, partition: bool) -> sqlalchemy.Table:
+    table = stock_price.StockPrice.__table__.to_metadata(sqlalchemy.MetaData(), name=name)
+    if partition:
+        table.dialect_kwargs['postgresql_partition_by'] = 'RANGE (date)'
+    return table
+
+
+def create_stock_price_partitions(connection: sqlalchemy.Connection, first_year: int, last_year: int,
+                                  table_name: str = stock_price.StockPrice.__tablename__):
+    """
+    Creates one partition per calendar year of a stock_price table partitioned by date, and a default
+    partition for dates outside them. Partitions that already exist are left alone.
+
+    Args:
+        connection (sqlalchemy.Connection): A connection with an open transaction.
+        first_year (int): The first year to create a partition for.
+        last_year (int): The last year to create a partition for.
+        table_name (str, optional): The name of the partitioned table. Defaults to stock_price.
+    """
+    schema = database_actions.DatabaseActions.raw_schema_name
+    prefix = stock_price.StockPrice.__tablename__
+    for year in range(first_year, last_year + 1):
+        connection.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {schema}.{prefix}_y{year} PARTITION OF {schema}.{table_name} "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')")
+    connection.exec_driver_sql(f'CREATE TABLE IF NOT EXISTS {schema}.{prefix}_default PARTITION OF {schema}.{table_name} DEFAULT')
+
+
+def check_stock_price_layout(db_actions: database_actions.DatabaseActions):
+    """
+    Checks that raw_data.stock_price has the (symbol, date) key the writers upsert on. create_all does not
+    change the key of a table created before it, and writing to such a table would only fail at the first
+    stock_price batch.
+
+    Args:
+        db_actions (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+
+    Raises:
+        RuntimeError: If the table still has its old key.
+    """
+    schema = database_actions.DatabaseActions.raw_schema_name
+    name = stock_price.StockPrice.__tablename__
+    key = sqlalchemy.inspect(db_actions.get_engine()).get_pk_constraint(name, schema=schema)['constrained_columns']
+    if key != STOCK_PRICE_KEY:
+        raise RuntimeError(f'{schema}.{name} is keyed on {key} instead of {STOCK_PRICE_KEY}. '
+                           f'Run "python migrations.py stock-price" once to migrate it.')
+
+
+def ensure_stock_price_partitions(db_actions: database_actions.DatabaseActions, through_year: Optional[int] = None):
+    """
+    Creates the yearly partitions of stock_price up to through_year if the table is partitioned, and does
+    nothing otherwise. A year's partition cannot be created once the default partition holds rows of that
+    year, so it is created a year ahead by default.
+
+    Args:
+        db_actions (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+        through_year (int, optional): The last year to create a partition for. Defaults to next year.
+    """
+    today = datetime.date.today()
+    through_year = through_year if through_year is not None else today.year + 1
+    schema = database_actions.DatabaseActions.raw_schema_name
+    with db_actions.get_engine().begin() as connection:
+        if is_partitioned(connection, schema, stock_price.StockPrice.__tablename__):
+            create_stock_price_partitions(connection, today.year, through_year)
+
+
+def migrate_stock_price(db_actions: database_actions.DatabaseActions, partition_from_year: Optional[int] = None,
+                        drop_legacy: bool = False) -> int:
+    """
+    Moves raw_data.stock_price to the (symbol, date) key, optionally range partitioned by year on PostgreSQL.
+
+    The rows are copied into a new table, keeping the first inserted row of each symbol and date, and
+    the tables are then swapped in the same transaction. The old table is kept as stock_price_legacy
+    unless drop_legacy is set. A table that already has the target layout is left alone.
+
+    Args:
+        db_actions (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+        partition_from_year (int, optional): Partition by year from this year through next year, with a default
+            partition for other dates. PostgreSQL only. Defaults to no partitioning.
+        drop_legacy (bool, optional): Whether to drop the old table after the swap. Defaults to False.
+
+    Returns:
+        int: The number of rows copied
+    """
+    schema = database_actions.DatabaseActions.raw_schema_name
+    name = stock_price.StockPrice.__tablename__
+    partition = partition_from_year is not None
+
+    with db_actions.get_engine().begin() as connection:
+        if partition and connection.dialect.name != 'postgresql':
+            raise ValueError(f'Partitioning is not supported on {connection.dialect.name}')
+
+        inspector = sqlalchemy.inspect(connection)
+        if not inspector.has_table(name, schema=schema):
+            _stock_price_table(name, partition).create(connection)
+            if partition:
+                create_stock_price_partitions(connection, partition_from_year, datetime.date.today().year + 1)
+            logger.info(f'Created {schema}.{name}')
+            return 0
+
+        old_key = inspector.get_pk_constraint(name, schema=schema)
+        if old_key['constrained_columns'] == STOCK_PRICE_KEY and is_partitioned(connection, schema, name) == partition:
+            logger.info(f'{schema}.{name} already has the target layout')
+            return 0
+
+        new_table = _stock_price_table(_STOCK_PRICE_NEW_NAME, partition)
+        new_table.create(connection)
+        if partition:
+            create_stock_price_partitions(connection, partition_from_year, datetime.date.today().year + 1,
+                                          table_name=_STOCK_PRICE_NEW_NAME)
+
+        columns = ', '.join(column.name for column in new_table.columns)
+        result = connection.exec_driver_sql(f"""
+            INSERT INTO {schema}.{_STOCK_PRICE_NEW_NAME} ({columns})
+            SELECT {columns}
+            FROM (
+                SELECT {columns}, ROW_NUMBER() OVER (PARTITION BY symbol, date ORDER BY inserted_at, id) AS row_number
+                FROM {schema}.{name}
+            ) ranked
+            WHERE row_number = 1""")
+        logger.info(f'Copied {result.rowcount} rows of {schema}.{name}')
+
+        connection.exec_driver_sql(f'ALTER TABLE {schema}.{name} RENAME TO {STOCK_PRICE_LEGACY_NAME}')
+        connection.exec_driver_sql(f'ALTER TABLE {schema}.{_STOCK_PRICE_NEW_NAME} RENAME TO {name}')
+        if connection.dialect.name == 'postgresql':
+            # Constraint names do not follow a table rename, so give the key the name create_all would
+            if old_key['name']:
+                connection.exec_driver_sql(f'ALTER TABLE {schema}.{STOCK_PRICE_LEGACY_NAME} '
+                                           f'RENAME CONSTRAINT {old_key["name"]} TO {STOCK_PRICE_LEGACY_NAME}_pkey')
+            connection.exec_driver_sql(f'ALTER TABLE {schema}.{name} RENAME CONSTRAINT {_STOCK_PRICE_NEW_NAME}_pkey TO {name}_pkey')
+            connection.exec_driver_sql(f'ANALYZE {schema}.{name}')
+
+        if drop_legacy:
+            connection.exec_driver_sql(f'DROP TABLE {schema}.{STOCK_PRICE_LEGACY_NAME}')
+
+    return result.rowcount
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description='Migrate the storage layout of the raw_data tables')
+    subparsers = parser.add_subparsers(dest='migration', required=True)
+
+    price_parser = subparsers.add_parser('stock-price', help='Move stock_price to the (symbol, date) key')
+    price_parser.add_argument('--partition-from-year', type=int,
+                              help='Range partition by year from this year on (PostgreSQL only)')
+    price_parser.add_argument('--drop-legacy', action='store_true', help='Drop the old table after the swap')
+
+    partitions_parser = subparsers.add_parser('stock-price-partitions', help='Create upcoming yearly partitions of stock_price')
+    partitions_parser.add_argument('--through-year', type=int, help='Last year to create a partition for. Defaults to next year.')
+
+    args = parser.parse_args(argv)
+    db = database_actions.DatabaseActions(os.getenv('DATABASE_URL'))
+    db.create_schema()
+    if args.migration == 'stock-price':
+        migrate_stock_price(db, args.partition_from_year, args.drop_legacy)
+    else:
+        ensure_stock_price_partitions(db, args.through_year)
+
+
+if __name__ == '__main__':
+    main()
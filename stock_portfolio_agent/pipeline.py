@@ -0,0 +1,198 @@
+
+"""
+This module contains a writer stage that persists fetched rows on its own thread, so that fetching and
+writing overlap and at most a bounded number of fetched results are held in memory.
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import pandas as pd
+import sqlalchemy
+
+import database_actions
+import instrumentation
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class StreamingWriter:
+    def __init__(self, db_actions: database_actions.DatabaseActions, table: sqlalchemy.Table,
+                 on_conflict: Optional[str] = None, flush_rows: int = 5000, flush_seconds: float = 5.0,
+                 queue_size: int = 64,
+                 on_flush: Optional[Callable[[sqlalchemy.Connection, List[Tuple[str, bool]]], None]] = None,
+                 on_batch: Optional[Callable[[sqlalchemy.Connection, pd.DataFrame], None]] = None,
+                 transform: Optional[Callable[[sqlalchemy.Connection, pd.DataFrame], pd.DataFrame]] = None):
+        """
+        Args:
+            db_actions (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+            table (sqlalchemy.Table): The table the rows are written to.
+            on_conflict (str, optional): The on_conflict mode passed to DatabaseActions.bulk_load. Defaults to None.
+            flush_rows (int, optional): A batch is written once it holds this many rows. Defaults to 5000.
+            flush_seconds (float, optional): A batch is written once its first result is this many seconds old,
+                however few rows it holds. Defaults to 5.0.
+            queue_size (int, optional): The number of symbol results that may wait for the writer before
+                put blocks. Defaults to 64.
+            on_flush (Callable[[sqlalchemy.Connection, List[Tuple[str, bool]]], None], optional): Called with the
+                connection and the (symbol, worked) pairs of each batch, inside the transaction that writes the batch.
+            on_batch (Callable[[sqlalchemy.Connection, pd.DataFrame], None], optional): Called with the connection and
+                the rows of each batch, inside the transaction that writes the batch.
+            transform (Callable[[sqlalchemy.Connection, pd.DataFrame], pd.DataFrame], optional): Turns the rows of each
+                batch into the rows written to table, inside the transaction that writes them, e.g.
+                change_capture.ChangeCapture.changes. The hooks still see the rows as fetched.
+        """
+        self._db_actions = db_actions
+        self._table = table
+        self._on_conflict = on_conflict
+        self._flush_rows = flush_rows
+        self._flush_seconds = flush_seconds
+        self._on_flush = on_flush
+        self._on_batch = on_batch
+        self._transform = transform
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=f'writer-{table.name}', daemon=True)
+
+        self.rows_written = 0
+        self.flushes = 0
+
+    def __enter__(self) -> 'StreamingWriter':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, symbol: str, worked: bool, rows: Union[pd.DataFrame, List[Dict[str, Any]]]):
+        """
+        Hands the result of one symbol to the writer, blocking while the queue is full.
+
+        Args:
+            symbol (str): The stock symbol the rows belong to.
+            worked (bool): Whether the symbol was fetched successfully.
+            rows (Union[pd.DataFrame, List[Dict[str, Any]]]): The table rows fetched for the symbol.
+
+        Raises:
+            RuntimeError: If the writer thread has failed.
+        """
+        item = (symbol, worked, rows)
+        while True:
+            self._raise_if_failed()
+            try:
+                self._queue.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        """
+        Writes whatever is still buffered and waits for the writer thread to finish.
+
+        Raises:
+            RuntimeError: If the writer thread has failed.
+        """
+        if self._thread.is_alive():
+            while self._error is None:
+                try:
+                    self._queue.put(_STOP, timeout=1.0)
+                    break
+                except queue.Full:
+                    continue
+            self._thread.join()
+        self._raise_if_failed()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RuntimeError(f'Writing to {self._table.fullname} failed') from self._error
+
+    def _run(self):
+        symbols = []
+        frames = []
+        records = []
+        row_count = 0
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is _STOP:
+                    self._flush(symbols, frames, records)
+                    return
+
+                if item is not None:
+                    symbol, worked, rows = item
+                    symbols.append((symbol, worked))
+                    if isinstance(rows, pd.DataFrame):
+                        frames.append(rows)
+                    else:
+                        records.extend(rows)
+                    row_count += len(rows)
+                    if deadline is None:
+                        deadline = time.monotonic() + self._flush_seconds
+
+                if row_count >= self._flush_rows or (deadline is not None and time.monotonic() >= deadline):
+                    self._flush(symbols, frames, records)
+                    symbols, frames, records = [], [], []
+                    row_count = 0
+                    deadline = None
+        except Exception as e:
+            logger.error(f'Writer for {self._table.fullname} failed: {e}')
+            self._error = e
+
+    def _flush(self, symbols: List[Tuple[str, bool]], frames: List[pd.DataFrame], records: List[Dict[str, Any]]):
+        if len(symbols) == 0:
+            return
+
+        if len(records) > 0:
+            frames = frames + [pd.DataFrame(records)]
+        frames = [frame for frame in frames if len(frame) > 0]
+        batch = pd.concat(frames, ignore_index=True) if len(frames) > 0 else pd.DataFrame()
+
+        with self._db_actions.write_transaction() as connection:
+            rows = self._transform(connection, batch) if self._transform is not None else batch
+            result = self._db_actions.bulk_load(self._table, rows, connection=connection, on_conflict=self._on_conflict)
+            if self._on_batch is not None:
+                self._on_batch(connection, batch)
+            if self._on_flush is not None:
+                self._on_flush(connection, symbols)
+
+        self.rows_written += result.rows
+        self.flushes += 1
+        for symbol, worked in symbols:
+            instrumentation.metrics.increment('symbols', table=self._table.name, status='retrieved' if worked else 'failed')
+
+
+def write_stream(db_actions: database_actions.DatabaseActions, table: sqlalchemy.Table,
+                 results: Iterable[Tuple[str, bool, Union[pd.DataFrame, List[Dict[str, Any]]]]],
+                 **writer_options) -> int:
+    """
+    Writes a stream of per-symbol results through a StreamingWriter.
+
+    Args:
+        db_actions (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+        table (sqlalchemy.Table): The table the rows are written to.
+        results (Iterable[Tuple[str, bool, Union[pd.DataFrame, List[Dict[str, Any]]]]]): (symbol, worked, rows)
+            results, such as those yielded by StockData.iter_stock_prices.
+        **writer_options: Passed on to StreamingWriter.
+
+    Returns:
+        int: The number of rows written
+    """
+    with StreamingWriter(db_actions, table, **writer_options) as writer:
+        for symbol, worked, rows in results:
+            writer.put(symbol, worked, rows)
+    return writer.rows_written
@@ -0,0 +1,207 @@
+
+"""
+This module contains a local price cache stored as a Parquet dataset partitioned by symbol, for research
+and backtests that need years of prices for many symbols without going to the network.
+"""
+
+import datetime
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.fs
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+logger = logging.getLogger(__name__)
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+
+# Offsets of the yfinance period strings; 'ytd' and 'max' are handled by period_start
+_PERIOD_DAYS = {'1d': 1, '5d': 5, '1mo': 31, '3mo': 92, '6mo': 183, '1y': 366, '2y': 731, '5y': 1827, '10y': 3653}
+
+
+def period_start(time_period: str, today: datetime.date) -> Optional[datetime.date]:
+    """
+    Converts a yfinance period string to the first date it covers.
+
+    Args:
+        time_period (str): One of '1d', '5d', '1mo', '3mo', '6mo', '1y', '2y', '5y', '10y', 'ytd', 'max'.
+        today (datetime.date): The current date.
+
+    Returns:
+        Optional[datetime.date]: The first date of the period, or None for 'max'
+    """
+    if time_period == 'max':
+        return None
+    if time_period == 'ytd':
+        return datetime.date(today.year, 1, 1)
+    if time_period not in _PERIOD_DAYS:
+        raise ValueError(f'Unknown time period: {time_period}')
+    return today - datetime.timedelta(days=_PERIOD_DAYS[time_period])
+
+
+class ParquetPriceCache:
+    def __init__(self, root: Optional[str] = None):
+        """
+        Args:
+            root (str, optional): The directory of the dataset. Defaults to the PRICE_CACHE_DIR environment
+                variable, or price_cache.
+        """
+        if pyarrow is None:
+            raise ImportError('ParquetPriceCache requires pyarrow; install it with `pip install pyarrow`')
+
+        self._root = root if root is not None else os.getenv('PRICE_CACHE_DIR', 'price_cache')
+        self._manifest_path = os.path.join(self._root, '_coverage.json')
+        self._lock = threading.Lock()
+        self._schema = pyarrow.schema([('Date', pyarrow.date32()),
+                                       ('Open', pyarrow.float64()),
+                                       ('High', pyarrow.float64()),
+                                       ('Low', pyarrow.float64()),
+                                       ('Close', pyarrow.float64()),
+                                       ('Volume', pyarrow.int64()),
+                                       ('Dividends', pyarrow.float64()),
+                                       ('Stock Splits', pyarrow.float64())])
+        os.makedirs(self._root, exist_ok=True)
+
+    def _partition_path(self, symbol: str) -> str:
+        return os.path.join(self._root, f'symbol={symbol}')
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Optional[str]]]:
+        if not os.path.exists(self._manifest_path):
+            return {}
+        with open(self._manifest_path) as f:
+            return json.load(f)
+
+    def get_coverage(self, symbol: str) -> Optional[Tuple[Optional[datetime.date], datetime.date]]:
+        """
+        Retrieves the date range the cache holds for a symbol.
+
+        Args:
+            symbol (str): The stock symbol.
+
+        Returns:
+            Optional[Tuple[Optional[datetime.date], datetime.date]]: The first date covered (None if the full history is
+                cached) and the exclusive end date of the last download, or None if the symbol is not cached
+        """
+        coverage = self._load_manifest().get(symbol)
+        if coverage is None:
+            return None
+        covered_from = datetime.date.fromisoformat(coverage['from']) if coverage['from'] else None
+        return covered_from, datetime.date.fromisoformat(coverage['to'])
+
+    def write(self, symbol: str, data_df: pd.DataFrame, covered_from: Optional[datetime.date], covered_to: datetime.date,
+              replace: bool = False):
+        """
+        Adds downloaded prices of a symbol to the cache as a new file in its partition.
+
+        Args:
+            symbol (str): The stock symbol.
+            data_df (pd.DataFrame): The prices, in the format of Ticker.history(...).reset_index().
+            covered_from (Optional[datetime.date]): The first date the download asked for, or None for the full history.
+                Ignored when appending, where the existing start is kept.
+            covered_to (datetime.date): The exclusive end date the download asked for.
+            replace (bool, optional): Whether to drop the symbol's existing files first instead of appending.
+                Defaults to False.
+        """
+        partition = self._partition_path(symbol)
+        with self._lock:
+            if replace and os.path.exists(partition):
+                shutil.rmtree(partition)
+            os.makedirs(partition, exist_ok=True)
+
+            if len(data_df) > 0:
+                frame = data_df[PRICE_COLUMNS].copy()
+                frame.insert(0, 'Date', pd.to_datetime(data_df['Date']).dt.date.to_numpy())
+                table = pyarrow.Table.from_pandas(frame, schema=self._schema, preserve_index=False)
+                filename = f'part-{datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")}.parquet'
+                pyarrow.parquet.write_table(table, os.path.join(partition, filename))
+
+            manifest = self._load_manifest()
+            if not replace and symbol in manifest:
+                covered_from = manifest[symbol]['from']
+            else:
+                covered_from = covered_from.isoformat() if covered_from is not None else None
+            manifest[symbol] = {'from': covered_from, 'to': covered_to.isoformat()}
+            temporary_path = self._manifest_path + '.tmp'
+            with open(temporary_path, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(temporary_path, self._manifest_path)
+
+    def read(self, symbols: Optional[List[str]] = None, start: Optional[datetime.date] = None,
+             end: Optional[datetime.date] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Reads cached prices. The symbol filter prunes whole partitions and the date filter is pushed down
+        to the Parquet row groups; files are memory mapped rather than read into buffers.
+
+        Args:
+            symbols (List[str], optional): The symbols to read. Defaults to every cached symbol.
+            start (datetime.date, optional): The first date to read. Defaults to the earliest cached date.
+            end (datetime.date, optional): The exclusive end date. Defaults to the latest cached date.
+            columns (List[str], optional): The price columns to read. Defaults to all of them.
+
+        Returns:
+            pd.DataFrame: A frame with symbol and Date columns followed by the price columns, sorted by symbol and date
+        """
+        columns = columns if columns is not None else PRICE_COLUMNS
+        output_columns = ['symbol', 'Date'] + columns
+
+        # The partitioning is typed explicitly so that numeric-looking symbols are not read back as integers
+        partitioning = pyarrow.dataset.partitioning(pyarrow.schema([('symbol', pyarrow.string())]), flavor='hive')
+        dataset = pyarrow.dataset.dataset(self._root, format='parquet', partitioning=partitioning,
+                                          schema=self._schema.append(pyarrow.field('symbol', pyarrow.string())),
+                                          filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True),
+                                          ignore_prefixes=['_', '.'])
+        if len(dataset.files) == 0:
+            return pd.DataFrame(columns=output_columns)
+
+        predicate = None
+        if symbols is not None:
+            predicate = pyarrow.dataset.field('symbol').isin(symbols)
+        if start is not None:
+            condition = pyarrow.dataset.field('Date') >= pyarrow.scalar(start, type=pyarrow.date32())
+            predicate = condition if predicate is None else predicate & condition
+        if end is not None:
+            condition = pyarrow.dataset.field('Date') < pyarrow.scalar(end, type=pyarrow.date32())
+            predicate = condition if predicate is None else predicate & condition
+
+        table = dataset.to_table(columns=output_columns, filter=predicate)
+        data = table.to_pandas(date_as_object=False)
+        if len(data) == 0:
+            return pd.DataFrame(columns=output_columns)
+
+        data['symbol'] = data['symbol'].astype(str)
+        return data.sort_values(['symbol', 'Date'], kind='stable').reset_index(drop=True)
+
+    def compact(self, symbol: str):
+        """
+        Rewrites the files appended to a symbol's partition as one file, keeping the last row of each date.
+
+        Args:
+            symbol (str): The stock symbol.
+        """
+        partition = self._partition_path(symbol)
+        with self._lock:
+            if not os.path.exists(partition) or len(os.listdir(partition)) < 2:
+                return
+            table = pyarrow.dataset.dataset(partition, format='parquet', schema=self._schema).to_table()
+            frame = table.to_pandas().drop_duplicates(subset=['Date'], keep='last').sort_values('Date')
+            compacted = pyarrow.Table.from_pandas(frame, schema=self._schema, preserve_index=False)
+
+            # Files are read in name order, so the compacted file keeps a timestamped name like an append
+            filename = f'part-{datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")}.parquet'
+            temporary_path = os.path.join(self._root, f'.compact-{symbol}.parquet')
+            pyarrow.parquet.write_table(compacted, temporary_path)
+            shutil.rmtree(partition)
+            os.makedirs(partition)
+            os.replace(temporary_path, os.path.join(partition, filename))
@@ -1,7 +1,8 @@
 import datetime
 from database_base import Base
 import database_actions
-from sqlalchemy import String, Date, Float
+from sqlalchemy import String, Date, DateTime, Float
+from typing import Optional
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 
@@ -22,3 +23,25 @@ class PriceTarget(Base):
     def __repr__(self) -> str:
         return f"Recommendation(id={self.id}, symbol={self.symbol}, date={self.date}, current={self.current}, mean={self.mean})"
 
+
+class PriceTargetHistory(Base):
+    """
+    The analyst price targets of each symbol as validity intervals: a row holds from valid_from up to but
+    excluding valid_to, and valid_to is null for the current targets. The current price is left out, as it
+    changes every day. Written by change_capture.ChangeCapture.
+    """
+    __tablename__ = "price_target_history"
+    __table_args__ = {"schema": database_actions.DatabaseActions.raw_schema_name}
+
+    symbol: Mapped[str] = mapped_column(String(10), primary_key=True)
+    valid_from: Mapped[datetime.date] = mapped_column(Date, primary_key=True)
+    valid_to: Mapped[Optional[datetime.date]] = mapped_column(Date, nullable=True)
+    low: Mapped[float] = mapped_column(Float, nullable=True)
+    high: Mapped[float] = mapped_column(Float, nullable=True)
+    mean: Mapped[float] = mapped_column(Float, nullable=True)
+    median: Mapped[float] = mapped_column(Float, nullable=True)
+    row_hash: Mapped[str] = mapped_column(String(32))
+    inserted_at: Mapped[datetime.datetime] = mapped_column(DateTime)
+
+    def __repr__(self) -> str:
+        return f"PriceTargetHistory(symbol={self.symbol}, valid_from={self.valid_from}, valid_to={self.valid_to}, mean={self.mean})"
@@ -0,0 +1,171 @@
+
+"""
+This module contains a token-bucket rate limiter with additive-increase / multiplicative-decrease
+(AIMD) throttling, shared by every outbound call to Yahoo and AlphaVantage.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitedError(Exception):
+    """
+    Raised when a data provider answers that the caller is being rate limited without using an HTTP 429.
+    """
+    pass
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """
+    Checks whether an exception means the data provider throttled the request.
+
+    Args:
+        error (Exception): The exception raised by the outbound call.
+
+    Returns:
+        bool: True if the exception is a rate-limit response
+    """
+    if isinstance(error, RateLimitedError):
+        return True
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 429:
+        return True
+    if 'RateLimit' in type(error).__name__:
+        return True
+    message = str(error)
+    return '429' in message or 'Too Many Requests' in message
+
+
+class RateLimiter:
+    def __init__(self, rate: float = 5.0, burst: int = 10, min_rate: float = 0.5, max_rate: float = 50.0,
+                 increase: float = 0.5, throttle_decrease: float = 0.5, error_decrease: float = 0.9):
+        """
+        Args:
+            rate (float, optional): The starting budget in requests per second. Defaults to 5.0.
+            burst (int, optional): The number of requests that may be made back to back when the bucket is full.
+                Defaults to 10.
+            min_rate (float, optional): The rate is never lowered below this. Defaults to 0.5.
+            max_rate (float, optional): The rate is never raised above this. Defaults to 50.0.
+            increase (float, optional): How many requests per second the rate grows by for roughly every second
+                of successful calls. Defaults to 0.5.
+            throttle_decrease (float, optional): The factor the rate is multiplied by after a rate-limit response.
+                Defaults to 0.5.
+            error_decrease (float, optional): The factor the rate is multiplied by after any other error.
+                Defaults to 0.9.
+        """
+        if not 0 < min_rate <= rate <= max_rate:
+            raise ValueError('Rates must satisfy 0 < min_rate <= rate <= max_rate')
+
+        self._rate = rate
+        self._burst = burst
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._increase = increase
+        self._throttle_decrease = throttle_decrease
+        self._error_decrease = error_decrease
+
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+        self._counters = {'acquired': 0, 'delayed': 0, 'succeeded': 0, 'throttled': 0,
+                          'errors': 0, 'retried': 0, 'failed': 0}
+        self._waited_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> 'RateLimiter':
+        """
+        Builds a RateLimiter from the RATE_LIMIT_RPS, RATE_LIMIT_BURST, RATE_LIMIT_MIN_RPS and
+        RATE_LIMIT_MAX_RPS environment variables, using the constructor defaults for any that are unset.
+
+        Returns:
+            RateLimiter: The configured limiter
+        """
+        return cls(rate=float(os.getenv('RATE_LIMIT_RPS', 5.0)),
+                   burst=int(os.getenv('RATE_LIMIT_BURST', 10)),
+                   min_rate=float(os.getenv('RATE_LIMIT_MIN_RPS', 0.5)),
+                   max_rate=float(os.getenv('RATE_LIMIT_MAX_RPS', 50.0)))
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def _refill(self, now: float):
+        self._tokens = min(self._burst, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def acquire(self, tokens: int = 1) -> float:
+        """
+        Blocks until a request may be made under the current rate.
+
+        Args:
+            tokens (int, optional): The number of upstream requests the call makes, e.g. one per ticker of a
+                multi-ticker download. A call costing more than the burst waits for a full bucket and leaves it
+                in debt, so later calls wait until the extra requests are paid for. Defaults to 1.
+
+        Returns:
+            float: The number of seconds spent waiting
+        """
+        needed = min(tokens, self._burst)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    self._counters['acquired'] += tokens
+                    if waited > 0:
+                        self._counters['delayed'] += 1
+                        self._waited_seconds += waited
+                    return waited
+                wait = (needed - self._tokens) / self._rate
+            time.sleep(wait)
+            waited += wait
+
+    def on_success(self):
+        with self._lock:
+            self._counters['succeeded'] += 1
+            self._rate = min(self._max_rate, self._rate + self._increase / self._rate)
+
+    def on_error(self, error: Exception):
+        """
+        Lowers the rate after a failed call. Rate-limit responses also empty the bucket so that every
+        worker pauses, not just the one that was rejected.
+
+        Args:
+            error (Exception): The exception raised by the outbound call.
+        """
+        with self._lock:
+            if is_throttle_error(error):
+                self._counters['throttled'] += 1
+                self._rate = max(self._min_rate, self._rate * self._throttle_decrease)
+                self._tokens = 0.0
+                logger.warning(f'Rate limited, lowering request rate to {self._rate:.2f}/s')
+            else:
+                self._counters['errors'] += 1
+                self._rate = max(self._min_rate, self._rate * self._error_decrease)
+
+    def on_retry(self):
+        with self._lock:
+            self._counters['retried'] += 1
+
+    def on_failure(self):
+        with self._lock:
+            self._counters['failed'] += 1
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Returns:
+            Dict[str, float]: The call counters, the total seconds spent waiting for tokens and the current rate
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['waited_seconds'] = self._waited_seconds
+            stats['rate'] = self._rate
+        return stats
@@ -2,7 +2,8 @@
 import datetime
 from database_base import Base
 import database_actions
-from sqlalchemy import String, Date
+from sqlalchemy import String, Date, DateTime
+from typing import Optional
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 
@@ -21,6 +22,27 @@ class Recommendation(Base):
     strong_sell: Mapped[int]
 
     def __repr__(self) -> str:
-        return f"Recommendation(id={self.id}, symbol={self.symbol}, date={self.date}, strong_buy={self.strong_buy}, buy={self.buy}, hold={self.hold}, sell={self.sell}, strong_sell={self.strong_sell})"    
-    
-    
\ No newline at end of file
+        return f"Recommendation(id={self.id}, symbol={self.symbol}, date={self.date}, strong_buy={self.strong_buy}, buy={self.buy}, hold={self.hold}, sell={self.sell}, strong_sell={self.strong_sell})"
+
+
+class RecommendationHistory(Base):
+    """
+    The recommendation counts of each symbol as validity intervals: a row holds from valid_from up to but
+    excluding valid_to, and valid_to is null for the current counts. Written by change_capture.ChangeCapture.
+    """
+    __tablename__ = "recommendation_history"
+    __table_args__ = {"schema": database_actions.DatabaseActions.raw_schema_name}
+
+    symbol: Mapped[str] = mapped_column(String(10), primary_key=True)
+    valid_from: Mapped[datetime.date] = mapped_column(Date, primary_key=True)
+    valid_to: Mapped[Optional[datetime.date]] = mapped_column(Date, nullable=True)
+    strong_buy: Mapped[int]
+    buy: Mapped[int]
+    hold: Mapped[int]
+    sell: Mapped[int]
+    strong_sell: Mapped[int]
+    row_hash: Mapped[str] = mapped_column(String(32))
+    inserted_at: Mapped[datetime.datetime] = mapped_column(DateTime)
+
+    def __repr__(self) -> str:
+        return f"RecommendationHistory(symbol={self.symbol}, valid_from={self.valid_from}, valid_to={self.valid_to}, strong_buy={self.strong_buy}, buy={self.buy}, hold={self.hold}, sell={self.sell}, strong_sell={self.strong_sell})"
@@ -0,0 +1,89 @@
+
+import datetime
+from database_base import Base
+import database_actions
+from sqlalchemy import String, DateTime, text, Connection
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+from typing import List, Set, Tuple
+
+
+class IngestRunState(Base):
+    __tablename__ = "ingest_run_state"
+    __table_args__ = {"schema": database_actions.DatabaseActions.raw_schema_name}
+
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    run_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    dataset: Mapped[str] = mapped_column(String(32), primary_key=True)
+    symbol: Mapped[str] = mapped_column(String(10), primary_key=True)
+    status: Mapped[str] = mapped_column(String(10))
+    updated_at: Mapped[datetime.datetime] = mapped_column(DateTime)
+
+    def __repr__(self) -> str:
+        return f"IngestRunState(run_id={self.run_id}, dataset={self.dataset}, symbol={self.symbol}, status={self.status})"
+
+
+class RunCheckpoint:
+    """
+    Records which symbols of a dataset an ingestion run has finished, in the same transaction as the
+    rows written for them, so that a restarted run can skip them.
+    """
+
+    def __init__(self, db_actions: database_actions.DatabaseActions, run_id: str, dataset: str):
+        self._db_actions = db_actions
+        self.run_id = run_id
+        self.dataset = dataset
+
+    @staticmethod
+    def new_run_id() -> str:
+        return datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+
+    def get_completed_symbols(self) -> Set[str]:
+        """
+        Retrieves the symbols this run has already finished for the dataset.
+
+        Returns:
+            Set[str]: The finished symbols
+        """
+        table = IngestRunState.__table__
+        query = f"""
+            SELECT symbol
+            FROM {table.schema}.{table.name}
+            WHERE run_id = :run_id AND dataset = :dataset AND status = :status"""
+
+        with self._db_actions.get_engine().connect() as conn:
+            result = conn.execute(text(query), {'run_id': self.run_id, 'dataset': self.dataset, 'status': IngestRunState.STATUS_DONE})
+            return {r[0] for r in result.all()}
+
+    def get_pending_symbols(self, symbols: List[str]) -> List[str]:
+        """
+        Filters out the symbols this run has already finished for the dataset. Failed and missing symbols are kept.
+
+        Args:
+            symbols (List[str]): The symbols of the run.
+
+        Returns:
+            List[str]: The symbols still to fetch, in the order of symbols
+        """
+        completed = self.get_completed_symbols()
+        return [symbol for symbol in symbols if symbol not in completed]
+
+    def record(self, connection: Connection, results: List[Tuple[str, bool]]):
+        """
+        Records the outcome of a batch of symbols. Meant to be passed as the on_flush hook of a
+        pipeline.StreamingWriter, so it shares the transaction that writes the batch.
+
+        Args:
+            connection (Connection): The connection whose transaction writes the batch.
+            results (List[Tuple[str, bool]]): The (symbol, worked) pairs of the batch.
+        """
+        now = datetime.datetime.now()
+        rows = [{'run_id': self.run_id,
+                 'dataset': self.dataset,
+                 'symbol': symbol,
+                 'status': IngestRunState.STATUS_DONE if worked else IngestRunState.STATUS_FAILED,
+                 'updated_at': now} for symbol, worked in results]
+        self._db_actions.bulk_load(IngestRunState.__table__, rows, connection=connection,
+                                   on_conflict=database_actions.DatabaseActions.ON_CONFLICT_UPDATE)
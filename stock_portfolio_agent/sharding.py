@@ -0,0 +1,206 @@
+
+"""
+This module partitions the symbol universe into shards, so that an ingestion run can be spread over several
+processes or hosts, and merges the run reports of the shards.
+
+Examples:
+    python main.py --processes 8
+    python main.py --run-id 20240102 --shard 2/4 --report-file shard-2.json
+    python sharding.py merge shard-*.json --output run_report.json --prometheus-file ingest.prom
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import instrumentation
+
+
+logger = logging.getLogger(__name__)
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+# The rate limiter settings that bound the requests of one process. Shards run on one host share its
+# address, so the host's budget is split between them.
+RATE_LIMIT_VARIABLES = {'RATE_LIMIT_RPS': 5.0,
+                        'RATE_LIMIT_MIN_RPS': 0.5,
+                        'RATE_LIMIT_MAX_RPS': 50.0}
+RATE_LIMIT_BURST_DEFAULT = 10
+
+
+def shard_of(symbol: str, count: int) -> int:
+    """
+    Assigns a symbol to a shard by the CRC-32 of its name, which unlike hash() is the same in every process
+    and on every host, so symbols keep their shard as the universe changes.
+
+    Args:
+        symbol (str): The stock symbol.
+        count (int): The number of shards.
+
+    Returns:
+        int: The shard of the symbol, from 0 to count - 1
+    """
+    return zlib.crc32(symbol.encode('utf-8')) % count
+
+
+def select_shard(symbols: List[str], index: int, count: int) -> List[str]:
+    """
+    Args:
+        symbols (List[str]): The symbol universe.
+        index (int): The shard to select, from 0 to count - 1.
+        count (int): The number of shards.
+
+    Returns:
+        List[str]: The symbols of the shard, in the order of symbols
+    """
+    return [symbol for symbol in symbols if shard_of(symbol, count) == index]
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """
+    Parses a shard given as 'i/N' on the command line, with shards numbered from 0.
+
+    Returns:
+        Tuple[int, int]: The shard index and the number of shards
+    """
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected a shard as i/N, got {text!r}')
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f'Shard {text} is out of range: i must be from 0 to N - 1')
+    return index, count
+
+
+def shard_environment(count: int, environ: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    Builds the environment of one of count shard processes on the same host, dividing the rate limits and
+    the burst between them. Each shard keeps a burst of at least one request.
+
+    Args:
+        count (int): The number of shard processes.
+        environ (Dict[str, str], optional): The environment to start from. Defaults to os.environ.
+
+    Returns:
+        Dict[str, str]: The environment of a shard process
+    """
+    environ = dict(environ if environ is not None else os.environ)
+    for name, default in RATE_LIMIT_VARIABLES.items():
+        environ[name] = str(float(environ.get(name, default)) / count)
+    environ['RATE_LIMIT_BURST'] = str(max(1, int(environ.get('RATE_LIMIT_BURST', RATE_LIMIT_BURST_DEFAULT)) // count))
+    return environ
+
+
+def run_local_shards(argv: List[str], count: int, directory: Optional[str] = None) -> Tuple[List[dict], List[int]]:
+    """
+    Runs main.py once per shard, each in its own process with its own database connections, writers and
+    rate limiter, and waits for all of them.
+
+    Args:
+        argv (List[str]): The arguments common to every shard, including the run id.
+        count (int): The number of shards.
+        directory (str, optional): The directory the shards write their run reports to. Defaults to a
+            temporary directory removed afterwards.
+
+    Returns:
+        Tuple[List[dict], List[int]]: The run reports of the shards that finished and the indexes of those that failed
+    """
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = directory if directory is not None else temporary
+        environ = shard_environment(count)
+        processes = []
+        for index in range(count):
+            report_file = os.path.join(directory, f'shard-{index}.json')
+            command = [sys.executable, MAIN_PATH, *argv, '--shard', f'{index}/{count}', '--report-file', report_file]
+            processes.append((index, report_file, subprocess.Popen(command, env=environ)))
+        logger.info(f'Started {count} shard processes')
+
+        reports = []
+        failed = []
+        for index, report_file, process in processes:
+            if process.wait() != 0:
+                logger.error(f'!!!ERROR: shard {index}/{count} exited with status {process.returncode}')
+                failed.append(index)
+                continue
+            with open(report_file) as f:
+                reports.append(json.load(f))
+        return reports, failed
+
+
+def merge_reports(reports: List[dict]) -> Tuple[instrumentation.Metrics, dict]:
+    """
+    Merges the run reports of the shards of a run. Counters, histograms, symbols, rows written and rate limiter
+    statistics are summed; the run takes as long as its slowest shard.
+
+    Args:
+        reports (List[dict]): The run reports written by main.py for each shard.
+
+    Returns:
+        Tuple[instrumentation.Metrics, dict]: The merged metrics, and the other fields of the merged report
+    """
+    metrics = instrumentation.Metrics()
+    rows_written: Dict[str, int] = {}
+    rate_limiter: Dict[str, float] = {}
+    for report in reports:
+        metrics.merge_report(report)
+        for dataset, rows in report['rows_written'].items():
+            rows_written[dataset] = rows_written.get(dataset, 0) + rows
+        for name, value in (report.get('rate_limiter') or {}).items():
+            rate_limiter[name] = rate_limiter.get(name, 0) + value
+
+    run_ids = sorted({report['run_id'] for report in reports})
+    extra = {'run_id': run_ids[0] if len(run_ids) == 1 else run_ids,
+             'datasets': sorted({dataset for report in reports for dataset in report['datasets']}),
+             'symbols': sum(report['symbols'] for report in reports),
+             'rows_written': rows_written,
+             'run_seconds': max((report['run_seconds'] for report in reports), default=0.0),
+             'rate_limiter': rate_limiter or None,
+             'shards': [{'shard': report.get('shard'),
+                         'symbols': report['symbols'],
+                         'run_seconds': report['run_seconds']} for report in reports]}
+    return metrics, extra
+
+
+def write_merged_report(reports: List[dict], report_file: Optional[str] = None, prometheus_file: Optional[str] = None) -> dict:
+    """
+    Merges the run reports of the shards of a run, logs the result and writes it to the given files.
+
+    Returns:
+        dict: The merged report
+    """
+    metrics, extra = merge_reports(reports)
+    logger.info(f'Merged report of {len(reports)} shards: {json.dumps({**metrics.report(), **extra}, default=str)}')
+    if report_file:
+        metrics.write_report(report_file, extra)
+    if prometheus_file:
+        metrics.write_prometheus(prometheus_file)
+    return {**metrics.report(), **extra}
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description='Work with the shards of a sharded ingestion run')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    merge_parser = subparsers.add_parser('merge', help='Merge the run reports written by the shards of a run')
+    merge_parser.add_argument('reports', nargs='+', help='The JSON run reports of the shards')
+    merge_parser.add_argument('--output', help='Write the merged JSON report to this file')
+    merge_parser.add_argument('--prometheus-file', help='Write the merged metrics in the Prometheus text format to this file')
+
+    args = parser.parse_args(argv)
+    reports = []
+    for path in args.reports:
+        with open(path) as f:
+            reports.append(json.load(f))
+    write_merged_report(reports, args.output, args.prometheus_file)
+
+
+if __name__ == '__main__':
+    main()
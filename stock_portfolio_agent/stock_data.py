@@ -5,22 +5,23 @@ This module contains a class for downloading & savingstock price data from the A
 """
 
 import concurrent.futures
-from typing import List, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 import datetime
+import math
 import random
-import os
-import csv
-import requests
-import json
 import pandas as pd
 import logging
 import yfinance
-import time
 
-import recommendation
-import price_target
 import stock_price
 import database_actions
+import fetch_engine
+import frame_conversion
+import instrumentation
+import price_cache
+import symbol_universe
+import trading_calendar
+import watermark
 
 
 logging.basicConfig(
@@ -34,14 +35,42 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class StockData:
-    def __init__(self):
-        self._symbols = self.download_list_of_symbols()
+    def __init__(self, engine: Optional[fetch_engine.FetchEngine] = None,
+                 ticker_factory: Callable[[str], yfinance.Ticker] = yfinance.Ticker,
+                 symbols: Optional[List[str]] = None,
+                 batch_downloader: Callable[..., pd.DataFrame] = yfinance.download,
+                 batch_size: int = 100,
+                 universe: Optional[symbol_universe.SymbolUniverse] = None,
+                 cache: Optional[price_cache.ParquetPriceCache] = None):
+        """
+        Args:
+            engine (fetch_engine.FetchEngine, optional): The engine used to fetch symbols concurrently.
+                Defaults to one configured from the environment.
+            ticker_factory (Callable[[str], yfinance.Ticker], optional): Builds the ticker object for a symbol.
+                Defaults to yfinance.Ticker.
+            symbols (List[str], optional): The symbols to work with. If None, the currently listed symbols
+                are read from the symbol universe the first time they are needed.
+            batch_downloader (Callable[..., pd.DataFrame], optional): Downloads the prices of several symbols in
+                one request. Defaults to yfinance.download.
+            batch_size (int, optional): The maximum number of symbols in one multi-ticker price request. Defaults to 100.
+            universe (symbol_universe.SymbolUniverse, optional): The cached listing symbols are read from when symbols
+                is None. Defaults to one configured from the environment.
+            cache (price_cache.ParquetPriceCache, optional): The price cache used by download_stock_price_data.
+                Defaults to one configured from the environment, created on first use.
+        """
+        self._engine = engine if engine is not None else fetch_engine.FetchEngine.from_env()
+        self._ticker_factory = ticker_factory
+        self._batch_downloader = batch_downloader
+        self._batch_size = batch_size
+        self._universe = universe if universe is not None else symbol_universe.SymbolUniverse(self._engine)
+        self._symbols = symbols
+        self._price_cache = cache
         #self.data = self.download_stock_price_data()
         pass
 
     def download_stock_price_data(self, time_period: str = '5y', number_of_symbols: int = 20, check_file: bool = False) -> pd.DataFrame:
         """
-        Retrieves stock price data from the yfinance API. The format
+        Retrieves stock price data from the yfinance API, keeping it in the local Parquet price cache. The format
         of the returned data has the following columns:
         | symbol | Date | Open | Close |
 
@@ -50,71 +79,239 @@ class StockData:
                                         Must be one of the following: '1d', '5d', '1mo', '3mo', '6mo', '1y', '2y', '5y', '10y', 'ytd', 'max'
             number_of_symbols (int, optional): The number of symbols to retrieve stock price data for. Defaults to 20.
                 If None, will retrieve data for all symbols
-            check_file (bool, optional): Whether to check if a file of previously-downloaded stock price data exists before downloading. Defaults to False.
+            check_file (bool, optional): Whether to use the prices already in the cache. Symbols whose cached history
+                covers the time period only have the days since their last download fetched. Defaults to False.
 
         Returns:
             pd.DataFrame: A pandas DataFrame containing the stock price data
         """
+        if self._price_cache is None:
+            self._price_cache = price_cache.ParquetPriceCache()
+        cache = self._price_cache
 
-        filename = 'stock_data.csv'
-    
-        if os.path.exists(filename) and check_file:
-            logger.info('Loading stock price data from file')
-            data = pd.read_csv(filename)
-            return data
+        today = datetime.date.today()
+        start_date = price_cache.period_start(time_period, today)
 
-        logger.info('Downloading stock price data')
-     
-        all_symbols = self._symbols
+        all_symbols = self.get_list_of_symbols()
 
         if number_of_symbols is not None:
             all_symbols = random.sample(all_symbols, number_of_symbols)
 
-
-        results = pd.DataFrame()
+        # Each symbol is either appended to from the end of its cached range, or downloaded in full
+        appends = {}
         for symbol in all_symbols:
-            logger.info(f'Getting data for {symbol}')
-            
-            data_df = yfinance.Ticker(symbol).history(period=time_period).reset_index()
-            data_df['symbol'] = symbol
-            
-            data_df = data_df[['symbol', 'Date', 'Open', 'Close']]
-            results = pd.concat([results, data_df], axis=0)
+            coverage = cache.get_coverage(symbol) if check_file else None
+            if coverage is not None and (coverage[0] is None or (start_date is not None and coverage[0] <= start_date)):
+                if len(trading_calendar.trading_days(coverage[1], today)) > 0:
+                    appends[symbol] = coverage[1]
+            else:
+                appends[symbol] = None
 
-        results.to_csv(filename, index=False)
+        logger.info(f'Downloading stock price data for {len(appends)} of {len(all_symbols)} symbols')
 
-        return results
+        def download(symbol: str) -> Optional[pd.DataFrame]:
+            append_from = appends[symbol]
+            try:
+                if append_from is None:
+                    return self._engine.call_with_retry(
+                        f'data for {symbol}', lambda: self._ticker_factory(symbol).history(period=time_period).reset_index(),
+                        dataset='price_cache')
+                return self._engine.call_with_retry(
+                    f'data for {symbol}',
+                    lambda: self._ticker_factory(symbol).history(start=append_from.isoformat(), end=today.isoformat()).reset_index(),
+                    dataset='price_cache')
+            except Exception:
+                logger.warning(f'!!!WARNING: {symbol} data never retrieved')
+                return None
+
+        symbols_to_download = list(appends)
+        for symbol, data_df in zip(symbols_to_download, self._engine.imap(download, symbols_to_download)):
+            if data_df is not None:
+                cache.write(symbol, data_df, start_date, today, replace=appends[symbol] is None)
+
+        data = cache.read(all_symbols, start=start_date, columns=['Open', 'Close'])
+        return data[['symbol', 'Date', 'Open', 'Close']]
+
+    def download_stock_prices(self, db_actions: database_actions.DatabaseActions, symbols: List[str]) -> pd.DataFrame:
+        """
+        Retrieves the daily stock prices of the given symbols from the yfinance API, starting after the latest
+        date already stored for each symbol.
 
-    def download_stock_prices(self, db_actions: database_actions.DatabaseActions, symbols: List[str]) -> List[price_target.PriceTarget]:
+        Args:
+            db_actions (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+            symbols (List[str]): The stock symbols for which to retrieve prices.
+        Returns:
+            pd.DataFrame: The price data in the columns of the stock_price table (see frame_conversion.STOCK_PRICE_COLUMNS),
+                in the order of symbols
         """
-        Retrieves the price targets from the yfinance API.
+        prices_by_symbol = self.download_stock_prices_by_symbol(db_actions, symbols)
+        return frame_conversion.concat_stock_price_frames([prices_by_symbol[symbol] for symbol in symbols if symbol in prices_by_symbol])
+
+    def iter_stock_prices(self, db_actions: database_actions.DatabaseActions, symbols: Optional[List[str]] = None,
+                          watermarks: Optional[watermark.WatermarkStore] = None) -> Iterator[Tuple[str, bool, pd.DataFrame]]:
+        """
+        Retrieves the daily stock prices of the given symbols slice by slice, yielding each symbol's result as
+        soon as its slice is downloaded, so only one slice is held in memory at a time.
 
         Args:
-            None
+            db_actions (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+            symbols (List[str], optional): The stock symbols for which to retrieve prices. Defaults to all symbols.
+            watermarks (watermark.WatermarkStore, optional): The stock_price watermarks to start each symbol after.
+                If None, the latest stored dates are queried from the stock_price table for every slice.
+        Returns:
+            Iterator[Tuple[str, bool, pd.DataFrame]]: The symbol, whether its prices were retrieved, and the price data
+                in the columns of the stock_price table, in the order of symbols
+        """
+        symbols = symbols if symbols is not None else self.get_list_of_symbols()
+        for k in range(0, len(symbols), self._batch_size):
+            symbol_slice = symbols[k:k + self._batch_size]
+            max_dates = watermarks.get_many(symbol_slice) if watermarks is not None else None
+            prices_by_symbol = self.download_stock_prices_by_symbol(db_actions, symbol_slice, max_dates)
+            for symbol in symbol_slice:
+                if symbol in prices_by_symbol:
+                    yield symbol, True, prices_by_symbol[symbol]
+                else:
+                    yield symbol, False, frame_conversion.empty_stock_price_frame()
+
+    def download_stock_prices_by_symbol(self, db_actions: database_actions.DatabaseActions, symbols: List[str],
+                                        max_dates: Optional[Dict[str, datetime.date]] = None) -> Dict[str, pd.DataFrame]:
+        """
+        Retrieves the daily stock prices of the given symbols from the yfinance API, starting at the first trading
+        day after the latest date already stored for each symbol.
+
+        Symbols that share a start date are downloaded together in multi-ticker calls of up to batch_size
+        symbols, split so that every worker gets a batch. yfinance still makes one upstream request per ticker,
+        so each call is charged to the rate limiter per ticker. Only the symbols missing from a batch result are
+        fetched again one at a time.
+
+        Args:
+            db_actions (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+            symbols (List[str]): The stock symbols for which to retrieve prices.
+            max_dates (Dict[str, datetime.date], optional): The latest date already stored for each symbol. If None,
+                it is queried from the stock_price table.
         Returns:
-            List[price_target.PriceTarget]: A list of Recommendation objects containing the analyst price targets data
+            Dict[str, pd.DataFrame]: The price data of each symbol that was retrieved, in the columns of the stock_price table.
+                Symbols with no trading day missing get an empty frame without a request.
         """
         today = datetime.date.today()
         now = datetime.datetime.now()
 
-        symbol_maxes = stock_price.StockPrice().get_max_date_by_symbol(db_actions)
-        final_list = []
+        symbol_maxes = max_dates if max_dates is not None else stock_price.StockPrice().get_max_date_by_symbol(db_actions, symbols)
+        start_dates = {}
+        prices_by_symbol = {}
 
         for symbol in symbols:
             if symbol in symbol_maxes:
-                max_existing_date = symbol_maxes[symbol]
+                missing = trading_calendar.missing_range(symbol_maxes[symbol], today)
+            else:
+                missing = (today - datetime.timedelta(days=99*365), today)
+
+            if missing is None:
+                # No trading day has closed since the last stored bar, so there is nothing to ask for
+                prices_by_symbol[symbol] = frame_conversion.empty_stock_price_frame()
             else:
-                max_existing_date = today - datetime.timedelta(days=99*365)
+                start_dates[symbol] = missing[0]
 
-            start_date = max_existing_date + datetime.timedelta(days=2)
+        current = len(prices_by_symbol)
+        if current > 0:
+            logger.info(f'Skipping {current} of {len(symbols)} symbols with prices through {trading_calendar.previous_trading_day(today)}')
+            instrumentation.metrics.increment('skipped_current', current, dataset='stock_price')
+        symbols = [symbol for symbol in symbols if symbol in start_dates]
 
-            worked, prices = self.download_price_of_one_symbol(symbol, today, now, start_date)
+        batches = []
+        symbols_by_start_date = {}
+        for symbol in symbols:
+            symbols_by_start_date.setdefault(start_dates[symbol], []).append(symbol)
+        for start_date, group in symbols_by_start_date.items():
+            # On an incremental run most symbols share one start date, so spread the group over the workers
+            batch_size = max(1, min(self._batch_size, math.ceil(len(group) / self._engine.max_workers)))
+            for k in range(0, len(group), batch_size):
+                batches.append((start_date, group[k:k + batch_size]))
+
+        for batch_prices in self._engine.map(lambda batch: self.download_prices_of_symbols(batch[1], today, now, batch[0]), batches):
+            prices_by_symbol.update(batch_prices)
+
+        failed = [symbol for symbol in symbols if symbol not in prices_by_symbol]
+        instrumentation.metrics.increment('batch_fallbacks', len(failed), dataset='stock_price')
+        if len(failed) > 0:
+            logger.info(f'Falling back to single-symbol requests for {len(failed)} of {len(symbols)} symbols')
+        results = self._engine.map(
+            lambda symbol: self.download_price_of_one_symbol(symbol, today, now, start_dates[symbol]), failed)
+        for symbol, (worked, prices) in zip(failed, results):
             if worked:
-                final_list.extend(prices)
+                prices_by_symbol[symbol] = prices
+
+        return prices_by_symbol
+
+    def download_prices_of_symbols(self, symbols: List[str], today: datetime.date, now: datetime.datetime, start_date: datetime.date) -> Dict[str, pd.DataFrame]:
+        """
+        Retrieves the stock price data of several symbols in one multi-ticker yfinance.download call. yfinance
+        requests the tickers one after another, so the call takes one rate limiter token per symbol.
+
+        Args:
+            symbols (List[str]): The stock symbols for which to retrieve the price data.
+            today (datetime.date): The current date.
+            now (datetime.datetime): The current datetime.
+            start_date (datetime.date): The date from which to begin retrieving price data for every symbol.
 
-        return final_list
+        Returns:
+            Dict[str, pd.DataFrame]: The price data of each symbol that came back with data, in the columns of the
+                stock_price table. Symbols that failed or returned no rows are left out.
+        """
+        logger.info(f'Getting prices for {len(symbols)} symbols starting {start_date.isoformat()}')
+        try:
+            wide_df = self._engine.call_with_retry(
+                f'prices for {len(symbols)} symbols',
+                lambda: self._batch_downloader(symbols, start=start_date.isoformat(), end=today.isoformat(),
+                                               group_by='ticker', actions=True, auto_adjust=True, ignore_tz=False,
+                                               threads=False, progress=False),
+                dataset='stock_price_batch', cost=len(symbols))
+        except Exception:
+            # The failed symbols fall back to single-symbol requests, so log why instead of failing the run
+            logger.exception(f'!!!ERROR: prices for {len(symbols)} symbols starting {start_date.isoformat()} never retrieved')
+            return {}
+
+        prices_by_symbol = {}
+        with instrumentation.metrics.timer('convert', dataset='stock_price'):
+            for symbol, data_df in self.split_multi_ticker_frame(wide_df, symbols).items():
+                prices_by_symbol[symbol] = frame_conversion.stock_price_frame(symbol, data_df, now)
+        return prices_by_symbol
+
+    @staticmethod
+    def split_multi_ticker_frame(wide_df: pd.DataFrame, symbols: List[str]) -> Dict[str, pd.DataFrame]:
+        """
+        Splits the wide result of a multi-ticker yfinance.download call into one frame per symbol, in the
+        same format Ticker.history(...).reset_index() returns.
 
-    def download_price_of_one_symbol(self, symbol: str, today: datetime.date, now: datetime.datetime, start_date: datetime.date) -> Tuple[bool, List[stock_price.StockPrice]]:
+        Args:
+            wide_df (pd.DataFrame): The downloaded frame, with (symbol, field) column pairs.
+            symbols (List[str]): The symbols that were requested.
+
+        Returns:
+            Dict[str, pd.DataFrame]: The frame of each symbol that has at least one row with a close price
+        """
+        frames = {}
+        if wide_df is None or len(wide_df) == 0:
+            return frames
+
+        if not isinstance(wide_df.columns, pd.MultiIndex):
+            if len(symbols) != 1:
+                return frames
+            wide_df = pd.concat({symbols[0]: wide_df}, axis=1)
+
+        available = set(wide_df.columns.get_level_values(0))
+        for symbol in symbols:
+            if symbol not in available:
+                continue
+            data_df = wide_df[symbol].dropna(subset=['Close'])
+            if len(data_df) == 0:
+                continue
+            data_df = data_df.fillna({'Dividends': 0.0, 'Stock Splits': 0.0, 'Volume': 0})
+            data_df.index.name = 'Date'
+            frames[symbol] = data_df.reset_index()
+        return frames
+
+    def download_price_of_one_symbol(self, symbol: str, today: datetime.date, now: datetime.datetime, start_date: datetime.date) -> Tuple[bool, pd.DataFrame]:
 
         """
         Retrieves the stock price data for a given stock symbol from the yfinance API.
@@ -126,43 +323,31 @@ class StockData:
             start_date (datetime.date): The date from which to begin retrieving price data.
 
         Returns:
-            Tuple[bool, List[stock_price.StockPrice]]: A tuple containing a boolean indicating success and a list of StockPrice objects with the price data.
+            Tuple[bool, pd.DataFrame]: A tuple containing a boolean indicating success and the price data in the columns of the stock_price table.
         """
-        iteration = 0
-        prices = []
+        prices = frame_conversion.empty_stock_price_frame()
         worked = False
         data_df = None
-        while iteration < 3:
-            logger.info(f'Getting price for {symbol}')
-            try:
-                data_df = yfinance.Ticker(symbol).history(start=start_date.isoformat(), end=today.isoformat()).reset_index()
-                break
-            except Exception as e:
-                logger.error(f'Error getting price for {symbol}: {e}')
-                iteration += 1
-                time.sleep(1)
+        logger.info(f'Getting price for {symbol}')
+        try:
+            data_df = self._engine.call_with_retry(
+                f'price for {symbol}',
+                lambda: self._ticker_factory(symbol).history(start=start_date.isoformat(), end=today.isoformat()).reset_index(),
+                dataset='stock_price')
+        except Exception:
+            pass
         if data_df is None or len(data_df) == 0:
             logger.warning(f'!!!WARNING: {symbol} price never retrieved')
+            if data_df is not None:
+                instrumentation.metrics.increment('empty_frames', dataset='stock_price')
         else:
-            for i in data_df.index:
-                row = data_df.loc[i]
-                price = stock_price.StockPrice(id=symbol + '_' + row['Date'].isoformat(),
-                                               symbol=symbol,
-                                               date=row['Date'],
-                                               open_price=float(row['Open']),
-                                               high_price=float(row['High']),
-                                               low_price=float(row['Low']),
-                                               close_price=float(row['Close']),
-                                               volume=int(row['Volume']),
-                                               dividends=float(row['Dividends']),
-                                               stock_splits=float(row['Stock Splits']),
-                                               inserted_at=now)
-                prices.append(price)
+            with instrumentation.metrics.timer('convert', dataset='stock_price'):
+                prices = frame_conversion.stock_price_frame(symbol, data_df, now)
             worked = True
 
         return worked, prices
 
-    def download_recommendations(self) -> List[recommendation.Recommendation]:
+    def download_recommendations(self) -> pd.DataFrame:
         """
         Retrieves the recommendations counts from the yfinance API. The format
         of the returned data has the following columns:
@@ -171,87 +356,113 @@ class StockData:
         Args:
             None
         Returns:
-            List[recommendation.Recommendation]: A list of Recommendation objects containing the stock recommendation data
+            pd.DataFrame: The stock recommendation data in the columns of the recommendation table, one row per symbol
         """
-        today = datetime.date.today()
         final_list = []
+        for symbol, worked, recs in self.iter_recommendations():
+            final_list.extend(recs)
+        return pd.DataFrame(final_list)
 
-        for symbol in self._symbols:
-            worked, rec = self.download_recommedation_of_one_symbol(symbol, today)
-            if worked:
-                final_list.append(rec)
-        return final_list
+    def iter_recommendations(self, symbols: Optional[List[str]] = None) -> Iterator[Tuple[str, bool, List[Dict[str, Any]]]]:
+        """
+        Retrieves the recommendation counts of the given symbols, yielding each symbol's result as soon as it
+        and the ones before it are downloaded.
 
-    def download_recommedation_of_one_symbol(self, symbol: str, today: datetime.date) -> Tuple[bool, recommendation.Recommendation]:
+        Args:
+            symbols (List[str], optional): The stock symbols for which to retrieve recommendations. Defaults to all symbols.
+        Returns:
+            Iterator[Tuple[str, bool, List[Dict[str, Any]]]]: The symbol, whether its recommendations were retrieved,
+                and its recommendation table rows, in the order of symbols
+        """
+        today = datetime.date.today()
+        symbols = symbols if symbols is not None else self.get_list_of_symbols()
+        results = self._engine.imap(lambda symbol: self.download_recommedation_of_one_symbol(symbol, today), symbols)
+        for symbol, (worked, rec) in zip(symbols, results):
+            yield symbol, worked, [rec] if worked else []
+
+    def download_recommedation_of_one_symbol(self, symbol: str, today: datetime.date) -> Tuple[bool, Dict[str, Any]]:
         
         """
         Retrieves the recommendation counts for a given stock symbol from the yfinance API.
 
-        The function attempts to get the recommendation counts for the specified symbol up to three times. If successful, it returns a Recommendation object with the strongBuy, buy, hold, sell, and strongSell counts. Otherwise, it logs warnings if the data could not be retrieved.
+        The function attempts to get the recommendation counts for the specified symbol, retrying with backoff through the fetch engine. If successful, it returns a row of the recommendation table with the strongBuy, buy, hold, sell, and strongSell counts. Otherwise, it logs warnings if the data could not be retrieved.
 
         Args:
             symbol (str): The stock symbol for which to retrieve the recommendation counts.
             today (datetime.date): The current date.
 
         Returns:
-            Tuple[bool, recommendation.Recommendation]: A tuple containing a boolean indicating success and a Recommendation object with the recommendation counts.
+            Tuple[bool, Dict[str, Any]]: A tuple containing a boolean indicating success and a recommendation table row with the recommendation counts.
 
         """
-        iteration = 0
         rec = None
         worked = False
         data_df = None
-        while iteration < 3:
-            logger.info(f'Getting recommendation counts for {symbol}')
-            try:
-                data_df = yfinance.Ticker(symbol).get_recommendations()
-                break
-            except Exception as e:
-                logger.error(f'Error getting recommendation counts for {symbol}: {e}')
-                iteration += 1
-                time.sleep(1)
+        logger.info(f'Getting recommendation counts for {symbol}')
+        try:
+            data_df = self._engine.call_with_retry(
+                f'recommendation counts for {symbol}',
+                lambda: self._ticker_factory(symbol).get_recommendations(),
+                dataset='recommendation')
+        except Exception:
+            pass
         if data_df is None:
             logger.warning(f'!!!WARNING: {symbol} recommendations never retrieved')
-        if 'strongBuy' in data_df and len(data_df) > 0:
+        elif 'strongBuy' in data_df and len(data_df) > 0:
             data_df = data_df.iloc[0]
-            rec = recommendation.Recommendation(
-                id = symbol + '_' + today.isoformat(),
-                symbol = symbol,
-                date = today,
-                strong_buy = int(data_df['strongBuy']),
-                buy = int(data_df['buy']),
-                hold = int(data_df['hold']),
-                sell = int(data_df['sell']),
-                strong_sell = int(data_df['strongSell'])
-            )
+            rec = {
+                'id': symbol + '_' + today.isoformat(),
+                'symbol': symbol,
+                'date': today,
+                'strong_buy': int(data_df['strongBuy']),
+                'buy': int(data_df['buy']),
+                'hold': int(data_df['hold']),
+                'sell': int(data_df['sell']),
+                'strong_sell': int(data_df['strongSell'])
+            }
             worked = True
+        else:
+            instrumentation.metrics.increment('empty_frames', dataset='recommendation')
 
         return worked, rec
 
-    def download_price_targets(self) -> List[price_target.PriceTarget]:
+    def download_price_targets(self) -> pd.DataFrame:
         """
         Retrieves the price targets from the yfinance API.
 
         Args:
             None
         Returns:
-            List[price_target.PriceTarget]: A list of Recommendation objects containing the analyst price targets data
+            pd.DataFrame: The analyst price targets data in the columns of the price_target table, one row per symbol
         """
-        today = datetime.date.today()
         final_list = []
+        for symbol, worked, targets in self.iter_price_targets():
+            final_list.extend(targets)
+        return pd.DataFrame(final_list)
 
-        for symbol in self._symbols:
-            worked, target = self.download_price_target_of_one_symbol(symbol, today)
-            if worked:
-                final_list.append(target)
-        return final_list
-    def download_price_target_of_one_symbol(self, symbol: str, today: datetime.date) -> Tuple[
-        bool, price_target.PriceTarget]:
+    def iter_price_targets(self, symbols: Optional[List[str]] = None) -> Iterator[Tuple[str, bool, List[Dict[str, Any]]]]:
+        """
+        Retrieves the price targets of the given symbols, yielding each symbol's result as soon as it and the
+        ones before it are downloaded.
+
+        Args:
+            symbols (List[str], optional): The stock symbols for which to retrieve price targets. Defaults to all symbols.
+        Returns:
+            Iterator[Tuple[str, bool, List[Dict[str, Any]]]]: The symbol, whether its price target was retrieved,
+                and its price_target table rows, in the order of symbols
+        """
+        today = datetime.date.today()
+        symbols = symbols if symbols is not None else self.get_list_of_symbols()
+        results = self._engine.imap(lambda symbol: self.download_price_target_of_one_symbol(symbol, today), symbols)
+        for symbol, (worked, target) in zip(symbols, results):
+            yield symbol, worked, [target] if worked else []
+
+    def download_price_target_of_one_symbol(self, symbol: str, today: datetime.date) -> Tuple[bool, Dict[str, Any]]:
 
         """
         Retrieves the price target for a given stock symbol from the yfinance API.
 
-        The function attempts to get the price target for the specified symbol up to three times. If successful, it returns a PriceTarget object with
+        The function attempts to get the price target for the specified symbol, retrying with backoff through the fetch engine. If successful, it returns a row of the price_target table with
         the current, low, high, mean, and median price targets. Otherwise, it logs warnings if the data could not be retrieved.
 
         Args:
@@ -259,22 +470,20 @@ class StockData:
             today (datetime.date): The current date.
 
         Returns:
-            Tuple[bool, price_target.PriceTarget]: A tuple containing a boolean indicating success and a PriceTarget object with the price target data.
+            Tuple[bool, Dict[str, Any]]: A tuple containing a boolean indicating success and a price_target table row with the price target data.
 
         """
-        iteration = 0
         target = None
         worked = False
         data_dict = None
-        while iteration < 3:
-            logger.info(f'Getting price target for {symbol}')
-            try:
-                data_dict = yfinance.Ticker(symbol).get_analyst_price_targets()
-                break
-            except Exception as e:
-                logger.error(f'Error getting price target for {symbol}: {e}')
-                iteration += 1
-                time.sleep(1)
+        logger.info(f'Getting price target for {symbol}')
+        try:
+            data_dict = self._engine.call_with_retry(
+                f'price target for {symbol}',
+                lambda: self._ticker_factory(symbol).get_analyst_price_targets(),
+                dataset='price_target')
+        except Exception:
+            pass
         if data_dict is None:
             logger.warning(f'!!!WARNING: {symbol} price target never retrieved')
         elif 'current' in data_dict and \
@@ -282,56 +491,206 @@ class StockData:
                 'high' in data_dict and \
                 'mean' in data_dict and \
                 'median' in data_dict:
-            target = price_target.PriceTarget(
-                                              id=symbol + '_' + today.isoformat(),
-                                              symbol=symbol,
-                                              date=today,
-                                              current=float(data_dict['current']) if data_dict['current'] is not None else None,
-                                              low=float(data_dict['low']) if data_dict['low'] is not None else None,
-                                              high=float(data_dict['high']) if data_dict['high'] is not None else None,
-                                              mean=float(data_dict['mean']) if data_dict['mean'] is not None else None,
-                                              median=float(data_dict['median']) if data_dict['median'] is not None else None
-            )
+            target = {
+                'id': symbol + '_' + today.isoformat(),
+                'symbol': symbol,
+                'date': today,
+                'current': float(data_dict['current']) if data_dict['current'] is not None else None,
+                'low': float(data_dict['low']) if data_dict['low'] is not None else None,
+                'high': float(data_dict['high']) if data_dict['high'] is not None else None,
+                'mean': float(data_dict['mean']) if data_dict['mean'] is not None else None,
+                'median': float(data_dict['median']) if data_dict['median'] is not None else None
+            }
             worked = True
         else:
             logger.warning(f'!!!WARNING: {symbol} price target incomplete')
+            instrumentation.metrics.increment('incomplete', dataset='price_target')
 
         return worked, target
 
-    def download_list_of_symbols(self) -> List[str]:
+    def download_growth_estimates(self) -> pd.DataFrame:
         """
-        Retrieves a list of currently listed US stock symbols
+        Retrieves the analysts' growth estimates from the yfinance API.
 
+        Args:
+            None
         Returns:
-            List[str]: The list of stock symbols
+            pd.DataFrame: The growth estimates in the columns of the growth_estimate table, one row per symbol
+        """
+        final_list = []
+        for symbol, worked, estimates in self.iter_growth_estimates():
+            final_list.extend(estimates)
+        return pd.DataFrame(final_list)
+
+    def iter_growth_estimates(self, symbols: Optional[List[str]] = None) -> Iterator[Tuple[str, bool, List[Dict[str, Any]]]]:
+        """
+        Retrieves the growth estimates of the given symbols, yielding each symbol's result as soon as it and the
+        ones before it are downloaded.
+
+        Args:
+            symbols (List[str], optional): The stock symbols for which to retrieve growth estimates. Defaults to all symbols.
+        Returns:
+            Iterator[Tuple[str, bool, List[Dict[str, Any]]]]: The symbol, whether its growth estimates were retrieved,
+                and its growth_estimate table rows, in the order of symbols
+        """
+        today = datetime.date.today()
+        symbols = symbols if symbols is not None else self.get_list_of_symbols()
+        results = self._engine.imap(lambda symbol: self.download_growth_estimate_of_one_symbol(symbol, today), symbols)
+        for symbol, (worked, estimate) in zip(symbols, results):
+            yield symbol, worked, [estimate] if worked else []
+
+    def download_growth_estimate_of_one_symbol(self, symbol: str, today: datetime.date) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Retrieves the growth estimates for a given stock symbol from the yfinance API.
+
+        The function attempts to get the growth estimates for the specified symbol, retrying with backoff through the fetch engine. If successful,
+        it returns a row of the growth_estimate table with the stock's estimated growth for the current quarter, next quarter, current year
+        and next year. Otherwise, it logs warnings if the data could not be retrieved.
+
+        Args:
+            symbol (str): The stock symbol for which to retrieve the growth estimates.
+            today (datetime.date): The current date.
+
+        Returns:
+            Tuple[bool, Dict[str, Any]]: A tuple containing a boolean indicating success and a growth_estimate table row with the growth estimates.
+        """
+        estimate = None
+        worked = False
+        data_df = None
+        logger.info(f'Getting growth estimates for {symbol}')
+        try:
+            data_df = self._engine.call_with_retry(
+                f'growth estimates for {symbol}',
+                lambda: self._ticker_factory(symbol).get_growth_estimates(),
+                dataset='growth_estimate')
+        except Exception:
+            pass
+        if data_df is None:
+            logger.warning(f'!!!WARNING: {symbol} growth estimates never retrieved')
+            return worked, estimate
+
+        # Newer yfinance versions name the column of the stock's own estimates stockTrend instead of stock
+        column = 'stockTrend' if 'stockTrend' in data_df else 'stock'
+        if column in data_df and len(data_df) > 0:
+            values = data_df[column]
+
+            def get_value(period: str) -> Optional[float]:
+                value = values.get(period)
+                return float(value) if value is not None and not pd.isna(value) else None
+
+            estimate = {
+                'id': symbol + '_' + today.isoformat(),
+                'symbol': symbol,
+                'date': today,
+                'current_quarter': get_value('0q'),
+                'next_quarter': get_value('+1q'),
+                'current_year': get_value('0y'),
+                'next_year': get_value('+1y')
+            }
+            worked = True
+        else:
+            logger.warning(f'!!!WARNING: {symbol} growth estimates incomplete')
+            instrumentation.metrics.increment('incomplete', dataset='growth_estimate')
+
+        return worked, estimate
 
+    def download_insider_transactions(self) -> pd.DataFrame:
         """
-        logger.info('Getting list of stock symbols')
+        Retrieves the summaries of insider purchases and sales from the yfinance API.
 
-        url = 'https://www.alphavantage.co/query'
-        api_key = os.getenv('ALPHAVANTAGE_API_KEY')
+        Args:
+            None
+        Returns:
+            pd.DataFrame: The insider transaction summaries in the columns of the insider_transaction table, one row per symbol
+        """
+        final_list = []
+        for symbol, worked, transactions in self.iter_insider_transactions():
+            final_list.extend(transactions)
+        return pd.DataFrame(final_list)
+
+    def iter_insider_transactions(self, symbols: Optional[List[str]] = None) -> Iterator[Tuple[str, bool, List[Dict[str, Any]]]]:
+        """
+        Retrieves the insider transaction summaries of the given symbols, yielding each symbol's result as soon as it
+        and the ones before it are downloaded.
+
+        Args:
+            symbols (List[str], optional): The stock symbols for which to retrieve insider transactions. Defaults to all symbols.
+        Returns:
+            Iterator[Tuple[str, bool, List[Dict[str, Any]]]]: The symbol, whether its insider transactions were retrieved,
+                and its insider_transaction table rows, in the order of symbols
+        """
+        today = datetime.date.today()
+        symbols = symbols if symbols is not None else self.get_list_of_symbols()
+        results = self._engine.imap(lambda symbol: self.download_insider_transaction_of_one_symbol(symbol, today), symbols)
+        for symbol, (worked, transaction) in zip(symbols, results):
+            yield symbol, worked, [transaction] if worked else []
+
+    def download_insider_transaction_of_one_symbol(self, symbol: str, today: datetime.date) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Retrieves the summary of insider purchases and sales over the last six months for a given stock symbol from the yfinance API.
+
+        The function attempts to get the summary for the specified symbol, retrying with backoff through the fetch engine. If successful,
+        it returns a row of the insider_transaction table with the number of shares purchased, sold and held by insiders. Otherwise, it
+        logs warnings if the data could not be retrieved.
 
-        symbol_index = 0
-        exchange_index = 2
+        Args:
+            symbol (str): The stock symbol for which to retrieve the insider transactions.
+            today (datetime.date): The current date.
 
-        params =  {'function': 'LISTING_STATUS',
-                'apikey': api_key}
+        Returns:
+            Tuple[bool, Dict[str, Any]]: A tuple containing a boolean indicating success and an insider_transaction table row with the share counts.
+        """
+        transaction = None
+        worked = False
+        data_df = None
+        logger.info(f'Getting insider transactions for {symbol}')
+        try:
+            data_df = self._engine.call_with_retry(
+                f'insider transactions for {symbol}',
+                lambda: self._ticker_factory(symbol).get_insider_purchases(),
+                dataset='insider_transaction')
+        except Exception:
+            pass
+        if data_df is None:
+            logger.warning(f'!!!WARNING: {symbol} insider transactions never retrieved')
+            return worked, transaction
+
+        label_column = 'Insider Purchases Last 6m'
+        if label_column in data_df and 'Shares' in data_df and len(data_df) > 0:
+            shares = data_df.set_index(label_column)['Shares']
+
+            def get_shares(label: str) -> Optional[int]:
+                value = shares.get(label)
+                return int(value) if value is not None and not pd.isna(value) else None
+
+            transaction = {
+                'id': symbol + '_' + today.isoformat(),
+                'symbol': symbol,
+                'date': today,
+                'purchases': get_shares('Purchases'),
+                'sales': get_shares('Sales'),
+                'insider_shares_held': get_shares('Total Insider Shares Held')
+            }
+            worked = True
+        else:
+            logger.warning(f'!!!WARNING: {symbol} insider transactions incomplete')
+            instrumentation.metrics.increment('incomplete', dataset='insider_transaction')
 
-        all_symbols = []
+        return worked, transaction
 
-        with requests.Session() as s:
-            download = s.get(url, params=params)
-            decoded_content = download.content.decode('utf-8')
-            cr = csv.reader(decoded_content.splitlines(), delimiter=',')
-            my_list = list(cr)
-            for row in my_list:
-                all_symbols.append(row[symbol_index])
+    def download_list_of_symbols(self) -> List[str]:
+        """
+        Retrieves a list of currently listed US stock symbols, from the local symbol cache when it is fresh
 
-        symbols = all_symbols[1:]
-        logger.info(f'Retrieved {len(symbols)} symbols')
-        return symbols
+        Returns:
+            List[str]: The list of stock symbols
+
+        """
+        return self._universe.get_symbols()
 
     def get_list_of_symbols(self) -> List[str]:
+        if self._symbols is None:
+            self._symbols = self.download_list_of_symbols()
         return self._symbols
 
     def get_stock_price_data(self) -> dict:
@@ -1,10 +1,11 @@
 import datetime
 from database_base import Base
 import database_actions
-from sqlalchemy import String, Date, Float, text, BigInteger
+from sqlalchemy import String, Date, Float, text, BigInteger, bindparam
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
-from typing import Dict
+from typing import Dict, List, Optional
 import datetime
 
 
@@ -12,9 +13,11 @@ class StockPrice(Base):
     __tablename__ = "stock_price"
     __table_args__ = {"schema": database_actions.DatabaseActions.raw_schema_name}
 
-    id: Mapped[str] = mapped_column(primary_key=True)
-    symbol: Mapped[str] = mapped_column(String(10))
-    date: Mapped[datetime.date] = mapped_column(Date)
+    # (symbol, date) is the key so that the latest date of a symbol is an index-only lookup.
+    # id is kept as a plain column for readers of the old symbol_isoformat key
+    symbol: Mapped[str] = mapped_column(String(10), primary_key=True)
+    date: Mapped[datetime.date] = mapped_column(Date, primary_key=True)
+    id: Mapped[str] = mapped_column(String)
     open_price: Mapped[float]
     high_price: Mapped[float]
     low_price: Mapped[float]
@@ -24,29 +27,54 @@ class StockPrice(Base):
     stock_splits: Mapped[float]
     inserted_at: Mapped[datetime.datetime] = mapped_column(default=datetime.datetime.now())
 
-    def get_max_date_by_symbol(self, db_actions: database_actions.DatabaseActions) -> Dict[str, datetime.date]:
+    def get_max_date_by_symbol(self, db_actions: database_actions.DatabaseActions, symbols: Optional[List[str]] = None) -> Dict[str, datetime.date]:
         """
         Retrieves a dictionary of the maximum date for each symbol in the stock_price table.
 
+        With symbols given, only those symbols are looked up. On PostgreSQL each is then a backward scan of
+        the (symbol, date) key that stops at its first entry, rather than an aggregate over the whole table.
+
         Args:
             db_actions (database_actions.DatabaseAction): An instance of DatabaseActions for connecting to the database
+            symbols (List[str], optional): The symbols to look up. Defaults to every symbol in the table.
 
         Returns:
             Dict[str, datetime.date]: A dictionary where the keys are the stock symbols and the values are the
-                maximum dates in the stock_price table
+                maximum dates in the stock_price table. Symbols without prices are left out.
 
         """
+        if symbols is not None and len(symbols) == 0:
+            return {}
+
         engine = db_actions.get_engine()
-        query = f"""
-            SELECT symbol, MAX(date) AS max_date
-            FROM {self.__table_args__['schema']}.{self.__tablename__}
-            GROUP BY symbol"""
+        table = f"{self.__table_args__['schema']}.{self.__tablename__}"
+        parameters = {}
+        if symbols is None:
+            query = text(f"""
+                SELECT symbol, MAX(date) AS max_date
+                FROM {table}
+                GROUP BY symbol""")
+        elif engine.dialect.name == 'postgresql':
+            query = text(f"""
+                SELECT s.symbol, (SELECT MAX(p.date) FROM {table} p WHERE p.symbol = s.symbol) AS max_date
+                FROM unnest(:symbols) AS s(symbol)""").bindparams(bindparam('symbols', type_=postgresql.ARRAY(String)))
+            parameters['symbols'] = list(symbols)
+        else:
+            query = text(f"""
+                SELECT symbol, MAX(date) AS max_date
+                FROM {table}
+                WHERE symbol IN :symbols
+                GROUP BY symbol""").bindparams(bindparam('symbols', expanding=True))
+            parameters['symbols'] = list(symbols)
 
         max_dates = {}
         with engine.connect() as conn:
-            result = conn.execute(text(query))
+            result = conn.execute(query, parameters)
             for r in result.all():
-                max_dates[r[0]] = r[1]
+                if r[1] is None:
+                    continue
+                # SQLite returns dates from a text query as ISO strings
+                max_dates[r[0]] = datetime.date.fromisoformat(r[1]) if isinstance(r[1], str) else r[1]
 
         return max_dates
     def __repr__(self) -> str:
@@ -0,0 +1,198 @@
+
+"""
+This module contains a locally cached copy of the AlphaVantage listing of US stock symbols.
+"""
+
+import csv
+import datetime
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+import fetch_engine
+import rate_limiter
+
+
+logger = logging.getLogger(__name__)
+
+
+class SymbolUniverse:
+    url = 'https://www.alphavantage.co/query'
+
+    # Maps the LISTING_STATUS CSV header to the keys of a listing
+    listing_columns = {'symbol': 'symbol',
+                       'name': 'name',
+                       'exchange': 'exchange',
+                       'assetType': 'asset_type',
+                       'ipoDate': 'ipo_date',
+                       'delistingDate': 'delisting_date',
+                       'status': 'status'}
+
+    def __init__(self, engine: fetch_engine.FetchEngine, cache_path: Optional[str] = None, ttl: Optional[datetime.timedelta] = None):
+        """
+        Args:
+            engine (fetch_engine.FetchEngine): The engine the AlphaVantage request is retried and rate limited through.
+            cache_path (str, optional): The JSON file the listing is cached in. Defaults to the SYMBOL_CACHE_PATH
+                environment variable, or symbol_universe.json.
+            ttl (datetime.timedelta, optional): How long a cached listing is used before it is refreshed. Defaults to
+                the SYMBOL_CACHE_TTL_HOURS environment variable, or 24 hours.
+        """
+        self._engine = engine
+        self._cache_path = cache_path if cache_path is not None else os.getenv('SYMBOL_CACHE_PATH', 'symbol_universe.json')
+        self._ttl = ttl if ttl is not None else datetime.timedelta(hours=float(os.getenv('SYMBOL_CACHE_TTL_HOURS', 24)))
+
+    def get_symbols(self) -> List[str]:
+        """
+        Retrieves the currently listed symbols. Symbols delisted since the last refresh are not included.
+
+        Returns:
+            List[str]: The list of stock symbols
+        """
+        return [listing['symbol'] for listing in self.get_listings()]
+
+    def get_listings(self) -> List[Dict[str, str]]:
+        """
+        Retrieves the current listing, from the cache if it is younger than the TTL and from AlphaVantage
+        otherwise. If the refresh fails, a stale cache is used rather than failing the run.
+
+        Returns:
+            List[Dict[str, str]]: One dict per listed symbol, with symbol, name, exchange, asset_type, ipo_date,
+                delisting_date and status keys
+        """
+        cache = self._load_cache()
+        if cache is not None and datetime.datetime.now() - datetime.datetime.fromisoformat(cache['fetched_at']) < self._ttl:
+            logger.info(f'Using {len(cache["listings"])} cached symbols from {self._cache_path}')
+            return cache['listings']
+
+        try:
+            cache = self.refresh(cache)
+        except Exception as e:
+            if cache is None:
+                raise
+            logger.warning(f'!!!WARNING: could not refresh the list of symbols, using the cache from {cache["fetched_at"]}: {e}')
+        return cache['listings']
+
+    def refresh(self, cache: Optional[dict] = None) -> dict:
+        """
+        Downloads the listing from AlphaVantage, diffs it against the cached one and rewrites the cache.
+        The request is conditional on the validators of the cached response, if the server sent any.
+
+        Args:
+            cache (dict, optional): The current cache contents, if there is a cache.
+
+        Returns:
+            dict: The new cache contents
+        """
+        logger.info('Getting list of stock symbols')
+
+        params = {'function': 'LISTING_STATUS',
+                  'apikey': os.getenv('ALPHAVANTAGE_API_KEY')}
+        headers = {}
+        if cache is not None and cache.get('etag'):
+            headers['If-None-Match'] = cache['etag']
+        if cache is not None and cache.get('last_modified'):
+            headers['If-Modified-Since'] = cache['last_modified']
+
+        with requests.Session() as s:
+            download = self._engine.call_with_retry('list of stock symbols', lambda: self._get_listing_status(s, params, headers))
+
+        now = datetime.datetime.now()
+        if download.status_code == 304:
+            logger.info('List of stock symbols is unchanged')
+            cache['fetched_at'] = now.isoformat()
+            self._save_cache(cache)
+            return cache
+
+        listings = self.parse_listing_status(download.content.decode('utf-8'))
+        new_cache = {'fetched_at': now.isoformat(),
+                     'etag': download.headers.get('ETag'),
+                     'last_modified': download.headers.get('Last-Modified'),
+                     'listings': listings,
+                     'delisted': {} if cache is None else cache.get('delisted', {})}
+
+        if cache is not None:
+            listed, delisted = self.diff(cache['listings'], listings)
+            logger.info(f'{len(listed)} symbols newly listed, {len(delisted)} symbols delisted since {cache["fetched_at"]}')
+            for symbol in listed:
+                new_cache['delisted'].pop(symbol, None)
+            for symbol in delisted:
+                new_cache['delisted'][symbol] = now.date().isoformat()
+
+        logger.info(f'Retrieved {len(listings)} symbols')
+        self._save_cache(new_cache)
+        return new_cache
+
+    def _get_listing_status(self, session: requests.Session, params: dict, headers: dict) -> requests.Response:
+        """
+        Makes the AlphaVantage LISTING_STATUS request. AlphaVantage reports exhausted quota with a JSON
+        note instead of an HTTP 429, so that case is raised as a rate-limit error for the limiter to see.
+        """
+        download = session.get(self.url, params=params, headers=headers)
+        download.raise_for_status()
+        if download.content.lstrip().startswith(b'{'):
+            message = download.json()
+            if 'Note' in message or 'Information' in message:
+                raise rate_limiter.RateLimitedError(f'AlphaVantage rate limited the request: {message}')
+            raise ValueError(f'AlphaVantage rejected the request: {message}')
+        return download
+
+    @classmethod
+    def parse_listing_status(cls, content: str) -> List[Dict[str, str]]:
+        """
+        Parses the LISTING_STATUS CSV.
+
+        Args:
+            content (str): The CSV text, including its header row.
+
+        Returns:
+            List[Dict[str, str]]: One dict per row
+        """
+        listings = []
+        for row in csv.DictReader(content.splitlines(), delimiter=','):
+            listings.append({key: row.get(column) for column, key in cls.listing_columns.items()})
+        return listings
+
+    @staticmethod
+    def diff(old_listings: List[Dict[str, str]], new_listings: List[Dict[str, str]]) -> Tuple[List[str], List[str]]:
+        """
+        Compares two listings.
+
+        Args:
+            old_listings (List[Dict[str, str]]): The previous listing.
+            new_listings (List[Dict[str, str]]): The current listing.
+
+        Returns:
+            Tuple[List[str], List[str]]: The symbols that were newly listed and the symbols that were delisted
+        """
+        old_symbols = {listing['symbol'] for listing in old_listings}
+        new_symbols = {listing['symbol'] for listing in new_listings}
+        listed = sorted(new_symbols - old_symbols)
+        delisted = sorted(old_symbols - new_symbols)
+        return listed, delisted
+
+    def get_delisted(self) -> Dict[str, str]:
+        """
+        Returns:
+            Dict[str, str]: The symbols seen to be delisted, with the ISO date they dropped out of the listing
+        """
+        cache = self._load_cache()
+        return {} if cache is None else cache.get('delisted', {})
+
+    def _load_cache(self) -> Optional[dict]:
+        if not os.path.exists(self._cache_path):
+            return None
+        try:
+            with open(self._cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f'!!!WARNING: ignoring unreadable symbol cache {self._cache_path}: {e}')
+            return None
+
+    def _save_cache(self, cache: dict):
+        temporary_path = self._cache_path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(cache, f)
+        os.replace(temporary_path, self._cache_path)
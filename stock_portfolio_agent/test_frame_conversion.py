@@ -0,0 +1,51 @@
+
+"""
+Checks that frame_conversion.isoformat_dates formats dates exactly as the per-row strftime it replaced, and
+as Timestamp.isoformat, so that the ids of stored stock prices do not change.
+
+Examples:
+    python -m pytest test_frame_conversion.py
+"""
+
+import pandas as pd
+import pytest
+
+import frame_conversion
+
+
+def strftime_isoformat_dates(dates: pd.Series) -> pd.Series:
+    # The implementation isoformat_dates replaced
+    text = dates.dt.strftime('%Y-%m-%dT%H:%M:%S')
+    if dates.dt.tz is not None:
+        offset = dates.dt.strftime('%z')
+        text = text + offset.str[:3] + ':' + offset.str[3:]
+    return text
+
+
+DATES = {
+    'naive': pd.Series(pd.date_range('2024-03-08 21:00', '2024-03-11 03:00', freq='h')),
+    'new_york_spring_forward': pd.Series(pd.date_range('2024-03-09', '2024-03-12', freq='h', tz='America/New_York')),
+    'new_york_fall_back': pd.Series(pd.date_range('2024-11-02', '2024-11-05', freq='h', tz='America/New_York')),
+    'new_york_daily_bars': pd.Series(pd.bdate_range('2023-01-02', '2024-12-31', tz='America/New_York')),
+    'kolkata': pd.Series(pd.date_range('2024-01-01 09:15:00', periods=48, freq='37min', tz='Asia/Kolkata')),
+    'st_johns': pd.Series(pd.date_range('2024-03-09', '2024-03-12', freq='h', tz='America/St_Johns')),
+    'utc': pd.Series(pd.date_range('1999-12-31 23:00', periods=3, freq='h', tz='UTC')),
+}
+
+
+@pytest.mark.parametrize('name', sorted(DATES))
+def test_matches_strftime(name):
+    dates = DATES[name]
+    pd.testing.assert_series_equal(frame_conversion.isoformat_dates(dates), strftime_isoformat_dates(dates),
+                                   check_dtype=False)
+
+
+@pytest.mark.parametrize('name', sorted(DATES))
+def test_matches_timestamp_isoformat(name):
+    dates = DATES[name]
+    assert list(frame_conversion.isoformat_dates(dates)) == [timestamp.isoformat() for timestamp in dates]
+
+
+def test_keeps_index():
+    dates = DATES['kolkata'].set_axis(range(100, 100 + len(DATES['kolkata'])))
+    assert list(frame_conversion.isoformat_dates(dates).index) == list(dates.index)
@@ -0,0 +1,145 @@
+
+"""
+This module contains the NYSE trading calendar, computed locally from the exchange's holiday rules,
+so that the downloaders can tell which dates can have new daily bars without asking the network.
+"""
+
+import datetime
+import functools
+from typing import FrozenSet, List, Optional, Tuple
+
+
+# Closures outside the regular holiday rules: national days of mourning, 9/11 and Hurricane Sandy
+SPECIAL_CLOSURES = frozenset([datetime.date(1994, 4, 27),
+                              datetime.date(2001, 9, 11),
+                              datetime.date(2001, 9, 12),
+                              datetime.date(2001, 9, 13),
+                              datetime.date(2001, 9, 14),
+                              datetime.date(2004, 6, 11),
+                              datetime.date(2007, 1, 2),
+                              datetime.date(2012, 10, 29),
+                              datetime.date(2012, 10, 30),
+                              datetime.date(2018, 12, 5),
+                              datetime.date(2025, 1, 9)])
+
+
+def _easter(year: int) -> datetime.date:
+    # The anonymous Gregorian algorithm
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> datetime.date:
+    first = datetime.date(year, month, 1)
+    return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def _last_weekday(year: int, month: int, weekday: int) -> datetime.date:
+    last = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day: datetime.date) -> Optional[datetime.date]:
+    # A holiday on a Saturday is observed on the Friday before and one on a Sunday on the Monday after,
+    # except that New Year's Day on a Saturday is not observed at all, as that Friday closes a year
+    if day.weekday() == 5:
+        return None if (day.month, day.day) == (1, 1) else day - datetime.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + datetime.timedelta(days=1)
+    return day
+
+
+@functools.lru_cache(maxsize=None)
+def holidays(year: int) -> FrozenSet[datetime.date]:
+    """
+    Computes the NYSE full-day holidays of a year.
+
+    Args:
+        year (int): The calendar year.
+
+    Returns:
+        FrozenSet[datetime.date]: The weekdays of the year the exchange is closed
+    """
+    days = [_observed(datetime.date(year, 1, 1)),
+            _nth_weekday(year, 2, 0, 3),
+            _easter(year) - datetime.timedelta(days=2),
+            _last_weekday(year, 5, 0),
+            _observed(datetime.date(year, 7, 4)),
+            _nth_weekday(year, 9, 0, 1),
+            _nth_weekday(year, 11, 3, 4),
+            _observed(datetime.date(year, 12, 25))]
+    if year >= 1998:
+        days.append(_nth_weekday(year, 1, 0, 3))
+    if year >= 2022:
+        days.append(_observed(datetime.date(year, 6, 19)))
+    days.extend(day for day in SPECIAL_CLOSURES if day.year == year)
+    return frozenset(day for day in days if day is not None)
+
+
+def is_trading_day(day: datetime.date) -> bool:
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def previous_trading_day(day: datetime.date) -> datetime.date:
+    """
+    Returns:
+        datetime.date: The last trading day strictly before day. For a run on day, this is the latest date with a
+            complete daily bar.
+    """
+    day -= datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day -= datetime.timedelta(days=1)
+    return day
+
+
+def next_trading_day(day: datetime.date) -> datetime.date:
+    """
+    Returns:
+        datetime.date: The first trading day strictly after day
+    """
+    day += datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day += datetime.timedelta(days=1)
+    return day
+
+
+def trading_days(start: datetime.date, end: datetime.date) -> List[datetime.date]:
+    """
+    Returns:
+        List[datetime.date]: The trading days from start up to but excluding end
+    """
+    days = []
+    day = start
+    while day < end:
+        if is_trading_day(day):
+            days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def missing_range(last_date: datetime.date, today: datetime.date) -> Optional[Tuple[datetime.date, datetime.date]]:
+    """
+    Computes the dates still to download for a symbol whose bars are stored through last_date, with a download
+    ending before today, since today's bar is not complete.
+
+    Args:
+        last_date (datetime.date): The last date stored.
+        today (datetime.date): The current date.
+
+    Returns:
+        Optional[Tuple[datetime.date, datetime.date]]: The first trading day to download and the exclusive end date,
+            or None if there is no complete trading day after last_date
+    """
+    start = next_trading_day(last_date)
+    if start >= today:
+        return None
+    return start, today
@@ -0,0 +1,132 @@
+
+import datetime
+import threading
+from database_base import Base
+import database_actions
+from sqlalchemy import String, Date, DateTime, Connection, Table, func, select
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class IngestWatermark(Base):
+    __tablename__ = "ingest_watermark"
+    __table_args__ = {"schema": database_actions.DatabaseActions.raw_schema_name}
+
+    dataset: Mapped[str] = mapped_column(String(32), primary_key=True)
+    symbol: Mapped[str] = mapped_column(String(10), primary_key=True)
+    last_date: Mapped[datetime.date] = mapped_column(Date)
+    updated_at: Mapped[datetime.datetime] = mapped_column(DateTime)
+
+    def __repr__(self) -> str:
+        return f"IngestWatermark(dataset={self.dataset}, symbol={self.symbol}, last_date={self.last_date})"
+
+
+class WatermarkStore:
+    """
+    Holds the last ingested date of each symbol of a dataset. The watermarks are read from
+    raw_data.ingest_watermark once per run and kept in memory; record updates the table in the same
+    transaction as the rows it covers, so the table never runs ahead of the data.
+    """
+
+    def __init__(self, db_actions: database_actions.DatabaseActions, dataset: str, table: Table):
+        """
+        Args:
+            db_actions (database_actions.DatabaseActions): An instance of DatabaseActions for connecting to the database
+            dataset (str): The dataset the watermarks belong to, e.g. 'stock_price'.
+            table (Table): The table of the dataset, with symbol and date columns. Used to seed the watermarks
+                the first time the dataset is seen.
+        """
+        self._db_actions = db_actions
+        self.dataset = dataset
+        self._table = table
+        self._watermarks: Optional[Dict[str, datetime.date]] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, datetime.date]:
+        """
+        Retrieves the watermarks, reading them from the database on the first call only. If the dataset has
+        no watermarks yet, they are seeded from MAX(date) of its table, which scans the table once.
+
+        Returns:
+            Dict[str, datetime.date]: The last ingested date of each symbol
+        """
+        with self._lock:
+            if self._watermarks is not None:
+                return self._watermarks
+
+            watermark_table = IngestWatermark.__table__
+            query = select(watermark_table.c.symbol, watermark_table.c.last_date).where(watermark_table.c.dataset == self.dataset)
+            with self._db_actions.get_engine().connect() as conn:
+                watermarks = {r[0]: r[1] for r in conn.execute(query).all()}
+
+            if len(watermarks) == 0:
+                seed = select(self._table.c.symbol, func.max(self._table.c.date)).group_by(self._table.c.symbol)
+                with self._db_actions.get_engine().begin() as conn:
+                    watermarks = {r[0]: r[1] for r in conn.execute(seed).all() if r[1] is not None}
+                    self._write(conn, watermarks)
+
+            self._watermarks = watermarks
+            return self._watermarks
+
+    def get_many(self, symbols: List[str]) -> Dict[str, datetime.date]:
+        """
+        Args:
+            symbols (List[str]): The symbols to look up.
+
+        Returns:
+            Dict[str, datetime.date]: The last ingested date of each symbol that has one
+        """
+        watermarks = self.load()
+        with self._lock:
+            return {symbol: watermarks[symbol] for symbol in symbols if symbol in watermarks}
+
+    def get_stale_symbols(self, symbols: List[str], current_date: datetime.date) -> List[str]:
+        """
+        Filters out the symbols that are already ingested through current_date.
+
+        Args:
+            symbols (List[str]): The symbols of the run.
+            current_date (datetime.date): The latest date there can be data for, e.g. the last trading day.
+
+        Returns:
+            List[str]: The symbols with no watermark or one older than current_date, in the order of symbols
+        """
+        watermarks = self.get_many(symbols)
+        return [symbol for symbol in symbols if symbol not in watermarks or watermarks[symbol] < current_date]
+
+    def record(self, connection: Connection, batch: 'pd.DataFrame'):
+        """
+        Advances the watermarks of the symbols in a batch to the latest date written for them. Meant to be
+        passed as the on_batch hook of a pipeline.StreamingWriter, so it shares the transaction that writes the batch.
+
+        Args:
+            connection (Connection): The connection whose transaction writes the batch.
+            batch (pd.DataFrame): The rows written, with symbol and date columns.
+        """
+        if len(batch) == 0:
+            return
+
+        watermarks = self.load()
+        latest = {}
+        for symbol, last_date in batch.groupby('symbol')['date'].max().items():
+            last_date = last_date.date() if isinstance(last_date, datetime.datetime) else last_date
+            with self._lock:
+                if symbol not in watermarks or watermarks[symbol] < last_date:
+                    latest[symbol] = last_date
+
+        self._write(connection, latest)
+        with self._lock:
+            watermarks.update(latest)
+
+    def _write(self, connection: Connection, watermarks: Dict[str, datetime.date]):
+        now = datetime.datetime.now()
+        rows = [{'dataset': self.dataset,
+                 'symbol': symbol,
+                 'last_date': last_date,
+                 'updated_at': now} for symbol, last_date in watermarks.items()]
+        self._db_actions.bulk_load(IngestWatermark.__table__, rows, connection=connection,
+                                   on_conflict=database_actions.DatabaseActions.ON_CONFLICT_UPDATE)